@@ -1,5 +1,6 @@
 from fastapi import APIRouter
 
+from .metrics import router as metrics_router
 from .v1 import api_router as api_v1_router
 
 
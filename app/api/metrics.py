@@ -0,0 +1,193 @@
+import asyncio
+import os
+import secrets
+from typing import Callable, Iterator, Optional, Union
+
+from aioredis import Redis
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from prometheus_client import (
+    CollectorRegistry,
+    CONTENT_TYPE_LATEST,
+    Counter,
+    Gauge,
+    generate_latest,
+    REGISTRY
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.multiprocess import mark_process_dead, MultiProcessCollector
+from starlette.responses import Response
+from starlette.status import HTTP_401_UNAUTHORIZED
+
+from ..core import settings
+from ..core.hashing import get_hashing_stats
+from ..core.metrics import MULTIPROCESS
+from ..database.session import (
+    get_async_db_pool_stats,
+    get_redis_pool_stats,
+    get_redis_session
+)
+from ..services.auth import get_token_cache_stats
+from ..services.outbox import get_outbox_stats
+from ..services.rate_limit import get_rate_limit_stats
+
+
+router = APIRouter()
+metrics_scheme = HTTPBearer(auto_error=False)
+
+# the numbers which only grow, the others are exposed as gauges
+COUNTERS = {
+    'connects',
+    'checkouts',
+    'checkins',
+    'completed',
+    'failed',
+    'rejected',
+    'hits',
+    'misses',
+    'allowed',
+    'limited',
+    'failed_open',
+    'processed',
+}
+
+STATS_EXPORT_INTERVAL = 5
+
+_stats_export_task: Optional[asyncio.Task] = None
+
+
+class StatsCollector:
+
+    def __init__(self, stats: dict[str, Callable[[], dict]]):
+        self.stats = stats
+
+    def collect(self) -> Iterator:
+        for prefix, get_stats in self.stats.items():
+            for name, value in get_stats().items():
+                if name in COUNTERS:
+                    yield CounterMetricFamily(f'{prefix}_{name}', name, value=value)
+                else:
+                    yield GaugeMetricFamily(f'{prefix}_{name}', name, value=value)
+
+
+class MultiProcessStats:
+    # the stats of a worker are copied to the multiprocess files from time
+    # to time, a scrape only runs in one of the workers
+
+    def __init__(self, stats: dict[str, Callable[[], dict]]):
+        self.stats = stats
+        self.metrics: dict[str, Union[Counter, Gauge]] = {}
+        self.totals: dict[str, int] = {}
+
+    def export(self) -> None:
+        for prefix, get_stats in self.stats.items():
+            for name, value in get_stats().items():
+                metric_name = f'{prefix}_{name}'
+                metric = self.metrics.get(metric_name)
+
+                if name in COUNTERS:
+                    if metric is None:
+                        metric = Counter(metric_name, name, registry=None)
+                    # the counters of a process only grow, its files keep
+                    # the sum of the increments
+                    metric.inc(max(value - self.totals.get(metric_name, 0), 0))
+                    self.totals[metric_name] = value
+                else:
+                    if metric is None:
+                        metric = Gauge(
+                            metric_name,
+                            name,
+                            registry=None,
+                            multiprocess_mode='livesum'
+                        )
+                    metric.set(value)
+
+                self.metrics[metric_name] = metric
+
+
+STATS = {
+    'db_pool': get_async_db_pool_stats,
+    'redis_pool': get_redis_pool_stats,
+    'password_hashing': get_hashing_stats,
+    'token_cache': get_token_cache_stats,
+    'rate_limit': get_rate_limit_stats,
+}
+
+if MULTIPROCESS:
+    multi_process_stats = MultiProcessStats(STATS)
+else:
+    REGISTRY.register(StatsCollector(STATS))
+
+
+async def _export_stats() -> None:
+    while True:
+        multi_process_stats.export()
+        await asyncio.sleep(STATS_EXPORT_INTERVAL)
+
+
+async def start_stats_export() -> None:
+    global _stats_export_task
+
+    if _stats_export_task is None:
+        _stats_export_task = asyncio.create_task(_export_stats())
+
+
+async def stop_stats_export() -> None:
+    global _stats_export_task
+
+    if _stats_export_task is not None:
+        _stats_export_task.cancel()
+        try:
+            await _stats_export_task
+        except asyncio.CancelledError:
+            pass
+
+    _stats_export_task = None
+    # the live gauges of a stopped worker are no longer summed
+    mark_process_dead(os.getpid())
+
+
+def get_registry() -> CollectorRegistry:
+    if not MULTIPROCESS:
+        return REGISTRY
+
+    registry = CollectorRegistry()
+    MultiProcessCollector(registry)
+
+    return registry
+
+
+def check_metrics_token(
+        credentials: Optional[HTTPAuthorizationCredentials] = Depends(metrics_scheme)
+) -> None:
+    # the metrics expose the internals, only the scrapers may read them
+    token = credentials.credentials if credentials is not None else ''
+    is_valid_token = bool(settings.METRICS_TOKEN) and secrets.compare_digest(
+        token.encode(),
+        settings.METRICS_TOKEN.encode()
+    )
+
+    if not is_valid_token:
+        exception = HTTPException(
+            status_code=HTTP_401_UNAUTHORIZED,
+            detail='Could not validate credentials',
+            headers={'WWW-Authenticate': 'Bearer'}
+        )
+        raise exception from None
+
+
+@router.get(
+    '/metrics',
+    include_in_schema=False,
+    dependencies=[Depends(check_metrics_token), ],
+)
+async def metrics(redis_session: Redis = Depends(get_redis_session)):
+    # the outbox workers run in their own processes, they share their stats
+    # through redis
+    outbox_stats = await get_outbox_stats(redis_session)
+    outbox_collector = StatsCollector({'outbox': lambda: outbox_stats})
+
+    return Response(
+        generate_latest(get_registry()) + generate_latest(outbox_collector),
+        media_type=CONTENT_TYPE_LATEST
+    )
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from fastapi import APIRouter, Depends, status
 from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordRequestForm
@@ -5,6 +7,8 @@ from fastapi.security import OAuth2PasswordRequestForm
 from ... import schemas
 from ...core import settings
 from ...services.auth import AuthService, get_user, oauth2_scheme
+from ...services.availability import AvailabilityService
+from ...services.rate_limit import RateLimiter
 
 
 router = APIRouter(
@@ -17,6 +21,7 @@ router = APIRouter(
     '/sign-up',
     response_model=schemas.RefreshToken,
     status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(RateLimiter('sign_up')), ],
 )
 async def sign_up(
     user_data: schemas.UserCreate,
@@ -39,6 +44,7 @@ async def sign_up(
 @router.post(
     '/sign-in',
     response_model=schemas.RefreshToken,
+    dependencies=[Depends(RateLimiter('sign_in')), ],
 )
 async def sign_in(
     auth_data: OAuth2PasswordRequestForm = Depends(),
@@ -86,5 +92,21 @@ async def get_refresh_token(
     '/user',
     response_model=schemas.User,
 )
-async def get_user(user: str = Depends(get_user)):
-    return user
+async def get_user(
+        user: schemas.Principal = Depends(get_user),
+        auth_service: AuthService = Depends()
+):
+    return await auth_service.get_profile(user)
+
+
+@router.get(
+    '/availability',
+    response_model=schemas.Availability,
+    dependencies=[Depends(RateLimiter('availability')), ],
+)
+async def get_availability(
+        username: Optional[str] = None,
+        email: Optional[str] = None,
+        availability_service: AvailabilityService = Depends()
+):
+    return await availability_service.check(username, email)
@@ -4,6 +4,7 @@ from fastapi.responses import JSONResponse
 from ... import schemas
 from ...services.auth import get_user
 from ...services.blog_post import BlogPostService
+from ...services.rate_limit import UserRateLimiter
 
 
 router = APIRouter(
@@ -16,10 +17,11 @@ router = APIRouter(
     '/posts/create',
     response_model=schemas.BlogPost,
     status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(UserRateLimiter('create_post')), ],
 )
 async def create_blog_post(
     user_data: schemas.BlogPostCreate,
-    user: schemas.User = Depends(get_user),
+    user: schemas.Principal = Depends(get_user),
     blog_post_service: BlogPostService = Depends(),
 ):
     return await blog_post_service.create_blog_post(user, user_data)
@@ -33,7 +35,7 @@ async def update_blog_post(
     username: str,
     post_id: int,
     user_data: schemas.BlogPostUpdate,
-    user: schemas.User = Depends(get_user),
+    user: schemas.Principal = Depends(get_user),
     blog_post_service: BlogPostService = Depends(),
 ):
     return await blog_post_service.update_blog_post(user, user_data, post_id)
@@ -45,7 +47,7 @@ async def update_blog_post(
 async def archive_blog_post(
     username: str,
     post_id: int,
-    user: schemas.User = Depends(get_user),
+    user: schemas.Principal = Depends(get_user),
     blog_post_service: BlogPostService = Depends(),
 ):
     _ = await blog_post_service.archive_blog_post(user, post_id)
@@ -58,7 +60,7 @@ async def archive_blog_post(
 async def delete_blog_post(
     username: str,
     post_id: int,
-    user: schemas.User = Depends(get_user),
+    user: schemas.Principal = Depends(get_user),
     blog_post_service: BlogPostService = Depends(),
 ):
     _ = await blog_post_service.delete_blog_post(user, post_id)
@@ -71,7 +73,7 @@ async def delete_blog_post(
 async def create_blog_post_repost(
     username: str,
     post_id: int,
-    user: schemas.User = Depends(get_user),
+    user: schemas.Principal = Depends(get_user),
     blog_post_service: BlogPostService = Depends(),
 ):
     _ = await blog_post_service.create_blog_post_repost(user, post_id)
@@ -84,7 +86,7 @@ async def create_blog_post_repost(
 async def delete_blog_post_repost(
     username: str,
     post_id: int,
-    user: schemas.User = Depends(get_user),
+    user: schemas.Principal = Depends(get_user),
     blog_post_service: BlogPostService = Depends(),
 ):
     _ = await blog_post_service.delete_blog_post_repost(user, post_id)
@@ -97,7 +99,7 @@ async def delete_blog_post_repost(
 async def add_blog_post_like(
     username: str,
     post_id: int,
-    user: schemas.User = Depends(get_user),
+    user: schemas.Principal = Depends(get_user),
     blog_post_service: BlogPostService = Depends(),
 ):
     _ = await blog_post_service.add_blog_post_like(user, username, post_id)
@@ -110,7 +112,7 @@ async def add_blog_post_like(
 async def remove_blog_post_like(
     username: str,
     post_id: int,
-    user: schemas.User = Depends(get_user),
+    user: schemas.Principal = Depends(get_user),
     blog_post_service: BlogPostService = Depends(),
 ):
     _ = await blog_post_service.remove_blog_post_like(user, post_id)
@@ -18,7 +18,7 @@ router = APIRouter(
 )
 async def follow_user(
     username: str,
-    user: schemas.User = Depends(get_user),
+    user: schemas.Principal = Depends(get_user),
     follower_service: FollowerService = Depends(),
 ):
     _ = await follower_service.follow_user(user, username)
@@ -30,7 +30,7 @@ async def follow_user(
 )
 async def unfollow_user(
     username: str,
-    user: schemas.User = Depends(get_user),
+    user: schemas.Principal = Depends(get_user),
     follower_service: FollowerService = Depends(),
 ):
     _ = await follower_service.unfollow_user(user, username)
@@ -1,4 +1,6 @@
-from fastapi import APIRouter, Depends
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query, Response
 
 from ... import schemas
 from ...services.auth import get_user
@@ -16,7 +18,16 @@ router = APIRouter(
     response_model=list[schemas.HomeBlogPost]
 )
 async def home(
-    user: schemas.User = Depends(get_user),
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=100),
+    mode: schemas.HomeMode = schemas.HomeMode.timeline,
+    user: schemas.Principal = Depends(get_user),
     home_service: HomeService = Depends(),
 ):
-    return await home_service.home(user)
+    blog_posts, next_cursor = await home_service.home(user, cursor, limit, mode)
+
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+
+    return blog_posts
@@ -3,6 +3,16 @@ from pydantic import BaseSettings
 
 class Settings(BaseSettings):
     DEBUG: bool = False
+    METRICS_ENABLED: bool = True
+    # the scrapers send it as a bearer token, /metrics is closed while empty
+    METRICS_TOKEN: str = ''
+    # console, file or a registered exporter, empty disables the tracing
+    TRACING_EXPORTER: str = ''
+    TRACING_SAMPLE_RATE: float = 0.01
+    TRACING_FILE: str = 'traces.ndjson'
+    # the sampled flag of the traceparent header is only followed when the
+    # callers are trusted, e.g. behind a gateway which sets the header
+    TRACING_TRUST_TRACEPARENT: bool = False
     PYTHONPATH: str
 
     SQLALCHEMY_DATABASE_URL: str
@@ -11,12 +21,49 @@ class Settings(BaseSettings):
     SQLALCHEMY_TEST_DATABASE_URL: str
     REDIS_TEST_DATABASE_URL: str
 
+    SQLALCHEMY_POOL_SIZE: int = 5
+    SQLALCHEMY_MAX_OVERFLOW: int = 10
+    SQLALCHEMY_POOL_TIMEOUT: int = 30  # 30 sec.
+    SQLALCHEMY_POOL_RECYCLE: int = 60 * 30  # 30 min.
+    SQLALCHEMY_POOL_PRE_PING: bool = True
+
+    REDIS_POOL_MINSIZE: int = 1
+    REDIS_POOL_MAXSIZE: int = 10
+
     BLOG_POST_EDITED_TIME_LIMIT: int = 60 * 60 * 24  # 24 h.
 
+    # likes are buffered in redis and applied by app.tools.flush_likes
+    LIKES_WRITE_BEHIND: bool = False
+
+    HOME_TIMELINE_MAX_SIZE: int = 800
+    HOME_TIMELINE_EXPIRES: int = 60 * 60 * 24 * 7  # 7 days
+    # timelines are updated by app.tools.outbox_worker instead of the request
+    TIMELINE_FAN_OUT_IN_WORKER: bool = False
+
+    PASSWORD_HASHING_EXECUTOR: str = 'thread'  # thread or process
+    PASSWORD_HASHING_WORKERS: int = 4
+    PASSWORD_HASHING_MAX_QUEUE: int = 100
+
     JWT_SECRET_KEY: str
     JWT_ALGORITHM: str = 'HS256'
     JWT_ACCESS_TOKEN_EXPIRES: int = 60 * 60  # 1 h.
     JWT_REFRESH_TOKEN_EXPIRES: int = 60 * 60 * 24  # 24 h.
+    REFRESH_TOKEN_MAX_SESSIONS: int = 10
+    # tokens with the whole serialized user, issued by older releases, only
+    # enable it for JWT_REFRESH_TOKEN_EXPIRES after upgrading from them
+    JWT_ACCEPT_LEGACY_TOKENS: bool = False
+
+    TOKEN_CACHE_MAX_SIZE: int = 10000
+
+    USER_FILTER_CAPACITY: int = 1_000_000
+    USER_FILTER_ERROR_RATE: float = 0.01
+
+    # requests/seconds, the requests are also the allowed burst
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_SIGN_IN: str = '10/60'  # per ip
+    RATE_LIMIT_SIGN_UP: str = '10/60'  # per ip
+    RATE_LIMIT_AVAILABILITY: str = '30/60'  # per ip
+    RATE_LIMIT_CREATE_POST: str = '30/60'  # per user
 
 
 settings = Settings()
@@ -0,0 +1,98 @@
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from passlib.hash import bcrypt
+
+from .config import settings
+
+
+# bcrypt costs 100-300 ms of cpu per call, so it runs in a bounded pool
+# instead of the event loop. Calls over the queue limit are rejected, a
+# burst of sign-ins then fails fast instead of stalling other requests.
+
+_executor: Optional[Executor] = None
+_stats = {'in_flight': 0, 'completed': 0, 'failed': 0, 'rejected': 0}
+
+
+class HashingQueueFull(RuntimeError):
+    pass
+
+
+def hash_password_sync(plain_password: str) -> str:
+    # for the callers which run their own pool, e.g. the bulk load
+    return bcrypt.hash(plain_password)
+
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return bcrypt.verify(plain_password, hashed_password)
+
+
+def get_executor() -> Executor:
+    global _executor
+
+    if _executor is None:
+        if settings.PASSWORD_HASHING_EXECUTOR == 'process':
+            _executor = ProcessPoolExecutor(settings.PASSWORD_HASHING_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(
+                settings.PASSWORD_HASHING_WORKERS,
+                thread_name_prefix='password-hashing'
+            )
+
+    return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+
+    _executor = None
+
+
+def get_hashing_stats() -> dict[str, int]:
+    workers = settings.PASSWORD_HASHING_WORKERS
+    in_flight = _stats['in_flight']
+
+    return {
+        'workers': workers,
+        'max_queue': settings.PASSWORD_HASHING_MAX_QUEUE,
+        'running': min(in_flight, workers),
+        'queued': max(in_flight - workers, 0),
+        'completed': _stats['completed'],
+        'failed': _stats['failed'],
+        'rejected': _stats['rejected'],
+    }
+
+
+async def _run(func: Callable, *args):
+    # the counters are only updated on the event loop, no lock is needed
+    limit = settings.PASSWORD_HASHING_WORKERS + settings.PASSWORD_HASHING_MAX_QUEUE
+
+    if _stats['in_flight'] >= limit:
+        _stats['rejected'] += 1
+        raise HashingQueueFull()
+
+    _stats['in_flight'] += 1
+    try:
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(get_executor(), func, *args)
+    except Exception:
+        _stats['failed'] += 1
+        raise
+    finally:
+        _stats['in_flight'] -= 1
+
+    _stats['completed'] += 1
+
+    return result
+
+
+async def hash_password(plain_password: str) -> str:
+    return await _run(hash_password_sync, plain_password)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await _run(_verify, plain_password, hashed_password)
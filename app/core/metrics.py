@@ -0,0 +1,244 @@
+import asyncio
+import os
+import time
+from bisect import bisect_left
+from itertools import accumulate
+from typing import Any, Iterator, Optional
+
+import prometheus_client
+from prometheus_client import Gauge, REGISTRY
+from prometheus_client.core import GaugeMetricFamily, HistogramMetricFamily
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+# Prometheus metrics of an api worker, every worker process exposes its own
+# numbers on /metrics. The metrics below are only updated on the event loop,
+# so unlike the prometheus_client ones they need no lock: an observation is
+# a bisect and two additions. The gauges of the pools and caches are read
+# at scrape time.
+#
+# uvicorn --workers runs processes which don't share memory. With
+# PROMETHEUS_MULTIPROC_DIR set, the metrics are prometheus_client ones
+# instead, they are written to the files of its multiprocess mode and
+# summed over the workers at scrape time.
+
+MULTIPROCESS = 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+
+
+class Histogram:
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labels: tuple[str, ...],
+            buckets: tuple[float, ...]
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        # label values: counts per bucket (the last one is +Inf) and sum
+        self.series: dict[tuple, list] = {}
+
+    def observe(self, labels: tuple, value: float) -> None:
+        series = self.series.get(labels)
+
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def collect(self) -> Iterator[HistogramMetricFamily]:
+        family = HistogramMetricFamily(
+            self.name,
+            self.documentation,
+            labels=self.labels
+        )
+
+        for labels, (counts, total) in list(self.series.items()):
+            cumulative = list(accumulate(counts))
+            buckets = [
+                (str(bucket), count)
+                for bucket, count in zip(self.buckets, cumulative)
+            ]
+            buckets.append(('+Inf', cumulative[-1]))
+            family.add_metric([str(i) for i in labels], buckets, total)
+
+        yield family
+
+
+class InFlightGauge:
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0
+
+    def inc(self) -> None:
+        self.value += 1
+
+    def dec(self) -> None:
+        self.value -= 1
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        yield GaugeMetricFamily(self.name, self.documentation, value=self.value)
+
+
+class MultiProcessHistogram:
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labels: tuple[str, ...],
+            buckets: tuple[float, ...]
+    ):
+        self.metric = prometheus_client.Histogram(
+            name,
+            documentation,
+            labels,
+            buckets=buckets,
+            registry=None
+        )
+
+    def observe(self, labels: tuple, value: float) -> None:
+        if labels:
+            self.metric.labels(*labels).observe(value)
+        else:
+            self.metric.observe(value)
+
+
+def create_histogram(
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...],
+        buckets: tuple[float, ...]
+):
+    if MULTIPROCESS:
+        return MultiProcessHistogram(name, documentation, labels, buckets)
+
+    histogram = Histogram(name, documentation, labels, buckets)
+    REGISTRY.register(histogram)
+
+    return histogram
+
+
+def create_in_flight_gauge(name: str, documentation: str):
+    if MULTIPROCESS:
+        return Gauge(name, documentation, registry=None, multiprocess_mode='livesum')
+
+    gauge = InFlightGauge(name, documentation)
+    REGISTRY.register(gauge)
+
+    return gauge
+
+
+REQUEST_DURATION = create_histogram(
+    'http_request_duration_seconds',
+    'Duration of the http requests',
+    ('method', 'route', 'status'),
+    (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0)
+)
+REQUESTS_IN_FLIGHT = create_in_flight_gauge(
+    'http_requests_in_flight',
+    'Http requests being processed'
+)
+REDIS_COMMAND_DURATION = create_histogram(
+    'redis_command_duration_seconds',
+    'Duration of the redis commands',
+    ('command', ),
+    (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 1.0)
+)
+EVENT_LOOP_LAG = create_histogram(
+    'event_loop_lag_seconds',
+    'Delay of a callback scheduled on the event loop',
+    (),
+    (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+)
+
+EVENT_LOOP_LAG_INTERVAL = 0.5
+
+UNMATCHED_ROUTE = 'unmatched'
+
+_event_loop_lag_task: Optional[asyncio.Task] = None
+_routes: dict[Any, str] = {}
+
+
+def get_route(scope: Scope) -> str:
+    # the router stores the matched endpoint in the scope, the templates of
+    # the paths keep the number of label values bounded
+    endpoint = scope.get('endpoint')
+
+    if endpoint is None:
+        return UNMATCHED_ROUTE
+
+    if endpoint not in _routes:
+        for route in scope['app'].routes:
+            if getattr(route, 'endpoint', None) is endpoint:
+                _routes[endpoint] = route.path
+                break
+        else:
+            return UNMATCHED_ROUTE
+
+    return _routes[endpoint]
+
+
+class MetricsMiddleware:
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        started_at = time.perf_counter()
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            REQUEST_DURATION.observe(
+                (scope['method'], get_route(scope), status),
+                time.perf_counter() - started_at
+            )
+
+
+async def _measure_event_loop_lag() -> None:
+    while True:
+        started_at = time.perf_counter()
+        await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL)
+        lag = time.perf_counter() - started_at - EVENT_LOOP_LAG_INTERVAL
+        EVENT_LOOP_LAG.observe((), max(lag, 0))
+
+
+async def start_event_loop_lag_monitor() -> None:
+    global _event_loop_lag_task
+
+    if _event_loop_lag_task is None:
+        _event_loop_lag_task = asyncio.create_task(_measure_event_loop_lag())
+
+
+async def stop_event_loop_lag_monitor() -> None:
+    global _event_loop_lag_task
+
+    if _event_loop_lag_task is not None:
+        _event_loop_lag_task.cancel()
+        try:
+            await _event_loop_lag_task
+        except asyncio.CancelledError:
+            pass
+
+    _event_loop_lag_task = None
@@ -0,0 +1,353 @@
+import atexit
+import functools
+import inspect
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from queue import SimpleQueue
+from typing import Any, Callable, Iterator, Optional, Protocol, TextIO
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .config import settings
+from .metrics import get_route
+
+
+# Spans in the OpenTelemetry layout around the requests, the service
+# methods, the SQL statements and the redis commands. The sampling decision
+# is made once per request (or taken from the W3C traceparent header of a
+# trusted caller), an unsampled request only pays for a context variable
+# lookup per call. The spans of a trace are exported together when its root
+# span ends.
+
+# version-trace id-parent id-flags, lowercase hex
+TRACEPARENT_PATTERN = re.compile(
+    r'(?!ff)([0-9a-f]{2})-(?!0{32})([0-9a-f]{32})-(?!0{16})([0-9a-f]{16})-'
+    r'([0-9a-f]{2})'
+)
+SAMPLED_FLAG = 0x01
+
+_current_span: ContextVar[Optional['Span']] = ContextVar(
+    'current_span',
+    default=None
+)
+
+
+class Exporter(Protocol):
+
+    def export(self, spans: list['Span']) -> None:
+        ...
+
+
+class Trace:
+    __slots__ = ('trace_id', 'spans')
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans: list[Span] = []
+
+
+class Span:
+    __slots__ = (
+        'trace',
+        'span_id',
+        'parent_id',
+        'name',
+        'attributes',
+        'start_time',
+        'end_time',
+        'status'
+    )
+
+    def __init__(
+            self,
+            trace: Trace,
+            name: str,
+            parent_id: Optional[str] = None,
+            attributes: Optional[dict[str, Any]] = None
+    ):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes or {}
+        self.start_time = time.time_ns()
+        self.end_time: Optional[int] = None
+        self.status = 'ok'
+
+    def set_error(self, exception: BaseException) -> None:
+        self.status = 'error'
+        self.attributes['exception.type'] = type(exception).__name__
+
+    def end(self) -> None:
+        self.end_time = time.time_ns()
+        self.trace.spans.append(self)
+
+    def to_dict(self) -> dict[str, Any]:
+        duration = (self.end_time - self.start_time) / 1_000_000
+
+        return {
+            'trace_id': self.trace.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'duration_ms': round(duration, 3),
+            'status': self.status,
+            'attributes': self.attributes,
+        }
+
+
+class ConsoleExporter:
+
+    def __init__(self, stream: TextIO = sys.stdout):
+        self.stream = stream
+
+    def export(self, spans: list[Span]) -> None:
+        for span in spans:
+            self.stream.write(json.dumps(span.to_dict()) + '\n')
+        self.stream.flush()
+
+
+class FileExporter:
+    # the spans are written by a thread, the event loop only queues them
+
+    def __init__(self, path: Optional[str] = None):
+        self.file = open(path or settings.TRACING_FILE, 'a')
+        self.queue: SimpleQueue[Optional[list[Span]]] = SimpleQueue()
+        self.thread = threading.Thread(
+            target=self._write,
+            name='trace-exporter',
+            daemon=True
+        )
+        self.thread.start()
+        atexit.register(self.close)
+
+    def export(self, spans: list[Span]) -> None:
+        self.queue.put(spans)
+
+    def close(self) -> None:
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def _write(self) -> None:
+        is_closed = False
+
+        while not is_closed:
+            batches = [self.queue.get()]
+            # the traces queued meanwhile are written together
+            while not self.queue.empty():
+                batches.append(self.queue.get())
+
+            lines = []
+            for spans in batches:
+                if spans is None:
+                    is_closed = True
+                    continue
+                lines.extend(json.dumps(span.to_dict()) + '\n' for span in spans)
+
+            self.file.write(''.join(lines))
+            self.file.flush()
+
+        self.file.close()
+
+
+_exporter_factories: dict[str, Callable[[], Exporter]] = {
+    'console': ConsoleExporter,
+    'file': FileExporter,
+}
+_exporter: Optional[Exporter] = None
+
+
+def register_exporter(name: str, factory: Callable[[], Exporter]) -> None:
+    _exporter_factories[name] = factory
+
+
+def get_exporter() -> Exporter:
+    global _exporter
+
+    if _exporter is None:
+        _exporter = _exporter_factories[settings.TRACING_EXPORTER]()
+
+    return _exporter
+
+
+def _parse_traceparent(value: str) -> Optional[tuple[str, str, bool]]:
+    match = TRACEPARENT_PATTERN.fullmatch(value.strip())
+
+    if match is None:
+        return None
+
+    _, trace_id, parent_id, flags = match.groups()
+
+    return trace_id, parent_id, bool(int(flags, 16) & SAMPLED_FLAG)
+
+
+@contextmanager
+def start_trace(
+        name: str,
+        traceparent: Optional[str] = None,
+        **attributes: Any
+) -> Iterator[Optional[Span]]:
+    parent = _parse_traceparent(traceparent) if traceparent else None
+
+    if parent is not None:
+        trace_id, parent_id, is_sampled = parent
+    else:
+        trace_id, parent_id, is_sampled = os.urandom(16).hex(), None, False
+
+    # any client could otherwise force the sampling of its requests
+    if parent is None or not settings.TRACING_TRUST_TRACEPARENT:
+        is_sampled = random.random() < settings.TRACING_SAMPLE_RATE
+
+    if not is_sampled:
+        yield None
+        return
+
+    span = Span(Trace(trace_id), name, parent_id, attributes)
+    token = _current_span.set(span)
+
+    try:
+        yield span
+    except BaseException as e:
+        span.set_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end()
+        get_exporter().export(span.trace.spans)
+
+
+def create_span(name: str, **attributes: Any) -> Optional[Span]:
+    # a leaf span which the caller ends, None when the trace isn't sampled
+    parent = _current_span.get()
+
+    if parent is None:
+        return None
+
+    return Span(parent.trace, name, parent.span_id, attributes)
+
+
+@contextmanager
+def start_span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    span = create_span(name, **attributes)
+
+    if span is None:
+        yield None
+        return
+
+    token = _current_span.set(span)
+
+    try:
+        yield span
+    except BaseException as e:
+        span.set_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end()
+
+
+def _trace_coroutine(name: str, func: Callable) -> Callable:
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if _current_span.get() is None:
+            return await func(*args, **kwargs)
+
+        with start_span(name):
+            return await func(*args, **kwargs)
+
+    return wrapper
+
+
+def trace_methods(cls: type) -> type:
+    # a span per call of every coroutine method defined by the class
+    for name, value in list(vars(cls).items()):
+        span_name = f'{cls.__name__}.{name}'
+
+        if inspect.iscoroutinefunction(value):
+            setattr(cls, name, _trace_coroutine(span_name, value))
+        elif (
+                isinstance(value, classmethod) and
+                inspect.iscoroutinefunction(value.__func__)
+        ):
+            method = _trace_coroutine(span_name, value.__func__)
+            setattr(cls, name, classmethod(method))
+
+    return cls
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, *args):
+    if context is not None:
+        context._trace_span = create_span(
+            'sql',
+            **{'db.system': 'postgresql', 'db.statement': statement}
+        )
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, *args):
+    span = getattr(context, '_trace_span', None)
+
+    if span is not None:
+        span.end()
+
+
+def _handle_error(exception_context) -> None:
+    span = getattr(exception_context.execution_context, '_trace_span', None)
+
+    if span is not None:
+        span.set_error(exception_context.original_exception)
+        span.end()
+
+
+def listen_tracing_events(engine: Engine) -> None:
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+
+
+class TracingMiddleware:
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for header, value in scope['headers']:
+            if header == b'traceparent':
+                traceparent = value.decode('latin-1')
+
+        with start_trace(
+                f'{scope["method"]} {scope["path"]}',
+                traceparent,
+                **{'http.method': scope['method'], 'http.target': scope['path']}
+        ) as span:
+            if span is None:
+                await self.app(scope, receive, send)
+                return
+
+            async def send_with_status(message: Message) -> None:
+                if message['type'] == 'http.response.start':
+                    span.attributes['http.status_code'] = message['status']
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                route = get_route(scope)
+                span.name = f'{scope["method"]} {route}'
+                span.attributes['http.route'] = route
@@ -1,9 +1,23 @@
-from sqlalchemy import create_engine
+from sqlalchemy import text
 
 from .base_class import Base
-from ..core import settings
+from .session import (
+    close_redis_pool,
+    dispose_async_engine,
+    get_async_engine,
+    init_redis_pool
+)
 
 
-def create_db_schema() -> None:
-    engine = create_engine(settings.SQLALCHEMY_DATABASE_URL, pool_pre_ping=True)
-    Base.metadata.create_all(engine)
+async def connect() -> None:
+    # open the first pooled connections before the first request needs them
+    async with get_async_engine().connect() as connection:
+        await connection.execute(text('SELECT 1'))
+
+    redis = await init_redis_pool()
+    await redis.ping()
+
+
+async def disconnect() -> None:
+    await close_redis_pool()
+    await dispose_async_engine()
@@ -1,2 +1,2 @@
 from .base_class import Base
-from ..models import Like, Follower, Post, PostRelationship, User
+from ..models import Like, Follower, OutboxEvent, Post, PostRelationship, User
@@ -2,6 +2,7 @@ from logging.config import fileConfig
 
 from alembic import context
 from sqlalchemy import engine_from_config
+from sqlalchemy import inspect
 from sqlalchemy import pool
 
 from app.database.base import Base
@@ -22,6 +23,10 @@ fileConfig(config.config_file_name)
 # target_metadata = mymodel.Base.metadata
 target_metadata = Base.metadata
 
+# databases created by Base.metadata.create_all before the migrations
+# already have the schema of the initial revision
+INITIAL_REVISION = 'cff36e8de335'
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -51,6 +56,17 @@ def run_migrations_offline():
         context.run_migrations()
 
 
+def stamp_initial_revision(connection):
+    """Stamp a database created without migrations with the initial revision.
+
+    Otherwise the initial revision would fail to create the existing tables.
+
+    """
+    inspector = inspect(connection)
+    if inspector.has_table('user') and not inspector.has_table('alembic_version'):
+        context.get_context().stamp(context.script, INITIAL_REVISION)
+
+
 def run_migrations_online():
     """Run migrations in 'online' mode.
 
@@ -73,6 +89,7 @@ def run_migrations_online():
         )
 
         with context.begin_transaction():
+            stamp_initial_revision(connection)
             context.run_migrations()
 
 
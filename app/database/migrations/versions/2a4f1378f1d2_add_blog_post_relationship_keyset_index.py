@@ -0,0 +1,32 @@
+"""add blog post relationship keyset index
+
+Revision ID: 2a4f1378f1d2
+Revises: cff36e8de335
+Create Date: 2026-10-17 21:58:40.512304
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2a4f1378f1d2'
+down_revision = 'cff36e8de335'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'ix_blog_post_relationship_user_id_created_at',
+        'blog_post_relationship',
+        ['user_id', 'created_at', 'post_id'],
+        unique=False
+    )
+
+
+def downgrade():
+    op.drop_index(
+        'ix_blog_post_relationship_user_id_created_at',
+        table_name='blog_post_relationship'
+    )
@@ -0,0 +1,56 @@
+"""add hot path indexes
+
+Revision ID: 5f0b9a7c3d18
+Revises: 8c1e5d2b7f40
+Create Date: 2026-10-17 22:41:17.203958
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f0b9a7c3d18'
+down_revision = '8c1e5d2b7f40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'ix_follower_follower_id_active',
+        'follower',
+        ['follower_id', 'user_id'],
+        unique=False,
+        postgresql_where=sa.text('is_active')
+    )
+    op.create_index(
+        'ix_follower_user_id_active',
+        'follower',
+        ['user_id', 'follower_id'],
+        unique=False,
+        postgresql_where=sa.text('is_active')
+    )
+    op.create_index(
+        'ix_blog_post_relationship_post_id',
+        'blog_post_relationship',
+        ['post_id', 'user_id'],
+        unique=False
+    )
+    op.create_index(
+        'ix_blog_post_like_post_id_active',
+        'blog_post_like',
+        ['post_id', 'user_id'],
+        unique=False,
+        postgresql_where=sa.text('is_active')
+    )
+
+
+def downgrade():
+    op.drop_index('ix_blog_post_like_post_id_active', table_name='blog_post_like')
+    op.drop_index(
+        'ix_blog_post_relationship_post_id',
+        table_name='blog_post_relationship'
+    )
+    op.drop_index('ix_follower_user_id_active', table_name='follower')
+    op.drop_index('ix_follower_follower_id_active', table_name='follower')
@@ -0,0 +1,31 @@
+"""drop follower follower id index
+
+Revision ID: 6d2c8e4a1f37
+Revises: b3d6e1f09a52
+Create Date: 2026-10-18 09:12:45.318620
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6d2c8e4a1f37'
+down_revision = 'b3d6e1f09a52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the primary key (follower_id, user_id) already serves these lookups
+    op.drop_index('ix_follower_follower_id_active', table_name='follower')
+
+
+def downgrade():
+    op.create_index(
+        'ix_follower_follower_id_active',
+        'follower',
+        ['follower_id', 'user_id'],
+        unique=False,
+        postgresql_where=sa.text('is_active')
+    )
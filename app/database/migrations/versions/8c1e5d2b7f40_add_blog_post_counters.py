@@ -0,0 +1,49 @@
+"""add blog post counters
+
+Revision ID: 8c1e5d2b7f40
+Revises: 2a4f1378f1d2
+Create Date: 2026-10-17 22:14:05.871396
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c1e5d2b7f40'
+down_revision = '2a4f1378f1d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'blog_post',
+        sa.Column('likes_count', sa.Integer(), server_default='0', nullable=False)
+    )
+    op.add_column(
+        'blog_post',
+        sa.Column('reposts_count', sa.Integer(), server_default='0', nullable=False)
+    )
+    op.execute(
+        """
+        UPDATE blog_post
+        SET likes_count = (
+                SELECT count(*)
+                FROM blog_post_like
+                WHERE blog_post_like.post_id = blog_post.id
+                  AND blog_post_like.is_active
+            ),
+            reposts_count = (
+                SELECT count(*)
+                FROM blog_post_relationship
+                WHERE blog_post_relationship.post_id = blog_post.id
+                  AND NOT blog_post_relationship.is_owner
+            )
+        """
+    )
+
+
+def downgrade():
+    op.drop_column('blog_post', 'reposts_count')
+    op.drop_column('blog_post', 'likes_count')
@@ -0,0 +1,95 @@
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Iterator
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.requests import Request
+from starlette.responses import Response
+
+
+# Every statement run by the engines is counted by the trackers active in
+# the current context: one per request in debug mode and the ones opened
+# by tests. The same statement run more than once by a request is a N+1
+# candidate, usually a query in a loop or a lazy load.
+
+logger = logging.getLogger(__name__)
+
+_trackers: ContextVar[tuple['QueryStats', ...]] = ContextVar(
+    'query_stats_trackers',
+    default=()
+)
+
+
+class QueryStats:
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements: Counter[str] = Counter()
+
+    @property
+    def repeated(self) -> dict[str, int]:
+        return {
+            statement: count
+            for statement, count in self.statements.items()
+            if count > 1
+        }
+
+
+@contextmanager
+def track_queries() -> Iterator[QueryStats]:
+    stats = QueryStats()
+    token = _trackers.set(_trackers.get() + (stats, ))
+    try:
+        yield stats
+    finally:
+        _trackers.reset(token)
+
+
+def _before_cursor_execute(conn, cursor, statement, *args) -> None:
+    conn.info.setdefault('query_started_at', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, *args) -> None:
+    duration = time.perf_counter() - conn.info['query_started_at'].pop()
+
+    for stats in _trackers.get():
+        stats.count += 1
+        stats.duration += duration
+        stats.statements[statement] += 1
+
+
+def listen_query_events(engine: Engine) -> None:
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+async def add_query_stats_headers(
+        request: Request,
+        call_next: Callable[[Request], Awaitable[Response]]
+) -> Response:
+    with track_queries() as stats:
+        response = await call_next(request)
+
+    duration = round(stats.duration * 1000, 2)
+    response.headers['X-DB-Queries'] = str(stats.count)
+    response.headers['Server-Timing'] = (
+        f'db;dur={duration};desc="{stats.count} queries"'
+    )
+
+    if stats.repeated:
+        response.headers['X-DB-Repeated-Queries'] = str(len(stats.repeated))
+        for statement, count in stats.repeated.items():
+            logger.warning(
+                'possible N+1 in %s %s, the statement ran %d times: %s',
+                request.method,
+                request.url.path,
+                count,
+                statement
+            )
+
+    return response
@@ -1,22 +1,197 @@
-from typing import AsyncIterator, Iterator
+import time
+from typing import AsyncIterator, Iterator, Optional
 
-from aioredis import create_redis, Redis
-from sqlalchemy import create_engine
+from aioredis import create_redis_pool, Redis
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import Session, sessionmaker
 
 from ..core import settings
+from ..core.metrics import REDIS_COMMAND_DURATION
+from ..core.tracing import create_span, listen_tracing_events, Span
+from .query_stats import listen_query_events
 
 
 DATABASE = settings.SQLALCHEMY_DATABASE_URL
 REDIS = settings.REDIS_DATABASE_URL
 
+ASYNC_DRIVER = 'postgresql+asyncpg'
+
+_engine: Optional[Engine] = None
+_session_factory: Optional[sessionmaker] = None
+_async_engine: Optional[AsyncEngine] = None
+_async_session_factory: Optional[sessionmaker] = None
+_redis: Optional[Redis] = None
+_pool_events = {
+    'sync': {'connect': 0, 'checkout': 0, 'checkin': 0},
+    'async': {'connect': 0, 'checkout': 0, 'checkin': 0},
+}
+
+
+def _count_pool_event(engine_name: str, event_name: str):
+    def listener(*args) -> None:
+        _pool_events[engine_name][event_name] += 1
+
+    return listener
+
+
+def _get_engine_options() -> dict:
+    return {
+        'echo': settings.DEBUG,
+        'pool_size': settings.SQLALCHEMY_POOL_SIZE,
+        'max_overflow': settings.SQLALCHEMY_MAX_OVERFLOW,
+        'pool_timeout': settings.SQLALCHEMY_POOL_TIMEOUT,
+        'pool_recycle': settings.SQLALCHEMY_POOL_RECYCLE,
+        'pool_pre_ping': settings.SQLALCHEMY_POOL_PRE_PING,
+    }
+
+
+def _listen_pool_events(engine: Engine, engine_name: str) -> None:
+    for event_name in _pool_events[engine_name]:
+        event.listen(engine, event_name, _count_pool_event(engine_name, event_name))
+
+
+def _get_pool_stats(engine: Engine, engine_name: str) -> dict[str, int]:
+    pool = engine.pool
+    events = _pool_events[engine_name]
+
+    return {
+        'size': pool.size(),
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        'overflow': pool.overflow(),
+        'connects': events['connect'],
+        'checkouts': events['checkout'],
+        'checkins': events['checkin'],
+    }
+
+
+def get_engine() -> Engine:
+    global _engine, _session_factory
+
+    if _engine is None:
+        _engine = create_engine(DATABASE, **_get_engine_options())
+        _listen_pool_events(_engine, 'sync')
+        listen_query_events(_engine)
+        listen_tracing_events(_engine)
+        _session_factory = sessionmaker(
+            autocommit=False,
+            autoflush=False,
+            bind=_engine
+        )
+
+    return _engine
+
+
+def get_async_engine() -> AsyncEngine:
+    global _async_engine, _async_session_factory
+
+    if _async_engine is None:
+        url = make_url(DATABASE).set(drivername=ASYNC_DRIVER)
+        _async_engine = create_async_engine(url, **_get_engine_options())
+        _listen_pool_events(_async_engine.sync_engine, 'async')
+        listen_query_events(_async_engine.sync_engine)
+        listen_tracing_events(_async_engine.sync_engine)
+        _async_session_factory = sessionmaker(
+            autoflush=False,
+            expire_on_commit=False,
+            bind=_async_engine,
+            class_=AsyncSession
+        )
+
+    return _async_engine
+
+
+def dispose_engine() -> None:
+    global _engine, _session_factory
+
+    if _engine is not None:
+        _engine.dispose()
+
+    _engine = None
+    _session_factory = None
+
+
+async def dispose_async_engine() -> None:
+    global _async_engine, _async_session_factory
+
+    if _async_engine is not None:
+        await _async_engine.dispose()
+
+    _async_engine = None
+    _async_session_factory = None
+
+
+def get_db_pool_stats() -> dict[str, int]:
+    return _get_pool_stats(get_engine(), 'sync')
+
+
+def get_async_db_pool_stats() -> dict[str, int]:
+    # the metrics registry collects the stats on registration, which must
+    # not create the engine
+    if _async_engine is None:
+        events = _pool_events['async']
+        return {
+            'size': 0,
+            'checked_in': 0,
+            'checked_out': 0,
+            'overflow': 0,
+            'connects': events['connect'],
+            'checkouts': events['checkout'],
+            'checkins': events['checkin'],
+        }
+
+    return _get_pool_stats(_async_engine.sync_engine, 'async')
+
+
+async def _observe_redis_command(
+        command: str,
+        result,
+        started_at: float,
+        span: Optional[Span]
+):
+    try:
+        return await result
+    except BaseException as e:
+        if span is not None:
+            span.set_error(e)
+        raise
+    finally:
+        REDIS_COMMAND_DURATION.observe(
+            (command, ),
+            time.perf_counter() - started_at
+        )
+        if span is not None:
+            span.end()
+
+
+class InstrumentedRedis(Redis):
+
+    def execute(self, command, *args, **kwargs):
+        name = command.decode() if isinstance(command, bytes) else command
+        name = name.upper()
+        span = create_span(
+            f'redis {name}',
+            **{'db.system': 'redis', 'db.operation': name}
+        )
+        started_at = time.perf_counter()
+        # a future or a coroutine when the pool has no free connection
+        result = super().execute(command, *args, **kwargs)
+
+        return _observe_redis_command(name, result, started_at, span)
+
 
 def _create_session() -> Session:
-    echo = settings.DEBUG
-    engine = create_engine(DATABASE, pool_pre_ping=True, echo=echo)
-    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    get_engine()
+
+    return _session_factory()
+
 
-    return session()
+def _create_async_session() -> AsyncSession:
+    get_async_engine()
+
+    return _async_session_factory()
 
 
 def get_db_session() -> Iterator[Session]:
@@ -27,10 +202,58 @@ def get_db_session() -> Iterator[Session]:
         session.close()
 
 
-async def get_redis_session() -> AsyncIterator[Redis]:
-    redis = await create_redis(REDIS, encoding='utf-8')
+async def get_async_db_session() -> AsyncIterator[AsyncSession]:
+    session = _create_async_session()
     try:
-        yield redis
+        yield session
     finally:
-        redis.close()
-        await redis.wait_closed()
+        await session.close()
+
+
+async def init_redis_pool() -> Redis:
+    global _redis
+
+    if _redis is None:
+        redis = await create_redis_pool(
+            REDIS,
+            encoding='utf-8',
+            commands_factory=InstrumentedRedis,
+            minsize=settings.REDIS_POOL_MINSIZE,
+            maxsize=settings.REDIS_POOL_MAXSIZE
+        )
+        # another coroutine may have created the pool while we were waiting
+        if _redis is None:
+            _redis = redis
+        else:
+            redis.close()
+            await redis.wait_closed()
+
+    return _redis
+
+
+async def close_redis_pool() -> None:
+    global _redis
+
+    if _redis is not None:
+        _redis.close()
+        await _redis.wait_closed()
+
+    _redis = None
+
+
+def get_redis_pool_stats() -> dict[str, int]:
+    if _redis is None:
+        return {'minsize': 0, 'maxsize': 0, 'size': 0, 'freesize': 0}
+
+    pool = _redis.connection
+
+    return {
+        'minsize': pool.minsize,
+        'maxsize': pool.maxsize,
+        'size': pool.size,
+        'freesize': pool.freesize,
+    }
+
+
+async def get_redis_session() -> AsyncIterator[Redis]:
+    yield await init_redis_pool()
@@ -1,15 +1,51 @@
 import uvicorn
 from fastapi import FastAPI
 
-from .api import api_router
-from .database import create_db_schema
+from .api import api_router, metrics_router
+from .api.metrics import start_stats_export, stop_stats_export
+from .core import settings
+from .core.hashing import shutdown_executor
+from .core.metrics import (
+    MetricsMiddleware,
+    MULTIPROCESS,
+    start_event_loop_lag_monitor,
+    stop_event_loop_lag_monitor
+)
+from .core.tracing import TracingMiddleware
+from .database import connect, disconnect
+from .database.query_stats import add_query_stats_headers
 
 
-create_db_schema()
-app = FastAPI(title='fastapi-microblog')
+def create_app() -> FastAPI:
+    app = FastAPI(title='fastapi-microblog')
 
+    app.include_router(api_router)
 
-app.include_router(api_router)
+    if settings.DEBUG:
+        app.middleware('http')(add_query_stats_headers)
+
+    if settings.METRICS_ENABLED:
+        app.include_router(metrics_router)
+        app.add_middleware(MetricsMiddleware)
+        app.add_event_handler('startup', start_event_loop_lag_monitor)
+        app.add_event_handler('shutdown', stop_event_loop_lag_monitor)
+
+        if MULTIPROCESS:
+            app.add_event_handler('startup', start_stats_export)
+            app.add_event_handler('shutdown', stop_stats_export)
+
+    if settings.TRACING_EXPORTER:
+        # outermost, so that the span covers the metrics middleware as well
+        app.add_middleware(TracingMiddleware)
+
+    app.add_event_handler('startup', connect)
+    app.add_event_handler('shutdown', disconnect)
+    app.add_event_handler('shutdown', shutdown_executor)
+
+    return app
+
+
+app = create_app()
 
 
 if __name__ == "__main__":
@@ -1,3 +1,4 @@
 from .blog_post import Like, Post, PostRelationship
 from .follower import Follower
+from .outbox import OutboxEvent
 from .user import User
@@ -20,11 +20,13 @@ class Post(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     content = Column(Text, nullable=False)
     is_published = Column(Boolean(), default=True, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow())
+    likes_count = Column(Integer, default=0, server_default='0', nullable=False)
+    reposts_count = Column(Integer, default=0, server_default='0', nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(
         DateTime,
-        default=datetime.utcnow(),
-        onupdate=datetime.utcnow()
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow
     )
 
     users = relationship(
@@ -52,7 +54,7 @@ class PostRelationship(Base):
         ForeignKey('blog_post.id', ondelete='CASCADE'),
         primary_key=True
     )
-    created_at = Column(DateTime, default=datetime.utcnow(), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     is_owner = Column(Boolean(), default=True, nullable=False)
 
     __table_args__ = (
@@ -63,6 +65,13 @@ class PostRelationship(Base):
             unique=True,
             postgresql_where=(is_owner)
         ),
+        Index(
+            'ix_blog_post_relationship_user_id_created_at',
+            user_id,
+            created_at,
+            post_id
+        ),
+        Index('ix_blog_post_relationship_post_id', post_id, user_id),
     )
 
     user = relationship('User', back_populates='posts')
@@ -84,11 +93,20 @@ class Like(Base):
     )
     created_at = Column(
         DateTime,
-        default=datetime.utcnow(),
-        onupdate=datetime.utcnow(),
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
         nullable=False
     )
     is_active = Column(Boolean(), default=True, nullable=False)
 
+    __table_args__ = (
+        Index(
+            'ix_blog_post_like_post_id_active',
+            post_id,
+            user_id,
+            postgresql_where=(is_active)
+        ),
+    )
+
     user = relationship('User', back_populates='likes')
     post = relationship('Post', back_populates='likes')
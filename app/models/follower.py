@@ -5,6 +5,7 @@ from sqlalchemy import (
     Column,
     DateTime,
     ForeignKey,
+    Index,
     Integer
 )
 from sqlalchemy.orm import relationship
@@ -27,11 +28,21 @@ class Follower(Base):
     )
     created_at = Column(
         DateTime,
-        default=datetime.utcnow(),
-        onupdate=datetime.utcnow(),
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
         nullable=False
     )
     is_active = Column(Boolean(), default=True)
 
+    # the primary key leads with follower_id
+    __table_args__ = (
+        Index(
+            'ix_follower_user_id_active',
+            user_id,
+            follower_id,
+            postgresql_where=(is_active)
+        ),
+    )
+
     user = relationship('User', foreign_keys=[user_id, ])
     follower = relationship('User', foreign_keys=[follower_id, ])
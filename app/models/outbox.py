@@ -0,0 +1,20 @@
+from datetime import datetime
+
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    JSON,
+    String
+)
+
+from ..database.base_class import Base
+
+
+class OutboxEvent(Base):
+    __tablename__ = 'outbox_event'
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    event_type = Column(String(64), nullable=False)
+    payload = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
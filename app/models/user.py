@@ -19,7 +19,7 @@ class User(Base):
     username = Column(String, unique=True, nullable=False)
     email = Column(String, unique=True, nullable=False)
     password_hash = Column(String, nullable=False)
-    date_joined = Column(DateTime, default=datetime.utcnow())
+    date_joined = Column(DateTime, default=datetime.utcnow)
     is_active = Column(Boolean(), default=True)
     is_staff = Column(Boolean(), default=False)
     is_superuser = Column(Boolean(), default=False)
@@ -1,3 +1,11 @@
 from .blog_post import BlogPost, BlogPostCreate, BlogPostUpdate
-from .home import BlogPostUser, HomeBlogPost
-from .user import AccessToken, RefreshToken, User, UserCreate
+from .home import BlogPostUser, HomeBlogPost, HomeMode
+from .user import (
+    AccessToken,
+    Availability,
+    BaseUser,
+    Principal,
+    RefreshToken,
+    User,
+    UserCreate
+)
@@ -1,9 +1,15 @@
 from datetime import datetime
+from enum import Enum
 from typing import Optional
 
 from pydantic import BaseModel
 
 
+class HomeMode(str, Enum):
+    timeline = 'timeline'
+    query = 'query'
+
+
 class BlogPostUser(BaseModel):
     id: int
     username: str
@@ -1,6 +1,7 @@
 import re
 from datetime import datetime
 from string import ascii_lowercase, ascii_uppercase
+from typing import NamedTuple, Optional
 
 from pydantic import (
     BaseModel,
@@ -67,3 +68,14 @@ class AccessToken(BaseModel):
 
 class RefreshToken(AccessToken):
     refresh_token: str
+
+
+class Availability(BaseModel):
+    username: Optional[bool]
+    email: Optional[bool]
+
+
+class Principal(NamedTuple):
+    # the authenticated user as carried by a token
+    id: int
+    username: str
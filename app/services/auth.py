@@ -1,37 +1,102 @@
+import hashlib
+import secrets
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Any, Union
+from typing import Any, Optional, Union
 
 from aioredis import Redis
 from fastapi import Depends, HTTPException
-from fastapi.encoders import jsonable_encoder
 from fastapi.security import OAuth2, OAuth2PasswordBearer
 from jose import jwt, JWTError
-from passlib.hash import bcrypt
 from pydantic import ValidationError
-from sqlalchemy.orm import Session
-from starlette.status import HTTP_401_UNAUTHORIZED
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.status import HTTP_401_UNAUTHORIZED, HTTP_503_SERVICE_UNAVAILABLE
 
 from .. import models, schemas
-from ..core import settings
-from ..database.session import get_db_session, get_redis_session
+from ..core import hashing, settings
+from ..core.tracing import trace_methods
+from ..database.session import get_async_db_session, get_redis_session
+from .availability import add_values, get_values
 
 
 oauth2_scheme: OAuth2 = OAuth2PasswordBearer(tokenUrl='api/v1/auth/sign-in')
 
-
-async def get_user(token: str = Depends(oauth2_scheme)) -> schemas.User:
+# verified tokens: sha256 digest -> (user, exp), the least recently used first
+_token_cache: OrderedDict[bytes, tuple[schemas.Principal, int]] = OrderedDict()
+_token_cache_stats = {'hits': 0, 'misses': 0}
+
+
+# KEYS: refresh tokens of the user, legacy refresh tokens of the user
+# ARGV: rotated token digest ('' for a new session), now, token digest,
+#       expires at, max sessions, ttl, rotated token
+# returns 0 when the rotated token isn't an active session
+#
+# the sessions started before the sorted set are kept in a plain set keyed by
+# the username, they are rotated into the sorted set on their next refresh
+REFRESH_TOKENS_SCRIPT = '''
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+if ARGV[1] ~= '' and redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then
+    if redis.call('SREM', KEYS[2], ARGV[7]) == 0 then
+        return 0
+    end
+    -- the remaining legacy tokens expire before the set does
+    if redis.call('TTL', KEYS[2]) == -1 then
+        redis.call('EXPIRE', KEYS[2], ARGV[6])
+    end
+end
+redis.call('ZADD', KEYS[1], ARGV[4], ARGV[3])
+local extra = redis.call('ZCARD', KEYS[1]) - tonumber(ARGV[5])
+if extra > 0 then
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, extra - 1)
+end
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+return 1
+'''
+
+
+def get_token_cache_stats() -> dict[str, Union[int, float]]:
+    requests = _token_cache_stats['hits'] + _token_cache_stats['misses']
+
+    return {
+        'size': len(_token_cache),
+        'max_size': settings.TOKEN_CACHE_MAX_SIZE,
+        'hits': _token_cache_stats['hits'],
+        'misses': _token_cache_stats['misses'],
+        'hit_rate': _token_cache_stats['hits'] / requests if requests else 0.0,
+    }
+
+
+def clear_token_cache() -> None:
+    _token_cache.clear()
+    _token_cache_stats.update(hits=0, misses=0)
+
+
+async def get_user(token: str = Depends(oauth2_scheme)) -> schemas.Principal:
     return AuthService.get_user(token)
 
 
+@trace_methods
 class AuthService:
 
     @classmethod
-    def hash_password(cls, plain_password: str) -> str:
-        return bcrypt.hash(plain_password)
+    async def hash_password(cls, plain_password: str) -> str:
+        try:
+            return await hashing.hash_password(plain_password)
+        except hashing.HashingQueueFull:
+            raise cls._create_busy_exception() from None
 
     @classmethod
-    def verify_password(cls, plain_password: str, hashed_password: str) -> bool:
-        return bcrypt.verify(plain_password, hashed_password)
+    async def verify_password(
+            cls,
+            plain_password: str,
+            hashed_password: str
+    ) -> bool:
+        try:
+            return await hashing.verify_password(plain_password, hashed_password)
+        except hashing.HashingQueueFull:
+            raise cls._create_busy_exception() from None
 
     @classmethod
     def verify_token(cls, token: str) -> dict[str, Any]:
@@ -49,13 +114,18 @@ class AuthService:
         return payload
 
     @classmethod
-    def create_token(cls, user: schemas.User, token_expires: int) -> str:
+    def create_token(
+            cls,
+            user: Union[models.User, schemas.Principal],
+            token_expires: int
+    ) -> str:
         now = datetime.utcnow()
         payload = {
+            'sub': str(user.id),
+            'name': user.username,
+            'jti': secrets.token_urlsafe(8),
             'iat': now,
-            'nbf': now,
             'exp': now + timedelta(seconds=token_expires),
-            'user': jsonable_encoder(user),
         }
         token = jwt.encode(
             payload,
@@ -66,16 +136,57 @@ class AuthService:
         return token
 
     @classmethod
-    def get_user(cls, token: str) -> schemas.User:
+    def _parse_principal(cls, payload: dict[str, Any]) -> schemas.Principal:
+        if 'sub' in payload:
+            return schemas.Principal(int(payload['sub']), payload['name'])
+
+        # tokens issued before the compact claims embed the whole user,
+        # they are accepted until the last of them expires
+        if settings.JWT_ACCEPT_LEGACY_TOKENS:
+            user = schemas.User.parse_obj(payload.get('user'))
+            return schemas.Principal(user.id, user.username)
+
+        raise ValueError('legacy token')
+
+    @classmethod
+    def get_refresh_tokens_key(cls, username: str) -> str:
+        return f'user:{username}:refresh_tokens'
+
+    @classmethod
+    def get_legacy_refresh_tokens_key(cls, username: str) -> str:
+        return username
+
+    @classmethod
+    def get_token_digest(cls, token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    @classmethod
+    def get_user(cls, token: str) -> schemas.Principal:
         exception = cls._create_exception('Could not validate credentials')
+        key = hashlib.sha256(token.encode()).digest()
+        cached = _token_cache.get(key)
+
+        if cached is not None:
+            user, expires_at = cached
+            if expires_at > time.time():
+                _token_cache.move_to_end(key)
+                _token_cache_stats['hits'] += 1
+                return user
+            del _token_cache[key]
+
+        _token_cache_stats['misses'] += 1
         payload = cls.verify_token(token)
-        user_data = payload.get('user')
 
         try:
-            user = schemas.User.parse_obj(user_data)
-        except ValidationError:
+            user = cls._parse_principal(payload)
+        except (KeyError, TypeError, ValueError, ValidationError):
             raise exception from None
 
+        if settings.TOKEN_CACHE_MAX_SIZE > 0:
+            _token_cache[key] = (user, payload['exp'])
+            if len(_token_cache) > settings.TOKEN_CACHE_MAX_SIZE:
+                _token_cache.popitem(last=False)
+
         return user
 
     @classmethod
@@ -91,34 +202,66 @@ class AuthService:
         )
 
     @classmethod
-    def _create_access_token(cls, user: Union[models.User, schemas.User]) -> str:
-        if isinstance(user, models.User):
-            user = schemas.User.from_orm(user)
-        token_expires = settings.JWT_ACCESS_TOKEN_EXPIRES
-
-        return cls.create_token(user, token_expires)
+    def _create_busy_exception(cls) -> Exception:
+        return HTTPException(
+            status_code=HTTP_503_SERVICE_UNAVAILABLE,
+            detail='Too many sign-in requests, try again later',
+            headers={'Retry-After': '1'}
+        )
 
     @classmethod
-    def _create_refresh_token(cls, user: Union[models.User, schemas.User]) -> str:
-        if isinstance(user, models.User):
-            user = schemas.User.from_orm(user)
-        token_expires = settings.JWT_REFRESH_TOKEN_EXPIRES
+    def _create_access_token(
+            cls,
+            user: Union[models.User, schemas.Principal]
+    ) -> str:
+        return cls.create_token(user, settings.JWT_ACCESS_TOKEN_EXPIRES)
 
-        return cls.create_token(user, token_expires)
+    @classmethod
+    def _create_refresh_token(
+            cls,
+            user: Union[models.User, schemas.Principal]
+    ) -> str:
+        return cls.create_token(user, settings.JWT_REFRESH_TOKEN_EXPIRES)
 
     def __init__(
             self,
-            db_session: Session = Depends(get_db_session),
+            db_session: AsyncSession = Depends(get_async_db_session),
             redis_session: Redis = Depends(get_redis_session)
     ):
         self.db_session = db_session
         self.redis_session = redis_session
 
-    async def _create_tokens(self, user: models.User) -> schemas.RefreshToken:
+    async def _create_tokens(
+            self,
+            user: Union[models.User, schemas.Principal],
+            rotated_token: Optional[str] = None
+    ) -> schemas.RefreshToken:
         access_token = self._create_access_token(user)
         refresh_token = self._create_refresh_token(user)
 
-        await self.redis_session.sadd(user.username, refresh_token)
+        # sessions are sorted by expiry, the expired and the oldest ones
+        # over the limit are removed by the same script
+        now = int(time.time())
+        is_stored = await self.redis_session.eval(
+            REFRESH_TOKENS_SCRIPT,
+            keys=[
+                self.get_refresh_tokens_key(user.username),
+                self.get_legacy_refresh_tokens_key(user.username)
+            ],
+            args=[
+                self.get_token_digest(rotated_token) if rotated_token else '',
+                now,
+                self.get_token_digest(refresh_token),
+                now + settings.JWT_REFRESH_TOKEN_EXPIRES,
+                settings.REFRESH_TOKEN_MAX_SESSIONS,
+                settings.JWT_REFRESH_TOKEN_EXPIRES,
+                rotated_token or ''
+            ]
+        )
+
+        if not is_stored:
+            exception = self._create_exception('Could not validate credentials')
+            raise exception from None
 
         return schemas.RefreshToken(
             access_token=access_token,
@@ -129,16 +272,15 @@ class AuthService:
             self,
             user_data: schemas.UserCreate,
     ) -> schemas.RefreshToken:
-        db_user = (
-            self.db_session
-                .query(models.User)
-                .with_entities(models.User.username, models.User.email)
+        query = (
+            select(models.User.username, models.User.email)
                 .filter(
                     (models.User.username == user_data.username) |
                     (models.User.email == user_data.email)
                 )
-                .first()
+                .limit(1)
         )
+        db_user = (await self.db_session.execute(query)).first()
 
         if db_user:
             key = 'email address' if db_user.email == user_data.email else 'username'
@@ -150,10 +292,12 @@ class AuthService:
         user = models.User(
             email=user_data.email,
             username=user_data.username,
-            password_hash=self.hash_password(user_data.password),
+            password_hash=await self.hash_password(user_data.password),
         )
         self.db_session.add(user)
-        self.db_session.commit()
+        await self.db_session.commit()
+
+        await add_values(self.redis_session, get_values(user.username, user.email))
 
         return await self._create_tokens(user)
 
@@ -164,24 +308,33 @@ class AuthService:
     ) -> schemas.RefreshToken:
         exception = self._create_exception('Incorrect username or password')
 
-        user = (
-            self.db_session
-                .query(models.User)
+        query = (
+            select(models.User)
                 .filter(models.User.username == username)
-                .first()
+                .limit(1)
         )
+        user = (await self.db_session.execute(query)).scalar()
 
-        if not user or not self.verify_password(password, user.password_hash):
+        if not user or not await self.verify_password(password, user.password_hash):
             raise exception from None
 
         return await self._create_tokens(user)
 
     async def get_refresh_token(self, token: str) -> schemas.RefreshToken:
-        exception = self._create_exception('Could not validate credentials')
         user = self.get_user(token)
-        is_valid_token = await self.redis_session.srem(user.username, token)
 
-        if not is_valid_token:
+        return await self._create_tokens(user, token)
+
+    async def get_profile(self, user: schemas.Principal) -> schemas.User:
+        query = (
+            select(models.User)
+                .filter(models.User.id == user.id)
+                .limit(1)
+        )
+        db_user = (await self.db_session.execute(query)).scalar()
+
+        if db_user is None or not db_user.is_active:
+            exception = self._create_exception('Could not validate credentials')
             raise exception from None
 
-        return await self._create_tokens(user)
+        return schemas.User.from_orm(db_user)
@@ -0,0 +1,133 @@
+import hashlib
+import math
+from typing import Iterable, Optional
+
+from aioredis import Redis
+from fastapi import Depends
+from sqlalchemy import Column, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import models, schemas
+from ..core import settings
+from ..core.tracing import trace_methods
+from ..database.session import get_async_db_session, get_redis_session
+
+
+# A bloom filter of the registered usernames and emails, stored as a redis
+# bitmap. A miss means the value is free, a hit has to be confirmed by
+# postgres. Without the filter (before the first load) every check goes to
+# postgres. The filter is rebuilt into the building key and renamed, values
+# registered meanwhile are added to both keys.
+
+FILTER_KEY = 'users:bloom'
+BUILDING_FILTER_KEY = 'users:bloom:building'
+
+# KEYS: filter
+# ARGV: bit offsets
+# returns -1 without the filter, 1 when all the bits are set, 0 otherwise
+CHECK_SCRIPT = '''
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+for i = 1, #ARGV do
+    if redis.call('GETBIT', KEYS[1], ARGV[i]) == 0 then
+        return 0
+    end
+end
+return 1
+'''
+
+# KEYS: filter, building filter
+# ARGV: bit offsets
+ADD_SCRIPT = '''
+for i = 1, #KEYS do
+    if redis.call('EXISTS', KEYS[i]) == 1 then
+        for j = 1, #ARGV do
+            redis.call('SETBIT', KEYS[i], ARGV[j], 1)
+        end
+    end
+end
+return 0
+'''
+
+
+def get_filter_size() -> tuple[int, int]:
+    # bits and hash functions for the capacity and the false positive rate,
+    # the filter has to be reloaded after these settings are changed
+    capacity = settings.USER_FILTER_CAPACITY
+    error_rate = settings.USER_FILTER_ERROR_RATE
+    bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    hashes = max(1, round(bits / capacity * math.log(2)))
+
+    return bits, hashes
+
+
+def get_offsets(value: str) -> list[int]:
+    bits, hashes = get_filter_size()
+    digest = hashlib.sha256(value.encode()).digest()
+    first = int.from_bytes(digest[:8], 'big')
+    second = int.from_bytes(digest[8:16], 'big')
+
+    return [(first + i * second) % bits for i in range(hashes)]
+
+
+def get_values(username: str, email: str) -> list[str]:
+    return [f'username:{username}', f'email:{email}']
+
+
+async def add_values(redis_session: Redis, values: Iterable[str]) -> None:
+    offsets = [offset for value in values for offset in get_offsets(value)]
+
+    await redis_session.eval(
+        ADD_SCRIPT,
+        keys=[FILTER_KEY, BUILDING_FILTER_KEY],
+        args=offsets
+    )
+
+
+@trace_methods
+class AvailabilityService:
+
+    def __init__(
+            self,
+            db_session: AsyncSession = Depends(get_async_db_session),
+            redis_session: Redis = Depends(get_redis_session)
+    ):
+        self.db_session = db_session
+        self.redis_session = redis_session
+
+    async def _is_available(self, column: Column, value: str) -> bool:
+        is_possible_hit = await self.redis_session.eval(
+            CHECK_SCRIPT,
+            keys=[FILTER_KEY],
+            args=get_offsets(f'{column.key}:{value}')
+        )
+
+        if is_possible_hit == 0:
+            return True
+
+        query = (
+            select(func.count())
+                .select_from(models.User)
+                .filter(column == value)
+        )
+
+        return not (await self.db_session.execute(query)).scalar()
+
+    async def check(
+            self,
+            username: Optional[str] = None,
+            email: Optional[str] = None
+    ) -> schemas.Availability:
+        result = schemas.Availability()
+
+        # the same normalization as on sign-up
+        if username is not None:
+            username = username.strip().lower()
+            result.username = await self._is_available(models.User.username, username)
+
+        if email is not None:
+            email = email.strip().lower()
+            result.email = await self._is_available(models.User.email, email)
+
+        return result
@@ -2,15 +2,31 @@ from datetime import datetime
 from typing import Optional
 
 from fastapi import Depends, HTTPException
-from sqlalchemy import func
-from sqlalchemy.orm import Session
+from sqlalchemy import (
+    delete,
+    false,
+    func,
+    literal,
+    literal_column,
+    select,
+    true,
+    update
+)
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.expression import ColumnElement, CTE
 from starlette.status import HTTP_422_UNPROCESSABLE_ENTITY
 
 from .. import models, schemas
 from ..core import settings
-from ..database.session import get_db_session
+from ..core.tracing import trace_methods
+from ..database.session import get_async_db_session
+from .like_buffer import LikeBufferService
+from .outbox import add_event
+from .timeline import TimelineService
 
 
+@trace_methods
 class BlogPostService:
 
     @classmethod
@@ -25,96 +41,235 @@ class BlogPostService:
             headers={'WWW-Authenticate': 'Bearer'}
         )
 
-    def __init__(self, db_session: Session = Depends(get_db_session)):
+    @classmethod
+    def _serialize_blog_post(cls, blog_post: models.Post) -> schemas.BlogPost:
+        # relationships are not loaded implicitly by the async session
+        return schemas.BlogPost(
+            id=blog_post.id,
+            content=blog_post.content,
+            created_at=blog_post.created_at,
+            updated_at=blog_post.updated_at
+        )
+
+    def __init__(
+            self,
+            db_session: AsyncSession = Depends(get_async_db_session),
+            timeline_service: TimelineService = Depends(),
+            like_buffer_service: LikeBufferService = Depends()
+    ):
         self.db_session = db_session
+        self.timeline_service = timeline_service
+        self.like_buffer_service = like_buffer_service
 
-    def _is_existing_blog_post(self, post_id: int) -> bool:
-        blog_post = (
-            self.db_session
-                .query(func.count('*'))
+    async def _is_existing_blog_post(self, post_id: int) -> bool:
+        query = (
+            select(func.count())
                 .select_from(models.Post)
                 .filter(models.Post.id == post_id)
-                .scalar()
         )
+        blog_post = (await self.db_session.execute(query)).scalar()
 
         return bool(blog_post)
 
-    def _is_blog_post_author(self, user_id: int, post_id: int) -> bool:
-        post_relationship = (
-            self.db_session
-                .query(func.count('*'))
+    async def _is_blog_post_author(self, user_id: int, post_id: int) -> bool:
+        query = (
+            select(func.count())
                 .select_from(models.PostRelationship)
                 .filter(
                     (models.PostRelationship.post_id == post_id) &
                     (models.PostRelationship.user_id == user_id) &
                     (models.PostRelationship.is_owner)
                 )
-                .scalar()
         )
+        post_relationship = (await self.db_session.execute(query)).scalar()
 
         return bool(post_relationship)
 
-    def _get_blog_post(self, post_id: int) -> Optional[models.Post]:
-        blog_post = (
-            self.db_session
-                .query(models.Post)
+    async def _is_published_blog_post(self, username: str, post_id: int) -> bool:
+        query = (
+            select(func.count())
+                .select_from(models.Post)
+                .join(
+                    models.PostRelationship,
+                    models.PostRelationship.post_id == models.Post.id
+                )
+                .join(
+                    models.User,
+                    models.User.id == models.PostRelationship.user_id
+                )
+                .filter(
+                    (models.Post.id == post_id) &
+                    (models.User.username == username) &
+                    (models.PostRelationship.is_owner) &
+                    (models.Post.is_published)
+                )
+        )
+        blog_post = (await self.db_session.execute(query)).scalar()
+
+        return bool(blog_post)
+
+    async def _get_blog_post(self, post_id: int) -> Optional[models.Post]:
+        query = (
+            select(models.Post)
                 .filter(models.Post.id == post_id)
-                .first()
+                .limit(1)
         )
+        blog_post = (await self.db_session.execute(query)).scalar()
 
         return blog_post
 
-    def _get_blog_post_relationship(
+    async def _get_blog_post_relationship(
             self,
             user_id: int,
             post_id: int
     ) -> Optional[models.PostRelationship]:
-        post_relationship = (
-            self.db_session
-                .query(models.PostRelationship)
+        query = (
+            select(models.PostRelationship)
                 .filter(
                     (models.PostRelationship.user_id == user_id) &
                     (models.PostRelationship.post_id == post_id)
                 )
-                .first()
+                .limit(1)
         )
+        post_relationship = (await self.db_session.execute(query)).scalar()
 
         return post_relationship
 
+    async def _get_blog_post_user_ids(self, post_id: int) -> list[int]:
+        query = (
+            select(models.PostRelationship.user_id)
+                .filter(models.PostRelationship.post_id == post_id)
+        )
+
+        return (await self.db_session.execute(query)).scalars().all()
+
+    async def _update_blog_post_counters(
+            self,
+            post_id: int,
+            likes: int = 0,
+            reposts: int = 0
+    ) -> None:
+        query = (
+            update(models.Post)
+                .filter(models.Post.id == post_id)
+                .values(
+                    likes_count=models.Post.likes_count + likes,
+                    reposts_count=models.Post.reposts_count + reposts,
+                    # counters aren't edits of the post
+                    updated_at=models.Post.updated_at
+                )
+                .execution_options(synchronize_session=False)
+        )
+        await self.db_session.execute(query)
+
+    @classmethod
+    def _update_blog_post_counters_query(
+            cls,
+            post_id: ColumnElement,
+            likes: int = 0,
+            reposts: int = 0
+    ) -> CTE:
+        # the counters of the posts returned by a previous CTE. SQLAlchemy
+        # 1.4.15 misorders the positional parameters of nested DML CTEs with
+        # asyncpg, so the deltas are rendered inline
+        return (
+            update(models.Post)
+                .filter(models.Post.id.in_(select(post_id)))
+                .values(
+                    likes_count=models.Post.likes_count + literal_column(str(likes)),
+                    reposts_count=(
+                        models.Post.reposts_count + literal_column(str(reposts))
+                    ),
+                    # counters aren't edits of the post
+                    updated_at=models.Post.updated_at
+                )
+                .returning(models.Post.id)
+                .cte('updated_counters')
+        )
+
     async def create_blog_post(
             self,
-            user: schemas.User,
+            user: schemas.Principal,
             user_data: schemas.BlogPostCreate
     ) -> schemas.BlogPost:
-        blog_post = models.Post(content=user_data.content)
-        self.db_session.add(blog_post)
-        self.db_session.commit()
+        # the post and its owner are created by one statement in one transaction
+        created_at = datetime.utcnow()
+        # the column defaults aren't applied to an insert inside a CTE
+        blog_post = (
+            insert(models.Post)
+                .values(
+                    content=user_data.content,
+                    is_published=True,
+                    likes_count=0,
+                    reposts_count=0,
+                    created_at=created_at,
+                    updated_at=created_at
+                )
+                .returning(
+                    models.Post.id,
+                    models.Post.content,
+                    models.Post.created_at,
+                    models.Post.updated_at
+                )
+                .cte('new_post')
+        )
+        blog_post_relationship = (
+            insert(models.PostRelationship)
+                .from_select(
+                    ['user_id', 'post_id', 'created_at', 'is_owner'],
+                    select(
+                        literal(user.id),
+                        blog_post.c.id,
+                        blog_post.c.created_at,
+                        true()
+                    )
+                )
+                .returning(models.PostRelationship.post_id)
+                .cte('new_post_relationship')
+        )
+        query = (
+            select(blog_post)
+                .join(
+                    blog_post_relationship,
+                    blog_post_relationship.c.post_id == blog_post.c.id
+                )
+        )
+        new_blog_post = schemas.BlogPost(
+            **(await self.db_session.execute(query)).mappings().one()
+        )
 
-        blog_post_relationship = models.PostRelationship(
+        add_event(
+            self.db_session,
+            'post_created',
             user_id=user.id,
-            post_id=blog_post.id,
-            created_at=blog_post.created_at
+            post_id=new_blog_post.id,
+            created_at=new_blog_post.created_at
         )
+        await self.db_session.commit()
 
-        self.db_session.add(blog_post_relationship)
-        self.db_session.commit()
+        if not settings.TIMELINE_FAN_OUT_IN_WORKER:
+            await self.timeline_service.push(
+                user.id,
+                new_blog_post.id,
+                new_blog_post.created_at
+            )
 
-        return schemas.BlogPost.from_orm(blog_post)
+        return new_blog_post
 
     async def update_blog_post(
             self,
-            user: schemas.User,
+            user: schemas.Principal,
             user_data: schemas.BlogPostUpdate,
             post_id: int
     ) -> schemas.BlogPost:
-        if not self._is_blog_post_author(user.id, post_id):
+        if not await self._is_blog_post_author(user.id, post_id):
             exception = self._create_exception('invalid post relationship')
             raise exception from None
 
-        blog_post = self._get_blog_post(post_id)
+        blog_post = await self._get_blog_post(post_id)
 
         if blog_post.content == user_data.content:
-            return schemas.BlogPost.from_orm(blog_post)
+            return self._serialize_blog_post(blog_post)
 
         updated_at = datetime.utcnow()
         creation_timedelta = (updated_at - blog_post.created_at).total_seconds()
@@ -126,170 +281,318 @@ class BlogPostService:
         blog_post.content = user_data.content
         blog_post.updated_at = updated_at
 
-        self.db_session.commit()
+        add_event(
+            self.db_session,
+            'post_updated',
+            user_id=user.id,
+            post_id=post_id,
+            updated_at=updated_at
+        )
+        await self.db_session.commit()
 
-        return schemas.BlogPost.from_orm(blog_post)
+        return self._serialize_blog_post(blog_post)
 
     async def archive_blog_post(
             self,
-            user: schemas.User,
+            user: schemas.Principal,
             post_id: int
     ) -> None:
-        if not self._is_blog_post_author(user.id, post_id):
+        if not await self._is_blog_post_author(user.id, post_id):
             exception = self._create_exception('invalid post relationship')
             raise exception from None
 
-        blog_post = self._get_blog_post(post_id)
+        blog_post = await self._get_blog_post(post_id)
 
-        if blog_post.is_published:
-            blog_post.is_published = False
-            blog_post.updated_at = datetime.utcnow()
+        if not blog_post.is_published:
+            return
+
+        blog_post.is_published = False
+        blog_post.updated_at = datetime.utcnow()
 
-            self.db_session.commit()
+        user_ids = await self._get_blog_post_user_ids(post_id)
+        add_event(
+            self.db_session,
+            'post_archived',
+            post_id=post_id,
+            user_ids=user_ids
+        )
+        await self.db_session.commit()
+
+        # the reads skip unpublished posts, but the pages would come up short
+        if not settings.TIMELINE_FAN_OUT_IN_WORKER:
+            await self.timeline_service.remove(post_id, user_ids)
 
     async def delete_blog_post(
             self,
-            user: schemas.User,
+            user: schemas.Principal,
             post_id: int
     ) -> None:
-        if not self._is_blog_post_author(user.id, post_id):
+        if not await self._is_blog_post_author(user.id, post_id):
             exception = self._create_exception('invalid post relationship')
             raise exception from None
 
-        blog_post = self._get_blog_post(post_id)
+        blog_post = await self._get_blog_post(post_id)
+        # the reposts are deleted with the post
+        user_ids = await self._get_blog_post_user_ids(post_id)
+
+        await self.db_session.delete(blog_post)
+        add_event(
+            self.db_session,
+            'post_deleted',
+            post_id=post_id,
+            user_ids=user_ids
+        )
+        await self.db_session.commit()
 
-        self.db_session.delete(blog_post)
-        self.db_session.commit()
+        if not settings.TIMELINE_FAN_OUT_IN_WORKER:
+            await self.timeline_service.remove(post_id, user_ids)
 
     async def add_blog_post_like(
             self,
-            user: schemas.User,
+            user: schemas.Principal,
             username: str,
             post_id: int
     ) -> None:
-        post_relationship = (
-            self.db_session
-                .query(func.count('*'))
-                .select_from(models.PostRelationship)
+        # applied later by the flush_likes worker
+        if settings.LIKES_WRITE_BEHIND:
+            if not await self._is_published_blog_post(username, post_id):
+                exception = self._create_exception('invalid post relationship')
+                raise exception from None
+
+            await self.like_buffer_service.push(user.id, post_id, True)
+            return
+
+        # a single statement: the conflicting row is locked until the end of
+        # the transaction, so concurrent likes are counted only once
+        blog_post = (
+            select(models.Post.id)
                 .join(
-                    models.User,
-                    models.User.id == models.PostRelationship.user_id
+                    models.PostRelationship,
+                    models.PostRelationship.post_id == models.Post.id
                 )
                 .join(
-                    models.Post,
-                    models.Post.id == models.PostRelationship.post_id
+                    models.User,
+                    models.User.id == models.PostRelationship.user_id
                 )
                 .filter(
-                    (models.PostRelationship.post_id == post_id) &
+                    (models.Post.id == post_id) &
                     (models.User.username == username) &
                     (models.PostRelationship.is_owner) &
                     (models.Post.is_published)
                 )
-                .scalar()
+                .cte('target_post')
         )
+        insert_query = insert(models.Like).from_select(
+            ['user_id', 'post_id', 'created_at', 'is_active'],
+            select(
+                literal(user.id),
+                blog_post.c.id,
+                literal(datetime.utcnow()),
+                true()
+            )
+        )
+        blog_post_like = (
+            insert_query
+                .on_conflict_do_update(
+                    index_elements=[models.Like.user_id, models.Like.post_id],
+                    # no parameters in the upsert, see the counters query
+                    set_={
+                        'is_active': true(),
+                        'created_at': insert_query.excluded.created_at
+                    },
+                    where=~models.Like.is_active
+                )
+                .returning(models.Like.post_id)
+                .cte('new_like')
+        )
+        counters = self._update_blog_post_counters_query(
+            blog_post_like.c.post_id,
+            likes=1
+        )
+        query = select(
+            select(func.count()).select_from(blog_post).scalar_subquery(),
+            select(func.count()).select_from(counters).scalar_subquery()
+        )
+        is_existing_blog_post, is_liked = (
+            await self.db_session.execute(query)
+        ).one()
 
-        if not post_relationship:
+        if not is_existing_blog_post:
             exception = self._create_exception('invalid post relationship')
             raise exception from None
 
-        blog_post_like = (
-            self.db_session
-                .query(models.Like)
-                .filter(
-                    (models.Like.post_id == post_id) &
-                    (models.Like.user_id == user.id)
-                )
-                .first()
-        )
-
-        if blog_post_like:
-            if blog_post_like.is_active:
-                return
-            else:
-                blog_post_like.is_active = True
-                blog_post_like.created_at = datetime.utcnow()
-        else:
-            new_blog_post_like = models.Like(
-                user_id=user.id,
-                post_id=post_id
-            )
-            self.db_session.add(new_blog_post_like)
-
-        self.db_session.commit()
+        if is_liked:
+            add_event(self.db_session, 'post_liked', user_id=user.id, post_id=post_id)
+        await self.db_session.commit()
 
     async def remove_blog_post_like(
             self,
-            user: schemas.User,
+            user: schemas.Principal,
             post_id: int
     ) -> None:
-        blog_post_like = (
-            self.db_session
-                .query(models.Like)
-                .join(
-                    models.Post,
-                    models.Post.id == models.Like.post_id
-                )
+        if settings.LIKES_WRITE_BEHIND:
+            await self.like_buffer_service.push(user.id, post_id, False)
+            return
+
+        # a concurrent unlike waits for the row lock and then doesn't match,
+        # so the counter is decremented only once
+        query = (
+            update(models.Like)
                 .filter(
                     (models.Like.post_id == post_id) &
                     (models.Like.user_id == user.id) &
+                    (models.Like.is_active) &
+                    (models.Post.id == models.Like.post_id) &
                     (models.Post.is_published)
                 )
-                .first()
+                .values(is_active=False, created_at=datetime.utcnow())
+                .returning(models.Like.post_id)
+                .execution_options(synchronize_session=False)
         )
-
-        if not blog_post_like:
-            exception = self._create_exception(
-                'the blog post hasn\'t already liked'
+        is_removed = (await self.db_session.execute(query)).scalar() is not None
+
+        if not is_removed:
+            query = (
+                select(func.count())
+                    .select_from(models.Like)
+                    .join(
+                        models.Post,
+                        models.Post.id == models.Like.post_id
+                    )
+                    .filter(
+                        (models.Like.post_id == post_id) &
+                        (models.Like.user_id == user.id) &
+                        (models.Post.is_published)
+                    )
             )
-            raise exception from None
-
-        if blog_post_like.is_active:
-            blog_post_like.is_active = False
-            blog_post_like.created_at = datetime.utcnow()
+            if not (await self.db_session.execute(query)).scalar():
+                exception = self._create_exception(
+                    'the blog post hasn\'t already liked'
+                )
+                raise exception from None
+            return
 
-            self.db_session.commit()
+        await self._update_blog_post_counters(post_id, likes=-1)
+        add_event(
+            self.db_session,
+            'post_unliked',
+            user_id=user.id,
+            post_id=post_id
+        )
+        await self.db_session.commit()
 
     async def create_blog_post_repost(
             self,
-            user: schemas.User,
+            user: schemas.Principal,
             post_id: int
     ) -> None:
-        if not self._is_existing_blog_post(post_id):
+        blog_post = (
+            select(models.Post.id)
+                .filter(models.Post.id == post_id)
+                .cte('target_post')
+        )
+        blog_post_relationship = (
+            insert(models.PostRelationship)
+                .from_select(
+                    ['user_id', 'post_id', 'created_at', 'is_owner'],
+                    select(
+                        literal(user.id),
+                        blog_post.c.id,
+                        literal(datetime.utcnow()),
+                        false()
+                    )
+                )
+                .on_conflict_do_nothing(
+                    index_elements=[
+                        models.PostRelationship.user_id,
+                        models.PostRelationship.post_id
+                    ]
+                )
+                .returning(
+                    models.PostRelationship.post_id,
+                    models.PostRelationship.created_at
+                )
+                .cte('new_repost')
+        )
+        counters = self._update_blog_post_counters_query(
+            blog_post_relationship.c.post_id,
+            reposts=1
+        )
+        query = select(
+            select(func.count()).select_from(blog_post).scalar_subquery(),
+            select(blog_post_relationship.c.created_at)
+                .join(counters, counters.c.id == blog_post_relationship.c.post_id)
+                .scalar_subquery()
+        )
+        is_existing_blog_post, created_at = (
+            await self.db_session.execute(query)
+        ).one()
+
+        if not is_existing_blog_post:
             exception = self._create_exception('invalid blog post id')
             raise exception from None
 
-        post_relationship = self._get_blog_post_relationship(user.id, post_id)
-
-        if post_relationship:
+        # the user has already reposted or owns this post
+        if created_at is None:
+            await self.db_session.commit()
             return
 
-        blog_post_relationship = models.PostRelationship(
+        add_event(
+            self.db_session,
+            'post_reposted',
             user_id=user.id,
             post_id=post_id,
-            is_owner=False
+            created_at=created_at
         )
+        await self.db_session.commit()
 
-        self.db_session.add(blog_post_relationship)
-        self.db_session.commit()
+        if not settings.TIMELINE_FAN_OUT_IN_WORKER:
+            await self.timeline_service.push(user.id, post_id, created_at)
 
     async def delete_blog_post_repost(
             self,
-            user: schemas.User,
+            user: schemas.Principal,
             post_id: int
     ) -> None:
-        if not self._is_existing_blog_post(post_id):
+        if not await self._is_existing_blog_post(post_id):
             exception = self._create_exception('invalid blog post id')
             raise exception from None
 
-        post_relationship = self._get_blog_post_relationship(user.id, post_id)
+        # the counter is decremented only if this statement removed the repost
+        query = (
+            delete(models.PostRelationship)
+                .filter(
+                    (models.PostRelationship.user_id == user.id) &
+                    (models.PostRelationship.post_id == post_id) &
+                    (~models.PostRelationship.is_owner)
+                )
+                .returning(models.PostRelationship.post_id)
+                .execution_options(synchronize_session=False)
+        )
+        is_deleted = (await self.db_session.execute(query)).scalar() is not None
+
+        if not is_deleted:
+            post_relationship = await self._get_blog_post_relationship(
+                user.id,
+                post_id
+            )
+
+            if post_relationship and post_relationship.is_owner:
+                exception = self._create_exception('cannot delete this repost')
+                raise exception from None
 
-        if not post_relationship:
             exception = self._create_exception('invalid post relationship')
             raise exception from None
 
-        if post_relationship.is_owner:
-            exception = self._create_exception('cannot delete this repost')
-            raise exception from None
+        await self._update_blog_post_counters(post_id, reposts=-1)
+        add_event(
+            self.db_session,
+            'repost_deleted',
+            user_id=user.id,
+            post_id=post_id
+        )
+        await self.db_session.commit()
 
-        self.db_session.delete(post_relationship)
-        self.db_session.commit()
+        # the repost may have hidden an older activity for this post
+        if not settings.TIMELINE_FAN_OUT_IN_WORKER:
+            await self.timeline_service.invalidate_followers(user.id)
@@ -1,13 +1,21 @@
+from datetime import datetime
 from typing import Optional
 
 from fastapi import Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import func, literal, select, true
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.status import HTTP_404_NOT_FOUND
 
 from .. import models, schemas
-from ..database.session import get_db_session
+from ..core import settings
+from ..core.tracing import trace_methods
+from ..database.session import get_async_db_session
+from .outbox import add_event
+from .timeline import TimelineService
 
 
+@trace_methods
 class FollowerService:
 
     @classmethod
@@ -22,54 +30,108 @@ class FollowerService:
             headers={'WWW-Authenticate': 'Bearer'}
         )
 
-    def __init__(self, db_session: Session = Depends(get_db_session)):
+    def __init__(
+            self,
+            db_session: AsyncSession = Depends(get_async_db_session),
+            timeline_service: TimelineService = Depends()
+    ):
         self.db_session = db_session
+        self.timeline_service = timeline_service
 
-    def _get_user(self, username: str) -> Optional[models.User]:
-        user = (
-            self.db_session
-                .query(models.User)
+    async def _get_user(self, username: str) -> Optional[models.User]:
+        query = (
+            select(models.User)
                 .filter(models.User.username == username)
-                .first()
+                .limit(1)
         )
+        user = (await self.db_session.execute(query)).scalar()
 
         return user
 
-    async def follow_user(self, user: schemas.User, username: str) -> None:
+    async def follow_user(self, user: schemas.Principal, username: str) -> None:
         if user.username == username:
             return
 
-        db_user = self._get_user(username)
+        db_user = (
+            select(models.User.id)
+                .filter(
+                    (models.User.username == username) &
+                    (models.User.is_active)
+                )
+                .cte('target_user')
+        )
+        insert_query = insert(models.Follower).from_select(
+            ['follower_id', 'user_id', 'created_at', 'is_active'],
+            select(
+                literal(user.id),
+                db_user.c.id,
+                literal(datetime.utcnow()),
+                true()
+            )
+        )
+        follower = (
+            insert_query
+                .on_conflict_do_update(
+                    index_elements=[
+                        models.Follower.follower_id,
+                        models.Follower.user_id
+                    ],
+                    # a parameter here would be misordered with asyncpg
+                    set_={
+                        'is_active': true(),
+                        'created_at': insert_query.excluded.created_at
+                    },
+                    # is_active is nullable
+                    where=models.Follower.is_active.isnot(True)
+                )
+                .returning(models.Follower.user_id)
+                .cte('new_follower')
+        )
+        query = select(
+            select(func.count()).select_from(db_user).scalar_subquery(),
+            select(follower.c.user_id).scalar_subquery()
+        )
+        is_existing_user, followed_user_id = (
+            await self.db_session.execute(query)
+        ).one()
 
-        if db_user is None or not db_user.is_active:
+        if not is_existing_user:
             exception = self._create_exception('invalid username')
             raise exception from None
 
-        follower = models.Follower(follower_id=user.id, user_id=db_user.id)
+        # the user may already follow this user
+        if followed_user_id is not None:
+            add_event(
+                self.db_session,
+                'user_followed',
+                follower_id=user.id,
+                user_id=followed_user_id
+            )
+        await self.db_session.commit()
 
-        self.db_session.add(follower)
-        self.db_session.commit()
+        if followed_user_id is not None and not settings.TIMELINE_FAN_OUT_IN_WORKER:
+            await self.timeline_service.invalidate(user.id)
 
-    async def unfollow_user(self, user: schemas.User, username: str) -> None:
+    async def unfollow_user(self, user: schemas.Principal, username: str) -> None:
         if user.username == username:
             return
 
-        db_user = self._get_user(username)
+        db_user = await self._get_user(username)
 
         if db_user is None or not db_user.is_active:
             exception = self._create_exception('invalid username')
             raise exception from None
 
-        follower = (
-            self.db_session
-                .query(models.Follower)
+        query = (
+            select(models.Follower)
                 .filter(
                     (models.Follower.user_id == db_user.id) &
                     (models.Follower.follower_id == user.id) &
                     (models.Follower.is_active)
                 )
-                .first()
+                .limit(1)
         )
+        follower = (await self.db_session.execute(query)).scalar()
 
         if follower is None:
             exception = self._create_exception('invalid username')
@@ -78,4 +140,13 @@ class FollowerService:
         follower.is_active = False
 
         self.db_session.add(follower)
-        self.db_session.commit()
+        add_event(
+            self.db_session,
+            'user_unfollowed',
+            follower_id=user.id,
+            user_id=db_user.id
+        )
+        await self.db_session.commit()
+
+        if not settings.TIMELINE_FAN_OUT_IN_WORKER:
+            await self.timeline_service.invalidate(user.id)
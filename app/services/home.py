@@ -1,125 +1,209 @@
-from datetime import datetime
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import Optional, Union
 
-from aioredis import Redis
-from fastapi import Depends
-from sqlalchemy import desc, func
-from sqlalchemy.orm import Session
+from fastapi import Depends, HTTPException
+from sqlalchemy import desc, select, true, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from starlette.status import HTTP_422_UNPROCESSABLE_ENTITY
 
 from .. import models, schemas
-from ..database.session import get_db_session, get_redis_session
+from ..core.tracing import trace_methods
+from ..database.session import get_async_db_session
+from .timeline import (
+    from_score,
+    TimelineCursor,
+    TimelineEntry,
+    TimelineService,
+    to_score
+)
 
 
+@trace_methods
 class HomeService:
 
+    @classmethod
+    def _create_exception(
+            cls,
+            detail: str,
+            status_code: int = HTTP_422_UNPROCESSABLE_ENTITY
+    ) -> Exception:
+        return HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={'WWW-Authenticate': 'Bearer'}
+        )
+
+    @classmethod
+    def encode_cursor(
+            cls,
+            entry: Union[TimelineEntry, schemas.HomeBlogPost]
+    ) -> str:
+        cursor = f'{to_score(entry.created_at)}:{entry.post_id}'
+        return urlsafe_b64encode(cursor.encode()).decode()
+
+    @classmethod
+    def decode_cursor(cls, cursor: str) -> TimelineCursor:
+        try:
+            score, post_id = urlsafe_b64decode(cursor.encode()).decode().split(':')
+            return TimelineCursor(from_score(int(score)), int(post_id))
+        except (ValueError, OverflowError, OSError):
+            exception = cls._create_exception('invalid cursor')
+            raise exception from None
+
     def __init__(
             self,
-            db_session: Session = Depends(get_db_session),
-            redis_session: Redis = Depends(get_redis_session)
+            db_session: AsyncSession = Depends(get_async_db_session),
+            timeline_service: TimelineService = Depends()
     ):
         self.db_session = db_session
-        self.redis_session = redis_session
+        self.timeline_service = timeline_service
 
     async def home(
             self,
-            user: schemas.User,
+            user: schemas.Principal,
+            cursor: Optional[str] = None,
             limit: int = 50,
-            expire: int = 900  # 15 min
+            mode: schemas.HomeMode = schemas.HomeMode.timeline
+    ) -> tuple[list[schemas.HomeBlogPost], Optional[str]]:
+        timeline_cursor = self.decode_cursor(cursor) if cursor else None
+
+        if mode == schemas.HomeMode.query:
+            blog_posts = await self._query(user.id, limit, timeline_cursor)
+            next_cursor = (
+                self.encode_cursor(blog_posts[-1]) if len(blog_posts) == limit else None
+            )
+            return blog_posts, next_cursor
+
+        entries = await self.timeline_service.read(user.id, limit, timeline_cursor)
+        next_cursor = self.encode_cursor(entries[-1]) if len(entries) == limit else None
+
+        return await self._hydrate(entries), next_cursor
+
+    async def _query(
+            self,
+            user_id: int,
+            limit: int,
+            cursor: Optional[TimelineCursor] = None
     ) -> list[schemas.HomeBlogPost]:
+        # the whole page in a single statement: the latest activity per post
+        # among followed users, its post, the actor and the original author
         users = (
-            self.db_session
-                .query(models.Follower.user_id)
-                .select_from(models.User)
-                .join(
-                    models.Follower,
-                    models.User.id == models.Follower.follower_id
-                )
+            select(models.Follower.user_id)
                 .filter(
-                    (models.User.id == user.id) &
+                    (models.Follower.follower_id == user_id) &
                     (models.Follower.is_active)
                 )
                 .subquery()
         )
-
-        last_blog_post_datetime = await self.redis_session.get(
-            f'home:{user.id}:last_blog_post_datetime'
-        )
-        condition = (models.Post.is_published)
-
-        if (
-            last_blog_post_datetime is not None and
-            isinstance(datetime.fromisoformat(last_blog_post_datetime), datetime)
-        ):
-            condition = condition & (
-                    models.PostRelationship.created_at < last_blog_post_datetime
+        # a user has one activity per post, so a post on the page is among
+        # the first `limit` activities of its actor below the cursor, which
+        # are read from the keyset index of each followed user
+        activity = (
+            select(
+                models.PostRelationship.post_id,
+                models.PostRelationship.user_id,
+                models.PostRelationship.created_at
             )
-
-        all_posts = (
-            self.db_session
-                .query(
-                    models.Post.id.label('post_id'),
-                    models.Post.content,
-                    func.max(models.PostRelationship.created_at).label('last_created_at')
-                )
-                .select_from(models.Post)
                 .join(
-                    models.PostRelationship,
-                    models.PostRelationship.post_id == models.Post.id
+                    models.Post,
+                    models.Post.id == models.PostRelationship.post_id
                 )
-                .join(
-                    users,
-                    users.c.user_id == models.PostRelationship.user_id
+                .filter(
+                    (models.PostRelationship.user_id == users.c.user_id) &
+                    (models.Post.is_published)
                 )
-                .filter(condition)
-                .group_by(
-                    models.Post.id,
-                    models.Post.content
+                .order_by(
+                    desc(models.PostRelationship.created_at),
+                    desc(models.PostRelationship.post_id)
                 )
-                .subquery()
+                .limit(limit)
         )
 
-        posts = (
-            self.db_session
-                .query(
-                    all_posts.c.post_id,
-                    all_posts.c.content,
-                    all_posts.c.last_created_at.label('created_at'),
-                    models.User.id.label('user_id'),
-                    models.User.username,
-                    models.PostRelationship.is_owner
-                )
+        if cursor is not None:
+            # the posts with a newer activity are on the previous pages
+            newer_activity = aliased(models.PostRelationship)
+            is_on_previous_page = (
+                select(newer_activity.post_id)
+                    .join(
+                        models.Follower,
+                        models.Follower.user_id == newer_activity.user_id
+                    )
+                    .filter(
+                        (newer_activity.post_id == models.PostRelationship.post_id) &
+                        (models.Follower.follower_id == user_id) &
+                        (models.Follower.is_active) &
+                        (
+                            tuple_(newer_activity.created_at, newer_activity.post_id) >=
+                            tuple_(cursor.created_at, cursor.post_id)
+                        )
+                    )
+                    .exists()
+            )
+            activity = activity.filter(
+                (
+                    tuple_(
+                        models.PostRelationship.created_at,
+                        models.PostRelationship.post_id
+                    ) < tuple_(cursor.created_at, cursor.post_id)
+                ) &
+                ~is_on_previous_page
+            )
+
+        activity = activity.lateral()
+        latest = (
+            select(activity.c.post_id, activity.c.user_id, activity.c.created_at)
+                .select_from(users)
+                .join(activity, true())
+                .distinct(activity.c.post_id)
+                .order_by(activity.c.post_id, desc(activity.c.created_at))
+                .subquery()
+        )
+        author = (
+            select(
+                models.User.id.label('author_id'),
+                models.User.username.label('author_username')
+            )
                 .join(
                     models.PostRelationship,
-                    models.PostRelationship.post_id == all_posts.c.post_id
+                    models.PostRelationship.user_id == models.User.id
+                )
+                .filter(
+                    (models.PostRelationship.post_id == latest.c.post_id) &
+                    (models.PostRelationship.is_owner)
                 )
+                .limit(1)
+                .lateral()
+        )
+        actor = aliased(models.User)
+        query = (
+            select(
+                latest.c.post_id,
+                latest.c.created_at,
+                models.Post.content,
+                models.Post.likes_count,
+                models.Post.reposts_count,
+                actor.id.label('user_id'),
+                actor.username,
+                author.c.author_id,
+                author.c.author_username
+            )
                 .join(
-                    users,
-                    users.c.user_id == models.PostRelationship.user_id
+                    models.Post,
+                    models.Post.id == latest.c.post_id
                 )
                 .join(
-                    models.User,
-                    models.User.id == models.PostRelationship.user_id
+                    actor,
+                    actor.id == latest.c.user_id
                 )
-                .filter(models.PostRelationship.created_at == all_posts.c.last_created_at)
-                .order_by(desc('last_created_at'))
+                .join(author, true())
+                .order_by(desc(latest.c.created_at), desc(latest.c.post_id))
                 .limit(limit)
-                .all()
         )
 
-        post_ids = []
-        repost_ids = []
-        result = {}
+        result = []
 
-        if posts:
-            await self.redis_session.set(
-                f'home:{user.id}:last_blog_post_datetime',
-                posts[-1]['created_at'].isoformat(),
-                expire=expire
-            )
-
-        for post in posts:
-            post_ids.append(post['post_id'])
-            if not post['is_owner']:
-                repost_ids.append(post['post_id'])
+        for post in (await self.db_session.execute(query)).mappings().all():
             blog_post = schemas.HomeBlogPost(
                 post_id=post['post_id'],
                 content=post['content'],
@@ -127,71 +211,95 @@ class HomeService:
                 user=schemas.BlogPostUser(
                     id=post['user_id'],
                     username=post['username']
-                )
-            )
-            result[post['post_id']] = blog_post
-
-        if repost_ids:
-            post_authors = (
-                self.db_session
-                    .query(
-                        models.PostRelationship.post_id,
-                        models.User.id.label('user_id'),
-                        models.User.username
-                    )
-                    .select_from(models.User)
-                    .join(
-                        models.PostRelationship,
-                        models.PostRelationship.user_id == models.User.id
-                    )
-                    .filter(
-                        (models.PostRelationship.post_id.in_(repost_ids)) &
-                        (models.PostRelationship.is_owner)
-                    )
-                    .all()
+                ),
+                likes_count=post['likes_count'],
+                reposts_count=post['reposts_count']
             )
 
-            for post_author in post_authors:
-                post_id = post_author['post_id']
-                result[post_id].author = schemas.BlogPostUser(
-                    id=post_author['user_id'],
-                    username=post_author['username']
+            if post['user_id'] != post['author_id']:
+                blog_post.author = schemas.BlogPostUser(
+                    id=post['author_id'],
+                    username=post['author_username']
                 )
 
-        blog_post_likes = (
-            self.db_session
-                .query(
-                    models.Like.post_id,
-                    func.count('*').label('likes_count')
+            result.append(blog_post)
+
+        return result
+
+    async def _hydrate(
+            self,
+            entries: list[TimelineEntry]
+    ) -> list[schemas.HomeBlogPost]:
+        post_ids = [entry.post_id for entry in entries]
+
+        if not post_ids:
+            return []
+
+        query = (
+            select(
+                models.Post.id.label('post_id'),
+                models.Post.content,
+                models.Post.likes_count,
+                models.Post.reposts_count,
+                models.User.id.label('user_id'),
+                models.User.username
+            )
+                .join(
+                    models.PostRelationship,
+                    models.PostRelationship.post_id == models.Post.id
+                )
+                .join(
+                    models.User,
+                    models.User.id == models.PostRelationship.user_id
                 )
                 .filter(
-                    (models.Like.post_id.in_(post_ids)) &
-                    (models.Like.is_active)
+                    (models.Post.id.in_(post_ids)) &
+                    (models.Post.is_published) &
+                    (models.PostRelationship.is_owner)
                 )
-                .group_by(models.Like.post_id)
-                .all()
         )
+        posts = {
+            post['post_id']: post
+            for post in (await self.db_session.execute(query)).mappings().all()
+        }
 
-        for blog_post_like in blog_post_likes:
-            post_id = blog_post_like['post_id']
-            result[post_id].likes_count = blog_post_like['likes_count']
+        users = {post['user_id']: post['username'] for post in posts.values()}
+        user_ids = {entry.user_id for entry in entries} - users.keys()
 
-        blog_post_reposts = (
-            self.db_session
-                .query(
-                    models.PostRelationship.post_id,
-                    func.count('*').label('reposts_count')
-                )
-                .filter(
-                    (models.PostRelationship.post_id.in_(post_ids)) &
-                    (~models.PostRelationship.is_owner)
+        if user_ids:
+            query = (
+                select(models.User.id, models.User.username)
+                    .filter(models.User.id.in_(user_ids))
+            )
+            users.update((await self.db_session.execute(query)).all())
+
+        result = {}
+
+        for entry in entries:
+            post = posts.get(entry.post_id)
+
+            # the post has been deleted or archived since it was pushed
+            if post is None or entry.user_id not in users:
+                continue
+
+            blog_post = schemas.HomeBlogPost(
+                post_id=entry.post_id,
+                content=post['content'],
+                created_at=entry.created_at,
+                user=schemas.BlogPostUser(
+                    id=entry.user_id,
+                    username=users[entry.user_id]
+                ),
+                likes_count=post['likes_count'],
+                reposts_count=post['reposts_count']
+            )
+
+            if entry.user_id != post['user_id']:
+                blog_post.author = schemas.BlogPostUser(
+                    id=post['user_id'],
+                    username=post['username']
                 )
-                .group_by(models.PostRelationship.post_id)
-                .all()
-        )
 
-        for blog_post_repost in blog_post_reposts:
-            post_id = blog_post_repost['post_id']
-            result[post_id].reposts_count = blog_post_repost['reposts_count']
+            result[entry.post_id] = blog_post
 
         return list(result.values())
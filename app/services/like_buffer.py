@@ -0,0 +1,145 @@
+from datetime import datetime
+from typing import Iterable
+
+from aioredis import Redis
+from fastapi import Depends
+from sqlalchemy import (
+    Boolean,
+    column,
+    false,
+    func,
+    Integer,
+    literal,
+    literal_column,
+    select,
+    true,
+    union_all,
+    update,
+    values
+)
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import models
+from ..core.tracing import trace_methods
+from ..database.session import get_redis_session
+
+
+# Write-behind likes: the api appends like toggles to a redis stream and
+# returns, the flush_likes worker reads them through a consumer group,
+# keeps the last toggle per (user, post) and applies a batch with a single
+# statement. Entries are acknowledged after the commit, a batch which
+# failed is delivered again (at-least-once), re-applying a toggle is a
+# no-op. The batches must be applied in the stream order, so a single
+# worker holds the lease and reads the group at a time. The stream isn't
+# trimmed, the worker deletes the entries once they are acknowledged.
+
+STREAM_KEY = 'likes:stream'
+GROUP_NAME = 'likes'
+
+
+def coalesce(entries: Iterable[tuple]) -> dict[tuple[int, int], bool]:
+    # entries are (stream, id, fields) in the stream order, the last wins
+    toggles = {}
+
+    for _, _, fields in entries:
+        key = (int(fields['user_id']), int(fields['post_id']))
+        toggles[key] = fields['is_active'] == '1'
+
+    return toggles
+
+
+async def flush(
+        db_session: AsyncSession,
+        toggles: dict[tuple[int, int], bool]
+) -> None:
+    if not toggles:
+        return
+
+    now = datetime.utcnow()
+    rows = (
+        values(
+            column('user_id', Integer),
+            column('post_id', Integer),
+            column('is_active', Boolean),
+            name='rows',
+            # ints and bools inline, untyped parameters would be text
+            literal_binds=True
+        )
+            .data([(*key, is_active) for key, is_active in toggles.items()])
+    )
+    batch = select(rows).cte('batch')
+
+    # SQLAlchemy 1.4.15 misorders the positional parameters of nested DML
+    # CTEs with asyncpg: booleans are rendered inline, the only parameters
+    # left are the timestamps, which have the same value
+    insert_query = insert(models.Like).from_select(
+        ['user_id', 'post_id', 'created_at', 'is_active'],
+        select(batch.c.user_id, batch.c.post_id, literal(now), true())
+            .join(models.Post, models.Post.id == batch.c.post_id)
+            .filter(batch.c.is_active & models.Post.is_published)
+    )
+    liked = (
+        insert_query
+            .on_conflict_do_update(
+                index_elements=[models.Like.user_id, models.Like.post_id],
+                set_={
+                    'is_active': true(),
+                    'created_at': insert_query.excluded.created_at
+                },
+                where=~models.Like.is_active
+            )
+            .returning(models.Like.post_id)
+            .cte('liked')
+    )
+    unliked = (
+        update(models.Like)
+            .filter(
+                (models.Like.user_id == batch.c.user_id) &
+                (models.Like.post_id == batch.c.post_id) &
+                (models.Post.id == models.Like.post_id) &
+                (~batch.c.is_active) &
+                (models.Like.is_active) &
+                (models.Post.is_published)
+            )
+            .values(is_active=false(), created_at=now)
+            .returning(models.Like.post_id)
+            .cte('unliked')
+    )
+    changes = union_all(
+        select(liked.c.post_id, literal_column('1').label('delta')),
+        select(unliked.c.post_id, literal_column('-1').label('delta'))
+    ).subquery()
+    deltas = (
+        select(changes.c.post_id, func.sum(changes.c.delta).label('delta'))
+            .group_by(changes.c.post_id)
+            .subquery()
+    )
+    query = (
+        update(models.Post)
+            .filter(models.Post.id == deltas.c.post_id)
+            .values(
+                likes_count=models.Post.likes_count + deltas.c.delta,
+                updated_at=models.Post.updated_at
+            )
+            .execution_options(synchronize_session=False)
+    )
+
+    await db_session.execute(query)
+
+
+@trace_methods
+class LikeBufferService:
+
+    def __init__(self, redis_session: Redis = Depends(get_redis_session)):
+        self.redis_session = redis_session
+
+    async def push(self, user_id: int, post_id: int, is_active: bool) -> None:
+        await self.redis_session.xadd(
+            STREAM_KEY,
+            {
+                'user_id': user_id,
+                'post_id': post_id,
+                'is_active': int(is_active),
+            }
+        )
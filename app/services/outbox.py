@@ -0,0 +1,154 @@
+import time
+from collections import defaultdict
+from datetime import datetime
+from itertools import groupby
+from typing import Any, Awaitable, Callable
+
+from aioredis import Redis
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import models
+from ..core import settings
+from .timeline import TimelineService
+
+
+# Side effects of the writes are recorded as outbox events in the same
+# transaction as the write itself. The outbox_worker tool reads them with
+# FOR UPDATE SKIP LOCKED, so several workers can run at once, passes runs
+# of events of the same type to the registered handlers and deletes them
+# in the same transaction. A failed batch is retried, handlers have to be
+# idempotent. Events without an enabled handler are only deleted.
+
+Handler = Callable[[AsyncSession, Redis, list[models.OutboxEvent]], Awaitable[None]]
+
+STATS_KEY = 'outbox:stats'
+
+_handlers: dict[str, list[tuple[Handler, Callable[[], bool]]]] = defaultdict(list)
+
+
+def handler(
+        *event_types: str,
+        is_enabled: Callable[[], bool] = lambda: True
+) -> Callable[[Handler], Handler]:
+    def decorator(func: Handler) -> Handler:
+        for event_type in event_types:
+            _handlers[event_type].append((func, is_enabled))
+        return func
+
+    return decorator
+
+
+def get_handlers(event_type: str) -> list[Handler]:
+    return [func for func, is_enabled in _handlers[event_type] if is_enabled()]
+
+
+def add_event(db_session: AsyncSession, event_type: str, **payload: Any) -> None:
+    db_session.add(
+        models.OutboxEvent(event_type=event_type, payload=jsonable_encoder(payload))
+    )
+
+
+async def process_batch(
+        db_session: AsyncSession,
+        redis_session: Redis,
+        batch_size: int
+) -> int:
+    query = (
+        select(models.OutboxEvent)
+            .order_by(models.OutboxEvent.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+    )
+    events = (await db_session.execute(query)).scalars().all()
+
+    if not events:
+        return 0
+
+    # consecutive events of the same type keep their order
+    for event_type, batch in groupby(events, key=lambda event: event.event_type):
+        batch = list(batch)
+        for func in get_handlers(event_type):
+            await func(db_session, redis_session, batch)
+
+    query = (
+        delete(models.OutboxEvent)
+            .filter(models.OutboxEvent.id.in_([event.id for event in events]))
+            .execution_options(synchronize_session=False)
+    )
+    await db_session.execute(query)
+    await db_session.commit()
+
+    lag = datetime.utcnow() - min(event.created_at for event in events)
+    transaction = redis_session.multi_exec()
+    transaction.hincrby(STATS_KEY, 'processed', len(events))
+    transaction.hset(STATS_KEY, 'last_lag_ms', int(lag.total_seconds() * 1000))
+    transaction.hset(STATS_KEY, 'last_processed_at', int(time.time()))
+    await transaction.execute()
+
+    return len(events)
+
+
+async def get_outbox_stats(redis_session: Redis) -> dict[str, int]:
+    stats = await redis_session.hgetall(STATS_KEY)
+
+    return {
+        name: int(stats.get(name, 0))
+        for name in ('processed', 'last_lag_ms', 'last_processed_at')
+    }
+
+
+def is_fan_out_in_worker() -> bool:
+    return settings.TIMELINE_FAN_OUT_IN_WORKER
+
+
+@handler('post_created', 'post_reposted', is_enabled=is_fan_out_in_worker)
+async def push_to_timelines(
+        db_session: AsyncSession,
+        redis_session: Redis,
+        events: list[models.OutboxEvent]
+) -> None:
+    timeline_service = TimelineService(db_session, redis_session)
+    for event in events:
+        await timeline_service.push(
+            event.payload['user_id'],
+            event.payload['post_id'],
+            datetime.fromisoformat(event.payload['created_at'])
+        )
+
+
+@handler('post_archived', 'post_deleted', is_enabled=is_fan_out_in_worker)
+async def remove_from_timelines(
+        db_session: AsyncSession,
+        redis_session: Redis,
+        events: list[models.OutboxEvent]
+) -> None:
+    timeline_service = TimelineService(db_session, redis_session)
+    for event in events:
+        await timeline_service.remove(
+            event.payload['post_id'],
+            event.payload['user_ids']
+        )
+
+
+@handler('repost_deleted', is_enabled=is_fan_out_in_worker)
+async def invalidate_followers_timelines(
+        db_session: AsyncSession,
+        redis_session: Redis,
+        events: list[models.OutboxEvent]
+) -> None:
+    timeline_service = TimelineService(db_session, redis_session)
+    for user_id in {event.payload['user_id'] for event in events}:
+        await timeline_service.invalidate_followers(user_id)
+
+
+@handler('user_followed', 'user_unfollowed', is_enabled=is_fan_out_in_worker)
+async def invalidate_timelines(
+        db_session: AsyncSession,
+        redis_session: Redis,
+        events: list[models.OutboxEvent]
+) -> None:
+    timeline_service = TimelineService(db_session, redis_session)
+    for follower_id in {event.payload['follower_id'] for event in events}:
+        await timeline_service.invalidate(follower_id)
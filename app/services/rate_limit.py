@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import math
+import time
+
+from aioredis import Redis, RedisError
+from fastapi import Depends, HTTPException, Request
+from starlette.status import HTTP_429_TOO_MANY_REQUESTS
+
+from .. import schemas
+from ..core import settings
+from ..core.tracing import trace_methods
+from ..database.session import get_redis_session
+from .auth import get_user
+
+
+logger = logging.getLogger(__name__)
+
+# KEYS: bucket
+# ARGV: capacity, refill rate (tokens per second), now (ms)
+# returns 1 and 0 or 0 and the time until the next token (ms)
+TOKEN_BUCKET_SCRIPT = '''
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate / 1000)
+local allowed, retry_after = 0, 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after = math.ceil((1 - tokens) * 1000 / rate)
+end
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate))
+return {allowed, retry_after}
+'''
+
+_stats = {'allowed': 0, 'limited': 0, 'failed_open': 0}
+
+
+def get_rate_limit_stats() -> dict[str, int]:
+    return dict(_stats)
+
+
+# a token bucket per route and client ip, the policy is read from the
+# RATE_LIMIT_<NAME> setting: '10/60' allows bursts of 10 requests and
+# 10 requests per 60 seconds
+@trace_methods
+class RateLimiter:
+
+    @classmethod
+    def _create_exception(cls, retry_after: int) -> Exception:
+        return HTTPException(
+            status_code=HTTP_429_TOO_MANY_REQUESTS,
+            detail='Too many requests',
+            headers={'Retry-After': str(retry_after)}
+        )
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def _get_policy(self) -> tuple[int, int]:
+        policy = getattr(settings, f'RATE_LIMIT_{self.name.upper()}')
+        limit, period = policy.split('/')
+
+        return int(limit), int(period)
+
+    async def hit(self, redis_session: Redis, identity: str) -> None:
+        if not settings.RATE_LIMIT_ENABLED:
+            return
+
+        limit, period = self._get_policy()
+
+        try:
+            allowed, retry_after = await redis_session.eval(
+                TOKEN_BUCKET_SCRIPT,
+                keys=[f'rate_limit:{self.name}:{identity}'],
+                args=[limit, limit / period, int(time.time() * 1000)]
+            )
+        except (RedisError, OSError, asyncio.TimeoutError) as e:
+            # an unavailable redis must not take the api down with it
+            _stats['failed_open'] += 1
+            logger.warning('rate limiter %s failed open: %r', self.name, e)
+            return
+
+        if not allowed:
+            _stats['limited'] += 1
+            exception = self._create_exception(math.ceil(retry_after / 1000))
+            raise exception from None
+
+        _stats['allowed'] += 1
+
+    async def __call__(
+            self,
+            request: Request,
+            redis_session: Redis = Depends(get_redis_session)
+    ) -> None:
+        await self.hit(redis_session, request.client.host)
+
+
+# a token bucket per route and authenticated user
+@trace_methods
+class UserRateLimiter(RateLimiter):
+
+    async def __call__(
+            self,
+            user: schemas.Principal = Depends(get_user),
+            redis_session: Redis = Depends(get_redis_session)
+    ) -> None:
+        await self.hit(redis_session, str(user.id))
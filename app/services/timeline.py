@@ -0,0 +1,341 @@
+from datetime import datetime, timezone
+from typing import NamedTuple, Optional
+
+from aioredis import Redis
+from fastapi import Depends
+from sqlalchemy import desc, func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import models
+from ..core import settings
+from ..core.tracing import trace_methods
+from ..database.session import get_async_db_session, get_redis_session
+
+
+# Home timelines are fanned out on write: every post and repost is pushed
+# into the timeline of each follower of its author. A timeline is a sorted
+# set of post ids scored by the time of the latest activity (microseconds)
+# plus a hash which stores the id of the user behind that activity.
+# Timelines which don't exist aren't written to, they are rebuilt from
+# postgres on the next read. An empty timeline holds a marker scored -inf,
+# which the reads skip, so that it's cached like any other.
+
+FAN_OUT_BATCH_SIZE = 500
+
+# the member of the marker in the scripts below
+EMPTY_MARKER = 'empty'
+
+# KEYS: timeline, actors, timeline, actors, ...
+# ARGV: score, post id, user id, timeline max size
+FAN_OUT_SCRIPT = '''
+local max_size = tonumber(ARGV[4])
+for i = 1, #KEYS, 2 do
+    if redis.call('EXISTS', KEYS[i]) == 1 then
+        local score = redis.call('ZSCORE', KEYS[i], ARGV[2])
+        if not score or tonumber(score) < tonumber(ARGV[1]) then
+            redis.call('ZADD', KEYS[i], ARGV[1], ARGV[2])
+            redis.call('HSET', KEYS[i + 1], ARGV[2], ARGV[3])
+        end
+        local removed = redis.call('ZRANGE', KEYS[i], 0, -(max_size + 1))
+        if #removed > 0 then
+            redis.call('ZREM', KEYS[i], unpack(removed))
+            redis.call('HDEL', KEYS[i + 1], unpack(removed))
+        end
+    end
+end
+return 0
+'''
+
+# KEYS: timeline, actors, timeline, actors, ...
+# ARGV: post id
+REMOVE_SCRIPT = '''
+for i = 1, #KEYS, 2 do
+    redis.call('ZREM', KEYS[i], ARGV[1])
+    redis.call('HDEL', KEYS[i + 1], ARGV[1])
+end
+return 0
+'''
+
+# KEYS: timeline, actors
+# ARGV: max score, max member ('' for the first page), count, expire
+# returns the timeline size followed by (member, score, user id) triples
+READ_SCRIPT = '''
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+local count = tonumber(ARGV[3])
+local size = redis.call('ZCARD', KEYS[1])
+if redis.call('ZSCORE', KEYS[1], 'empty') then
+    size = size - 1
+end
+local posts = {}
+local max_score = ARGV[1]
+if ARGV[2] ~= '' then
+    local ties = redis.call(
+        'ZREVRANGEBYSCORE', KEYS[1], ARGV[1], ARGV[1], 'WITHSCORES'
+    )
+    for i = 1, #ties, 2 do
+        if ties[i] < ARGV[2] and #posts < count * 2 then
+            table.insert(posts, ties[i])
+            table.insert(posts, ties[i + 1])
+        end
+    end
+    max_score = '(' .. ARGV[1]
+end
+if #posts < count * 2 then
+    local older = redis.call(
+        'ZREVRANGEBYSCORE', KEYS[1], max_score, '(-inf',
+        'WITHSCORES', 'LIMIT', 0, count - #posts / 2
+    )
+    for i = 1, #older do
+        table.insert(posts, older[i])
+    end
+end
+local result = {size}
+for i = 1, #posts, 2 do
+    table.insert(result, posts[i])
+    table.insert(result, posts[i + 1])
+    table.insert(result, redis.call('HGET', KEYS[2], posts[i]) or '')
+end
+return result
+'''
+
+
+class TimelineEntry(NamedTuple):
+    post_id: int
+    user_id: int
+    created_at: datetime
+
+
+class TimelineCursor(NamedTuple):
+    created_at: datetime
+    post_id: int
+
+
+def to_score(value: datetime) -> int:
+    # integer microseconds keep the scores exact
+    timestamp = value.replace(tzinfo=timezone.utc).timestamp()
+    return round(timestamp * 1_000_000)
+
+
+def from_score(value: int) -> datetime:
+    seconds, microseconds = divmod(int(value), 1_000_000)
+    return datetime.utcfromtimestamp(seconds).replace(microsecond=microseconds)
+
+
+def to_member(post_id: int) -> str:
+    # posts with the same score are ordered by member, zero padding makes
+    # that order the same as the order of the post ids
+    return f'{post_id:012d}'
+
+
+@trace_methods
+class TimelineService:
+
+    @classmethod
+    def _get_keys(cls, user_id: int) -> tuple[str, str]:
+        return f'home:{user_id}:timeline', f'home:{user_id}:timeline:actors'
+
+    def __init__(
+            self,
+            db_session: AsyncSession = Depends(get_async_db_session),
+            redis_session: Redis = Depends(get_redis_session)
+    ):
+        self.db_session = db_session
+        self.redis_session = redis_session
+
+    async def _get_followers(self, user_id: int) -> list[int]:
+        query = (
+            select(models.Follower.follower_id)
+                .filter(
+                    (models.Follower.user_id == user_id) &
+                    (models.Follower.is_active)
+                )
+        )
+
+        return (await self.db_session.execute(query)).scalars().all()
+
+    async def _query_entries(
+            self,
+            user_id: int,
+            limit: int,
+            cursor: Optional[TimelineCursor] = None
+    ) -> list[TimelineEntry]:
+        users = (
+            select(models.Follower.user_id)
+                .filter(
+                    (models.Follower.follower_id == user_id) &
+                    (models.Follower.is_active)
+                )
+                .subquery()
+        )
+        all_posts = (
+            select(
+                models.PostRelationship.post_id,
+                func.max(models.PostRelationship.created_at).label('last_created_at')
+            )
+                .join(
+                    users,
+                    users.c.user_id == models.PostRelationship.user_id
+                )
+                .join(
+                    models.Post,
+                    models.Post.id == models.PostRelationship.post_id
+                )
+                .filter(models.Post.is_published)
+                .group_by(models.PostRelationship.post_id)
+                .subquery()
+        )
+        query = (
+            select(
+                models.PostRelationship.post_id,
+                models.PostRelationship.user_id,
+                models.PostRelationship.created_at
+            )
+                .join(
+                    all_posts,
+                    (all_posts.c.post_id == models.PostRelationship.post_id) &
+                    (all_posts.c.last_created_at == models.PostRelationship.created_at)
+                )
+                .join(
+                    users,
+                    users.c.user_id == models.PostRelationship.user_id
+                )
+                .order_by(
+                    desc(models.PostRelationship.created_at),
+                    desc(models.PostRelationship.post_id)
+                )
+                .limit(limit)
+        )
+
+        if cursor is not None:
+            query = query.filter(
+                tuple_(
+                    models.PostRelationship.created_at,
+                    models.PostRelationship.post_id
+                ) < tuple_(cursor.created_at, cursor.post_id)
+            )
+
+        rows = (await self.db_session.execute(query)).all()
+        entries = {}
+
+        for row in rows:
+            entries.setdefault(row.post_id, TimelineEntry(*row))
+
+        return list(entries.values())
+
+    async def rebuild(self, user_id: int) -> None:
+        entries = await self._query_entries(user_id, settings.HOME_TIMELINE_MAX_SIZE)
+        timeline_key, actors_key = self._get_keys(user_id)
+
+        transaction = self.redis_session.multi_exec()
+        transaction.delete(timeline_key, actors_key)
+
+        if entries:
+            pairs = []
+            for entry in entries:
+                pairs.extend((to_score(entry.created_at), to_member(entry.post_id)))
+            transaction.zadd(timeline_key, *pairs)
+            transaction.hmset_dict(
+                actors_key,
+                {to_member(entry.post_id): entry.user_id for entry in entries}
+            )
+            transaction.expire(actors_key, settings.HOME_TIMELINE_EXPIRES)
+        else:
+            # otherwise every read of the timeline would rebuild it again
+            transaction.zadd(timeline_key, float('-inf'), EMPTY_MARKER)
+
+        transaction.expire(timeline_key, settings.HOME_TIMELINE_EXPIRES)
+        await transaction.execute()
+
+    async def read(
+            self,
+            user_id: int,
+            limit: int,
+            cursor: Optional[TimelineCursor] = None
+    ) -> list[TimelineEntry]:
+        if cursor is None:
+            args = ['+inf', '', limit, settings.HOME_TIMELINE_EXPIRES]
+        else:
+            args = [
+                to_score(cursor.created_at),
+                to_member(cursor.post_id),
+                limit,
+                settings.HOME_TIMELINE_EXPIRES
+            ]
+        keys = list(self._get_keys(user_id))
+
+        result = await self.redis_session.eval(READ_SCRIPT, keys=keys, args=args)
+
+        if result is None:
+            await self.rebuild(user_id)
+            result = await self.redis_session.eval(READ_SCRIPT, keys=keys, args=args)
+
+        size, posts = (result[0], result[1:]) if result else (0, [])
+        entries = [
+            TimelineEntry(int(post_id), int(actor_id), from_score(score))
+            for post_id, score, actor_id in zip(*[iter(posts)] * 3)
+            if actor_id
+        ]
+
+        # the timeline is capped, older posts are read from postgres
+        if len(posts) // 3 < limit and size >= settings.HOME_TIMELINE_MAX_SIZE:
+            if posts:
+                cursor = TimelineCursor(from_score(posts[-2]), int(posts[-3]))
+            entries.extend(
+                await self._query_entries(user_id, limit - len(posts) // 3, cursor)
+            )
+
+        return entries
+
+    async def push(self, user_id: int, post_id: int, created_at: datetime) -> None:
+        followers = await self._get_followers(user_id)
+        args = [
+            to_score(created_at),
+            to_member(post_id),
+            user_id,
+            settings.HOME_TIMELINE_MAX_SIZE
+        ]
+
+        for i in range(0, len(followers), FAN_OUT_BATCH_SIZE):
+            keys = []
+            for follower_id in followers[i:i + FAN_OUT_BATCH_SIZE]:
+                keys.extend(self._get_keys(follower_id))
+            await self.redis_session.eval(FAN_OUT_SCRIPT, keys=keys, args=args)
+
+    async def remove(self, post_id: int, user_ids: list[int]) -> None:
+        # the post is in the timelines of the followers of its owner and of
+        # everyone who reposted it
+        query = (
+            select(models.Follower.follower_id)
+                .filter(
+                    (models.Follower.user_id.in_(user_ids)) &
+                    (models.Follower.is_active)
+                )
+                .distinct()
+        )
+        followers = (await self.db_session.execute(query)).scalars().all()
+
+        for i in range(0, len(followers), FAN_OUT_BATCH_SIZE):
+            keys = []
+            for follower_id in followers[i:i + FAN_OUT_BATCH_SIZE]:
+                keys.extend(self._get_keys(follower_id))
+            await self.redis_session.eval(
+                REMOVE_SCRIPT,
+                keys=keys,
+                args=[to_member(post_id)]
+            )
+
+    async def invalidate(self, user_id: int) -> None:
+        await self.redis_session.delete(*self._get_keys(user_id))
+
+    async def invalidate_followers(self, user_id: int) -> None:
+        followers = await self._get_followers(user_id)
+
+        for i in range(0, len(followers), FAN_OUT_BATCH_SIZE):
+            keys = []
+            for follower_id in followers[i:i + FAN_OUT_BATCH_SIZE]:
+                keys.extend(self._get_keys(follower_id))
+            await self.redis_session.delete(*keys)
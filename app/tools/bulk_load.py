@@ -0,0 +1,311 @@
+"""Bulk load users, posts, reposts, follows and likes with COPY.
+
+    python -m app.tools.bulk_load users users.csv [--batch-size 10000] [--workers 4]
+
+A file is either csv with a header or ndjson (*.ndjson, *.jsonl). The ids
+are kept, so that the next files may refer to them:
+
+    users    id, username, email, password or password_hash, date_joined
+    posts    id, user_id, content, created_at
+    reposts  user_id, post_id, created_at
+    follows  follower_id, user_id, created_at
+    likes    user_id, post_id, created_at
+
+The records of a file either all have an id or none of them, the missing
+ids are taken from the sequences. Missing dates are set to now, usernames
+and emails are lowercased as on the sign up. The username filter is rebuilt
+after a users load and the home timelines are invalidated after the posts,
+reposts and follows loads by this command.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+from .. import models, schemas
+from ..core.hashing import hash_password_sync
+from ..database import session
+from .load_user_filter import load_user_filter
+from .reconcile_counters import reconcile_counters
+
+
+Record = dict[str, Any]
+# table, columns, rows
+Copy = tuple[str, list[str], list[tuple]]
+Loader = Callable[[Any, list[Record], Executor], list[Copy]]
+
+
+def _get(record: Record, name: str, default: Any = None) -> Any:
+    value = record.get(name)
+    return default if value is None or value == '' else value
+
+
+def read_records(path: Path) -> Iterator[Record]:
+    with path.open(newline='') as file:
+        if path.suffix in ('.ndjson', '.jsonl'):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(file)
+
+
+def check_ids(records: Iterator[Record]) -> None:
+    # the ids generated for a batch could collide with the explicit ids of
+    # the next ones
+    if len({bool(_get(record, 'id')) for record in records}) > 1:
+        raise ValueError('either all or none of the records must have an id')
+
+
+def advance_sequence(cursor, table: str) -> None:
+    # the loaded ids bypass the sequence, it's moved past them, but never
+    # back, the ids taken by the concurrent inserts aren't reused
+    sequence = "pg_get_serial_sequence(%(table)s, 'id')"
+    cursor.execute(
+        f'SELECT setval({sequence}, greatest('
+        f'max(id), pg_sequence_last_value({sequence})'
+        f') + 1, false) FROM "{table}"',
+        {'table': f'"{table}"'}
+    )
+
+
+def allocate_ids(cursor, table: str, records: list[Record]) -> Iterator[int]:
+    count = sum(not _get(record, 'id') for record in records)
+
+    if not count:
+        return iter(())
+
+    # past the ids of the previous loads
+    advance_sequence(cursor, table)
+    cursor.execute(
+        "SELECT nextval(pg_get_serial_sequence(%s, 'id')) "
+        'FROM generate_series(1, %s)',
+        (f'"{table}"', count)
+    )
+    return iter([row[0] for row in cursor.fetchall()])
+
+
+def copy_rows(cursor, table: str, columns: list[str], rows: list[tuple]) -> None:
+    # an unquoted empty csv field is loaded as NULL
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    column_names = ', '.join(f'"{column}"' for column in columns)
+    cursor.copy_expert(
+        f'COPY "{table}" ({column_names}) FROM STDIN WITH (FORMAT csv)',
+        buffer
+    )
+
+
+def load_users(cursor, records: list[Record], executor: Executor) -> list[Copy]:
+    now = datetime.utcnow().isoformat()
+    passwords = [
+        record['password'] for record in records if not _get(record, 'password_hash')
+    ]
+    # bcrypt is the bottleneck of the whole load, it runs in all the workers
+    password_hashes = executor.map(hash_password_sync, passwords)
+    ids = allocate_ids(cursor, models.User.__tablename__, records)
+
+    rows = []
+    for record in records:
+        user = schemas.BaseUser(username=record['username'], email=record['email'])
+        rows.append((
+            _get(record, 'id') or next(ids),
+            user.username,
+            user.email,
+            _get(record, 'password_hash') or next(password_hashes),
+            _get(record, 'date_joined', now),
+            _get(record, 'is_active', True),
+            False,
+            False
+        ))
+    columns = [
+        'id',
+        'username',
+        'email',
+        'password_hash',
+        'date_joined',
+        'is_active',
+        'is_staff',
+        'is_superuser'
+    ]
+
+    return [(models.User.__tablename__, columns, rows)]
+
+
+def load_posts(cursor, records: list[Record], executor: Executor) -> list[Copy]:
+    now = datetime.utcnow().isoformat()
+    ids = allocate_ids(cursor, models.Post.__tablename__, records)
+
+    posts, relationships = [], []
+
+    for record in records:
+        post_id = _get(record, 'id') or next(ids)
+        created_at = _get(record, 'created_at', now)
+        posts.append((post_id, record['content'], True, created_at, created_at))
+        relationships.append((record['user_id'], post_id, created_at, True))
+
+    return [
+        (
+            models.Post.__tablename__,
+            ['id', 'content', 'is_published', 'created_at', 'updated_at'],
+            posts
+        ),
+        (
+            models.PostRelationship.__tablename__,
+            ['user_id', 'post_id', 'created_at', 'is_owner'],
+            relationships
+        ),
+    ]
+
+
+def load_reposts(cursor, records: list[Record], executor: Executor) -> list[Copy]:
+    now = datetime.utcnow().isoformat()
+    rows = [
+        (record['user_id'], record['post_id'], _get(record, 'created_at', now), False)
+        for record in records
+    ]
+
+    return [
+        (
+            models.PostRelationship.__tablename__,
+            ['user_id', 'post_id', 'created_at', 'is_owner'],
+            rows
+        ),
+    ]
+
+
+def load_follows(cursor, records: list[Record], executor: Executor) -> list[Copy]:
+    now = datetime.utcnow().isoformat()
+    rows = [
+        (
+            record['follower_id'],
+            record['user_id'],
+            _get(record, 'created_at', now),
+            True
+        )
+        for record in records
+    ]
+
+    return [
+        (
+            models.Follower.__tablename__,
+            ['follower_id', 'user_id', 'created_at', 'is_active'],
+            rows
+        ),
+    ]
+
+
+def load_likes(cursor, records: list[Record], executor: Executor) -> list[Copy]:
+    now = datetime.utcnow().isoformat()
+    rows = [
+        (record['user_id'], record['post_id'], _get(record, 'created_at', now), True)
+        for record in records
+    ]
+
+    return [
+        (
+            models.Like.__tablename__,
+            ['user_id', 'post_id', 'created_at', 'is_active'],
+            rows
+        ),
+    ]
+
+
+LOADERS: dict[str, Loader] = {
+    'users': load_users,
+    'posts': load_posts,
+    'reposts': load_reposts,
+    'follows': load_follows,
+    'likes': load_likes,
+}
+
+
+def fix_sequences(cursor) -> None:
+    for table in (models.User.__tablename__, models.Post.__tablename__):
+        advance_sequence(cursor, table)
+
+
+async def invalidate_timelines(batch_size: int) -> int:
+    # the cached home timelines miss the loaded rows, they are rebuilt from
+    # the database on the next read
+    redis = await session.init_redis_pool()
+    keys_count = 0
+
+    try:
+        keys = []
+        async for key in redis.iscan(match='home:*', count=batch_size):
+            keys.append(key)
+            if len(keys) == batch_size:
+                keys_count += await redis.delete(*keys)
+                keys = []
+        if keys:
+            keys_count += await redis.delete(*keys)
+    finally:
+        await session.close_redis_pool()
+
+    return keys_count
+
+
+def bulk_load(kind: str, path: Path, batch_size: int, workers: int) -> int:
+    loader = LOADERS[kind]
+    check_ids(read_records(path))
+    records = read_records(path)
+    loaded = 0
+
+    connection = session.get_engine().raw_connection()
+
+    try:
+        with ProcessPoolExecutor(workers) as executor:
+            # a transaction per batch, a failed load may be resumed from
+            # the first record which isn't in the database
+            while batch := list(islice(records, batch_size)):
+                with connection.cursor() as cursor:
+                    for table, columns, rows in loader(cursor, batch, executor):
+                        copy_rows(cursor, table, columns, rows)
+                connection.commit()
+                loaded += len(batch)
+
+        with connection.cursor() as cursor:
+            fix_sequences(cursor)
+        connection.commit()
+    finally:
+        connection.close()
+
+    # COPY doesn't maintain the denormalized counters
+    if kind in ('reposts', 'likes'):
+        reconcile_counters(batch_size)
+
+    return loaded
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('kind', choices=LOADERS)
+    parser.add_argument('path', type=Path)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=4, help='bcrypt processes')
+    args = parser.parse_args()
+
+    loaded = bulk_load(args.kind, args.path, args.batch_size, args.workers)
+    print(f'{loaded} {args.kind} loaded')
+
+    # nor the username filter, which would report the new users as available
+    if args.kind == 'users':
+        users_count = asyncio.run(load_user_filter(args.batch_size))
+        print(f'{users_count} users loaded into the username filter')
+
+    if args.kind in ('posts', 'reposts', 'follows'):
+        keys_count = asyncio.run(invalidate_timelines(args.batch_size))
+        print(f'{keys_count} timeline keys invalidated')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Expire the legacy refresh token sets keyed by the bare username.
+
+    python -m app.tools.expire_refresh_tokens [--batch-size 10000]
+
+The sets were never given a ttl. Every token in them expires within
+JWT_REFRESH_TOKEN_EXPIRES, so the sets are expired after the same time and
+the sessions can still be rotated into the sorted sets until then.
+"""
+import argparse
+import asyncio
+
+from sqlalchemy import select
+
+from .. import models
+from ..core import settings
+from ..database import session
+from ..services.auth import AuthService
+
+
+# KEYS: legacy refresh tokens of the user
+# ARGV: ttl
+EXPIRE_SCRIPT = """
+if redis.call('TYPE', KEYS[1])['ok'] == 'set'
+        and redis.call('TTL', KEYS[1]) == -1 then
+    return redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+
+async def expire_refresh_tokens(batch_size: int) -> int:
+    redis = await session.init_redis_pool()
+    sets_count = 0
+
+    try:
+        query = select(models.User.username)
+        async with session.get_async_engine().connect() as connection:
+            result = await connection.stream(query)
+            async for users in result.partitions(batch_size):
+                pipeline = redis.pipeline()
+                for user in users:
+                    pipeline.eval(
+                        EXPIRE_SCRIPT,
+                        keys=[
+                            AuthService.get_legacy_refresh_tokens_key(
+                                user.username
+                            )
+                        ],
+                        args=[settings.JWT_REFRESH_TOKEN_EXPIRES]
+                    )
+                sets_count += sum(await pipeline.execute())
+    finally:
+        await session.close_redis_pool()
+        await session.dispose_async_engine()
+
+    return sets_count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    sets_count = asyncio.run(expire_refresh_tokens(args.batch_size))
+    print(f'{sets_count} refresh token sets expired')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Apply the buffered like toggles to postgres.
+
+    python -m app.tools.flush_likes [--batch-size 1000] [--block 1000]
+
+Several workers may run at once for availability, but only the one which
+holds the lease reads the stream: toggles of the same (user, post) in two
+concurrent batches could be committed out of order.
+"""
+import argparse
+import asyncio
+import uuid
+
+from aioredis import ReplyError, Redis
+
+from ..database import session
+from ..services.like_buffer import coalesce, flush, GROUP_NAME, STREAM_KEY
+
+
+# the pending entries of the group belong to one consumer name, so a worker
+# which takes over the lease reads the entries of a crashed one first
+CONSUMER_NAME = 'flush_likes'
+LEASE_KEY = 'likes:lease'
+LEASE_TIMEOUT = 30000  # 30 sec.
+
+# takes the lease if it's free and extends it if it's ours
+LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return 1
+end
+return 0
+"""
+
+
+async def hold_lease(redis: Redis, token: str) -> bool:
+    is_held = await redis.eval(
+        LEASE_SCRIPT,
+        keys=[LEASE_KEY],
+        args=[token, LEASE_TIMEOUT]
+    )
+
+    return bool(is_held)
+
+
+async def flush_likes(batch_size: int, block: int) -> None:
+    redis = await session.init_redis_pool()
+    token = uuid.uuid4().hex
+
+    try:
+        await redis.xgroup_create(
+            STREAM_KEY,
+            GROUP_NAME,
+            latest_id='0',
+            mkstream=True
+        )
+    except ReplyError:
+        pass  # the group already exists
+
+    # the entries delivered before a restart or a takeover come first
+    latest_id = '0'
+
+    try:
+        while True:
+            if not await hold_lease(redis, token):
+                latest_id = '0'
+                await asyncio.sleep(block / 1000)
+                continue
+
+            entries = await redis.xread_group(
+                GROUP_NAME,
+                CONSUMER_NAME,
+                [STREAM_KEY],
+                timeout=block,
+                count=batch_size,
+                latest_ids=[latest_id]
+            )
+
+            if not entries:
+                latest_id = '>'
+                continue
+
+            is_applied = False
+            async for db_session in session.get_async_db_session():
+                await flush(db_session, coalesce(entries))
+                # a worker which has taken over a stalled lease applies these
+                # entries again, this transaction is rolled back instead
+                is_applied = await hold_lease(redis, token)
+                if is_applied:
+                    await db_session.commit()
+
+            if not is_applied:
+                latest_id = '0'
+                continue
+
+            ids = [entry_id for _, entry_id, _ in entries]
+            await redis.xack(STREAM_KEY, GROUP_NAME, *ids)
+            await redis.execute('XDEL', STREAM_KEY, *ids)
+    finally:
+        await session.close_redis_pool()
+        await session.dispose_async_engine()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--block', type=int, default=1000, help='ms')
+    args = parser.parse_args()
+
+    asyncio.run(flush_likes(args.batch_size, args.block))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Load the usernames and emails of all the users into the bloom filter.
+
+    python -m app.tools.load_user_filter [--batch-size 10000]
+"""
+import argparse
+import asyncio
+
+from sqlalchemy import select
+
+from .. import models
+from ..database import session
+from ..services.availability import (
+    BUILDING_FILTER_KEY,
+    FILTER_KEY,
+    get_filter_size,
+    get_offsets,
+    get_values
+)
+
+
+async def load_user_filter(batch_size: int) -> int:
+    redis = await session.init_redis_pool()
+    bits, _ = get_filter_size()
+    users_count = 0
+
+    # registrations write to the building key as soon as it exists
+    await redis.delete(BUILDING_FILTER_KEY)
+    await redis.setbit(BUILDING_FILTER_KEY, bits - 1, 0)
+
+    try:
+        query = select(models.User.username, models.User.email)
+        async with session.get_async_engine().connect() as connection:
+            result = await connection.stream(query)
+            async for users in result.partitions(batch_size):
+                pipeline = redis.pipeline()
+                for user in users:
+                    for value in get_values(user.username, user.email):
+                        for offset in get_offsets(value):
+                            pipeline.setbit(BUILDING_FILTER_KEY, offset, 1)
+                await pipeline.execute()
+                users_count += len(users)
+
+        await redis.rename(BUILDING_FILTER_KEY, FILTER_KEY)
+    finally:
+        await redis.delete(BUILDING_FILTER_KEY)
+        await session.close_redis_pool()
+        await session.dispose_async_engine()
+
+    return users_count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    users_count = asyncio.run(load_user_filter(args.batch_size))
+    print(f'{users_count} users loaded')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Dispatch the outbox events to their handlers.
+
+    python -m app.tools.outbox_worker [--batch-size 100] [--poll-interval 1.0]
+
+Several workers may run at once, the events are locked with SKIP LOCKED.
+"""
+import argparse
+import asyncio
+import logging
+
+from ..database import session
+from ..services.outbox import process_batch
+
+
+logger = logging.getLogger(__name__)
+
+
+async def run_worker(batch_size: int, poll_interval: float) -> None:
+    redis = await session.init_redis_pool()
+
+    try:
+        while True:
+            processed = 0
+
+            try:
+                async for db_session in session.get_async_db_session():
+                    processed = await process_batch(db_session, redis, batch_size)
+            except Exception:
+                # the batch is rolled back and retried on the next poll
+                logger.exception('failed to process the outbox events')
+
+            if processed < batch_size:
+                await asyncio.sleep(poll_interval)
+    finally:
+        await session.close_redis_pool()
+        await session.dispose_async_engine()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='s')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_worker(args.batch_size, args.poll_interval))
+
+
+if __name__ == '__main__':
+    main()
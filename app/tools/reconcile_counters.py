@@ -0,0 +1,73 @@
+"""Repair blog post like and repost counters which drifted from the source rows.
+
+    python -m app.tools.reconcile_counters [--batch-size 10000]
+"""
+import argparse
+
+from sqlalchemy import func, select, update
+
+from .. import models
+from ..database.session import get_engine
+
+
+def reconcile_counters(batch_size: int) -> int:
+    likes_count = (
+        select(func.count())
+            .select_from(models.Like)
+            .filter(
+                (models.Like.post_id == models.Post.id) &
+                (models.Like.is_active)
+            )
+            .scalar_subquery()
+    )
+    reposts_count = (
+        select(func.count())
+            .select_from(models.PostRelationship)
+            .filter(
+                (models.PostRelationship.post_id == models.Post.id) &
+                (~models.PostRelationship.is_owner)
+            )
+            .scalar_subquery()
+    )
+
+    engine = get_engine()
+    repaired = 0
+
+    with engine.connect() as connection:
+        max_id = connection.execute(select(func.max(models.Post.id))).scalar() or 0
+
+    # short transactions, so that writers aren't blocked for long
+    for first_id in range(0, max_id + 1, batch_size):
+        query = (
+            update(models.Post)
+                .filter(
+                    (models.Post.id >= first_id) &
+                    (models.Post.id < first_id + batch_size) &
+                    (
+                        (models.Post.likes_count != likes_count) |
+                        (models.Post.reposts_count != reposts_count)
+                    )
+                )
+                .values(
+                    likes_count=likes_count,
+                    reposts_count=reposts_count,
+                    updated_at=models.Post.updated_at
+                )
+        )
+        with engine.begin() as connection:
+            repaired += connection.execute(query).rowcount
+
+    return repaired
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    repaired = reconcile_counters(args.batch_size)
+    print(f'{repaired} blog posts repaired')
+
+
+if __name__ == '__main__':
+    main()
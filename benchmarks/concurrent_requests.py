@@ -0,0 +1,125 @@
+"""Throughput of concurrent /home and /posts/create requests.
+
+Run against a started api, e.g.:
+
+    python benchmarks/concurrent_requests.py --url http://localhost:8080
+
+The api should run with RATE_LIMIT_ENABLED=false, every benchmark user
+creates more posts than the default policy allows.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+from httpx import AsyncClient
+
+
+async def sign_up(client: AsyncClient, username: str) -> str:
+    user = {
+        'username': username,
+        'email': f'{username}@example.com',
+        'password': '1Password'
+    }
+    response = await client.post('/api/v1/auth/sign-up', content=json.dumps(user))
+    response.raise_for_status()
+
+    return response.json()['access_token']
+
+
+async def prepare_users(client: AsyncClient, users_count: int) -> list[str]:
+    prefix = uuid.uuid4().hex[:8]
+    tokens = [
+        await sign_up(client, f'bench_{prefix}_{i}') for i in range(users_count)
+    ]
+
+    # every user follows every other user so that /home has content
+    for i, token in enumerate(tokens):
+        headers = {'Authorization': f'Bearer {token}', }
+        for j in range(users_count):
+            if i != j:
+                await client.post(
+                    f'/api/v1/users/bench_{prefix}_{j}/follow',
+                    headers=headers
+                )
+
+    return tokens
+
+
+async def run(
+        url: str,
+        requests_count: int,
+        concurrency: int,
+        users_count: int,
+        home_mode: str
+) -> dict:
+    async with AsyncClient(base_url=url, timeout=60) as client:
+        tokens = await prepare_users(client, users_count)
+        semaphore = asyncio.Semaphore(concurrency)
+        timings = {'home': [], 'create': []}
+
+        async def request(i: int) -> None:
+            headers = {'Authorization': f'Bearer {tokens[i % users_count]}', }
+            async with semaphore:
+                started_at = time.perf_counter()
+                if i % 2:
+                    route = 'create'
+                    response = await client.post(
+                        '/api/v1/posts/create',
+                        headers=headers,
+                        content=json.dumps({'content': f'benchmark post {i}'})
+                    )
+                else:
+                    route = 'home'
+                    response = await client.get(
+                        '/api/v1/home',
+                        headers=headers,
+                        params={'mode': home_mode}
+                    )
+                response.raise_for_status()
+                timings[route].append(time.perf_counter() - started_at)
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*(request(i) for i in range(requests_count)))
+        elapsed = time.perf_counter() - started_at
+
+    result = {
+        'requests': requests_count,
+        'concurrency': concurrency,
+        'home_mode': home_mode,
+        'elapsed': round(elapsed, 3),
+        'rps': round(requests_count / elapsed, 1),
+    }
+    for route, values in timings.items():
+        values.sort()
+        result[route] = {
+            'mean_ms': round(statistics.mean(values) * 1000, 2),
+            'p95_ms': round(values[int(len(values) * 0.95) - 1] * 1000, 2),
+        }
+
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:8080')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument(
+        '--home-mode',
+        choices=['timeline', 'query'],
+        default='timeline'
+    )
+    args = parser.parse_args()
+
+    result = asyncio.run(
+        run(args.url, args.requests, args.concurrency, args.users, args.home_mode)
+    )
+    print(json.dumps(result, indent=4))
+
+
+if __name__ == '__main__':
+    main()
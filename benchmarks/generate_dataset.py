@@ -0,0 +1,184 @@
+"""Seeded synthetic social graph in the app.tools.bulk_load format.
+
+    python benchmarks/generate_dataset.py --users 100000 --output dataset
+    python -m app.tools.bulk_load users dataset/users.csv
+    python -m app.tools.bulk_load posts dataset/posts.ndjson
+    python -m app.tools.bulk_load reposts dataset/reposts.csv
+    python -m app.tools.bulk_load follows dataset/follows.csv
+    python -m app.tools.bulk_load likes dataset/likes.csv
+
+The ids start from 1, so the dataset is loaded into an empty database.
+Popularity follows a power law: the user with rank r gets followers,
+likes and reposts in proportion to 1 / r ** alpha. Every user signs in
+as user_<id> with the password 1Password.
+"""
+import argparse
+import csv
+import json
+import random
+from bisect import bisect
+from datetime import datetime, timedelta
+from itertools import accumulate
+from pathlib import Path
+
+from passlib.hash import bcrypt
+
+
+PASSWORD = '1Password'
+
+
+class PowerLaw:
+
+    def __init__(self, size: int, alpha: float, rng: random.Random):
+        self.rng = rng
+        self.cum_weights = list(
+            accumulate(1 / rank ** alpha for rank in range(1, size + 1))
+        )
+        # ranks are shuffled, so that popularity doesn't follow the ids
+        self.ids = list(range(1, size + 1))
+        rng.shuffle(self.ids)
+
+    def sample(self, count: int, exclude: int) -> set[int]:
+        # rejection sampling, so no more than a half of all the ids
+        count = min(count, (len(self.ids) - 1) // 2)
+        total = self.cum_weights[-1]
+        result = set()
+
+        while len(result) < count:
+            index = bisect(self.cum_weights, self.rng.random() * total)
+            value = self.ids[min(index, len(self.ids) - 1)]
+            if value != exclude:
+                result.add(value)
+
+        return result
+
+
+def generate(
+        output: Path,
+        users_count: int,
+        posts_per_user: float,
+        follows_per_user: float,
+        likes_per_post: float,
+        reposts_per_post: float,
+        alpha: float,
+        days: int,
+        seed: int
+) -> dict:
+    rng = random.Random(seed)
+    popularity = PowerLaw(users_count, alpha, rng)
+    now = datetime.utcnow().replace(microsecond=0)
+    started_at = now - timedelta(days=days)
+    password_hash = bcrypt.hash(PASSWORD)
+    output.mkdir(parents=True, exist_ok=True)
+
+    def random_time(after: datetime) -> datetime:
+        return after + (now - after) * rng.random()
+
+    def write_csv(name: str, header: list[str]):
+        file = (output / name).open('w', newline='')
+        writer = csv.writer(file)
+        writer.writerow(header)
+        return file, writer
+
+    counts = dict.fromkeys(('users', 'posts', 'reposts', 'follows', 'likes'), 0)
+    users_file, users = write_csv(
+        'users.csv',
+        ['id', 'username', 'email', 'password_hash', 'date_joined']
+    )
+    follows_file, follows = write_csv(
+        'follows.csv',
+        ['follower_id', 'user_id', 'created_at']
+    )
+    reposts_file, reposts = write_csv(
+        'reposts.csv',
+        ['user_id', 'post_id', 'created_at']
+    )
+    likes_file, likes = write_csv('likes.csv', ['user_id', 'post_id', 'created_at'])
+    posts = (output / 'posts.ndjson').open('w')
+
+    try:
+        for user_id in range(1, users_count + 1):
+            users.writerow((
+                user_id,
+                f'user_{user_id}',
+                f'user_{user_id}@example.com',
+                password_hash,
+                started_at.isoformat()
+            ))
+            counts['users'] += 1
+
+            # the number of followed users is skewed as well, a few users
+            # follow thousands of others
+            follows_count = int(rng.paretovariate(2) * follows_per_user / 2)
+            for followed_id in popularity.sample(follows_count, exclude=user_id):
+                follows.writerow((user_id, followed_id, started_at.isoformat()))
+                counts['follows'] += 1
+
+            for _ in range(int(rng.expovariate(1 / posts_per_user))):
+                counts['posts'] += 1
+                post_id = counts['posts']
+                created_at = random_time(started_at)
+                posts.write(json.dumps({
+                    'id': post_id,
+                    'user_id': user_id,
+                    'content': f'post {post_id} by user_{user_id}',
+                    'created_at': created_at.isoformat(),
+                }) + '\n')
+
+                likes_count = int(rng.expovariate(1 / likes_per_post))
+                for liker_id in popularity.sample(likes_count, exclude=user_id):
+                    likes.writerow(
+                        (liker_id, post_id, random_time(created_at).isoformat())
+                    )
+                    counts['likes'] += 1
+
+                reposts_count = int(rng.expovariate(1 / reposts_per_post))
+                for reposter_id in popularity.sample(reposts_count, exclude=user_id):
+                    reposts.writerow(
+                        (reposter_id, post_id, random_time(created_at).isoformat())
+                    )
+                    counts['reposts'] += 1
+    finally:
+        for file in (users_file, follows_file, reposts_file, likes_file, posts):
+            file.close()
+
+    manifest = {
+        'seed': seed,
+        'alpha': alpha,
+        'password': PASSWORD,
+        **counts,
+    }
+    (output / 'manifest.json').write_text(json.dumps(manifest, indent=4))
+
+    return manifest
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', type=Path, default=Path('dataset'))
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--posts-per-user', type=float, default=20)
+    parser.add_argument('--follows-per-user', type=float, default=50)
+    parser.add_argument('--likes-per-post', type=float, default=5)
+    parser.add_argument('--reposts-per-post', type=float, default=0.5)
+    parser.add_argument('--alpha', type=float, default=1.0, help='power law exponent')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    manifest = generate(
+        args.output,
+        args.users,
+        args.posts_per_user,
+        args.follows_per_user,
+        args.likes_per_post,
+        args.reposts_per_post,
+        args.alpha,
+        args.days,
+        args.seed
+    )
+    print(json.dumps(manifest, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Throughput of concurrent like/dislike toggles on a single post.
+
+Run against a started api twice, with LIKES_WRITE_BEHIND=false and with
+LIKES_WRITE_BEHIND=true plus a running flush_likes worker (RATE_LIMIT_ENABLED
+should be false for both):
+
+    python benchmarks/like_throughput.py --url http://localhost:8080
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+from httpx import AsyncClient
+
+from concurrent_requests import sign_up
+
+
+async def run(
+        url: str,
+        requests_count: int,
+        concurrency: int,
+        users_count: int
+) -> dict:
+    async with AsyncClient(base_url=url, timeout=60) as client:
+        prefix = uuid.uuid4().hex[:8]
+        author = f'bench_{prefix}_author'
+        author_token = await sign_up(client, author)
+        response = await client.post(
+            '/api/v1/posts/create',
+            headers={'Authorization': f'Bearer {author_token}', },
+            content=json.dumps({'content': 'viral post'})
+        )
+        response.raise_for_status()
+        post_id = response.json()['id']
+
+        tokens = [
+            await sign_up(client, f'bench_{prefix}_{i}') for i in range(users_count)
+        ]
+        semaphore = asyncio.Semaphore(concurrency)
+        timings = []
+
+        async def request(i: int) -> None:
+            headers = {'Authorization': f'Bearer {tokens[i % users_count]}', }
+            async with semaphore:
+                started_at = time.perf_counter()
+                # every user likes and dislikes the post in turns
+                if (i // users_count) % 2:
+                    response = await client.put(
+                        f'/api/v1/users/{author}/{post_id}/dislike',
+                        headers=headers
+                    )
+                else:
+                    response = await client.post(
+                        f'/api/v1/users/{author}/{post_id}/like',
+                        headers=headers
+                    )
+                response.raise_for_status()
+                timings.append(time.perf_counter() - started_at)
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*(request(i) for i in range(requests_count)))
+        elapsed = time.perf_counter() - started_at
+
+    timings.sort()
+
+    return {
+        'requests': requests_count,
+        'concurrency': concurrency,
+        'elapsed': round(elapsed, 3),
+        'rps': round(requests_count / elapsed, 1),
+        'mean_ms': round(statistics.mean(timings) * 1000, 2),
+        'p95_ms': round(timings[int(len(timings) * 0.95) - 1] * 1000, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:8080')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--users', type=int, default=50)
+    args = parser.parse_args()
+
+    result = asyncio.run(
+        run(args.url, args.requests, args.concurrency, args.users)
+    )
+    print(json.dumps(result, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+"""Replay a mix of requests against an api loaded with a generated dataset.
+
+    python benchmarks/generate_dataset.py --output dataset
+    (load it with app.tools.bulk_load, start the api)
+    python benchmarks/load_test.py --dataset dataset --output before.json
+    python benchmarks/load_test.py --dataset dataset --baseline before.json
+
+The api should run with RATE_LIMIT_ENABLED=false. Every run is saved as
+json together with the current commit, --baseline prints the change of
+each route against an earlier run.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import statistics
+import subprocess
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from httpx import AsyncClient, HTTPError
+
+
+ROUTES = ('home', 'create', 'like', 'follow')
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    mix = {}
+
+    for item in value.split(','):
+        route, weight = item.split('=')
+        if route not in ROUTES:
+            raise argparse.ArgumentTypeError(f'unknown route {route}')
+        mix[route] = float(weight)
+
+    return mix
+
+
+def sample_posts(path: Path, count: int, rng: random.Random) -> list[tuple[int, int]]:
+    # reservoir sampling, the posts file doesn't have to fit in memory
+    posts = []
+
+    with path.open() as file:
+        for i, line in enumerate(file):
+            post = json.loads(line)
+            if i < count:
+                posts.append((post['id'], post['user_id']))
+            elif (j := rng.randrange(i + 1)) < count:
+                posts[j] = (post['id'], post['user_id'])
+
+    return posts
+
+
+def percentile(values: list[float], q: float) -> float:
+    # nearest rank, values are sorted
+    return values[max(math.ceil(q * len(values)) - 1, 0)]
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            check=True,
+            capture_output=True,
+            text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def sign_in(client: AsyncClient, username: str, password: str) -> str:
+    response = await client.post(
+        '/api/v1/auth/sign-in',
+        data={'username': username, 'password': password}
+    )
+    response.raise_for_status()
+
+    return response.json()['access_token']
+
+
+async def run(
+        url: str,
+        dataset: Path,
+        requests_count: int,
+        concurrency: int,
+        users_count: int,
+        mix: dict[str, float],
+        seed: int
+) -> dict:
+    rng = random.Random(seed)
+    manifest = json.loads((dataset / 'manifest.json').read_text())
+    posts = sample_posts(dataset / 'posts.ndjson', 10000, rng)
+    user_ids = rng.sample(range(1, manifest['users'] + 1), users_count)
+    routes, weights = zip(*mix.items())
+    schedule = rng.choices(routes, weights, k=requests_count)
+
+    async with AsyncClient(base_url=url, timeout=60) as client:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def authorize(user_id: int) -> str:
+            async with semaphore:
+                return await sign_in(client, f'user_{user_id}', manifest['password'])
+
+        tokens = await asyncio.gather(*(authorize(i) for i in user_ids))
+        timings = {route: [] for route in routes}
+        errors = dict.fromkeys(routes, 0)
+
+        def send(i: int, route: str):
+            headers = {'Authorization': f'Bearer {tokens[i % users_count]}', }
+
+            if route == 'home':
+                return client.get('/api/v1/home', headers=headers)
+            if route == 'create':
+                return client.post(
+                    '/api/v1/posts/create',
+                    headers=headers,
+                    content=json.dumps({'content': f'load test post {i}'})
+                )
+            if route == 'like':
+                post_id, author_id = rng.choice(posts)
+                return client.post(
+                    f'/api/v1/users/user_{author_id}/{post_id}/like',
+                    headers=headers
+                )
+            user_id = rng.randint(1, manifest['users'])
+            return client.post(f'/api/v1/users/user_{user_id}/follow', headers=headers)
+
+        async def request(i: int, route: str) -> None:
+            async with semaphore:
+                started_at = time.perf_counter()
+                try:
+                    response = await send(i, route)
+                    response.raise_for_status()
+                except HTTPError:
+                    errors[route] += 1
+                    return
+                timings[route].append(time.perf_counter() - started_at)
+
+        started_at = time.perf_counter()
+        await asyncio.gather(
+            *(request(i, route) for i, route in enumerate(schedule))
+        )
+        elapsed = time.perf_counter() - started_at
+
+    result = {
+        'commit': get_commit(),
+        'started_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'dataset': manifest,
+        'requests': requests_count,
+        'concurrency': concurrency,
+        'users': users_count,
+        'mix': mix,
+        'elapsed': round(elapsed, 3),
+        'rps': round(requests_count / elapsed, 1),
+        'routes': {},
+    }
+    for route, values in timings.items():
+        values.sort()
+        result['routes'][route] = {
+            'requests': len(values),
+            'errors': errors[route],
+            'rps': round(len(values) / elapsed, 1),
+        }
+        if values:
+            result['routes'][route].update(
+                mean_ms=round(statistics.mean(values) * 1000, 2),
+                p50_ms=round(percentile(values, 0.5) * 1000, 2),
+                p95_ms=round(percentile(values, 0.95) * 1000, 2),
+                p99_ms=round(percentile(values, 0.99) * 1000, 2)
+            )
+
+    return result
+
+
+def compare(result: dict, baseline: dict) -> dict:
+    # relative change, e.g. -0.2 is 20% lower than the baseline
+    changes = {}
+
+    for route, values in result['routes'].items():
+        base_values = baseline['routes'].get(route, {})
+        changes[route] = {
+            name: round(value / base_values[name] - 1, 3)
+            for name, value in values.items()
+            if name in ('rps', 'p50_ms', 'p95_ms', 'p99_ms') and base_values.get(name)
+        }
+
+    return {'baseline': baseline.get('commit'), 'changes': changes}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:8080')
+    parser.add_argument('--dataset', type=Path, default=Path('dataset'))
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument(
+        '--mix',
+        type=parse_mix,
+        default='home=60,create=10,like=25,follow=5'
+    )
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', type=Path)
+    parser.add_argument('--baseline', type=Path)
+    args = parser.parse_args()
+
+    result = asyncio.run(
+        run(
+            args.url,
+            args.dataset,
+            args.requests,
+            args.concurrency,
+            args.users,
+            args.mix,
+            args.seed
+        )
+    )
+
+    if args.output:
+        args.output.write_text(json.dumps(result, indent=4))
+    if args.baseline:
+        result = compare(result, json.loads(args.baseline.read_text()))
+
+    print(json.dumps(result, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Cost of the prometheus middleware per request.
+
+Calls a no-op asgi app with and without MetricsMiddleware in a loop, no
+server or database is involved:
+
+    python benchmarks/metrics_overhead.py --requests 100000
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from types import SimpleNamespace
+
+from app.core.metrics import MetricsMiddleware
+
+
+async def endpoint():
+    pass
+
+
+async def asgi_app(scope, receive, send) -> None:
+    scope['endpoint'] = endpoint
+    await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def receive() -> dict:
+    return {'type': 'http.request', 'body': b''}
+
+
+async def send(message: dict) -> None:
+    pass
+
+
+async def measure(app, requests_count: int) -> float:
+    router = SimpleNamespace(routes=[SimpleNamespace(endpoint=endpoint, path='/')])
+    started_at = time.perf_counter()
+
+    for _ in range(requests_count):
+        scope = {'type': 'http', 'method': 'GET', 'path': '/', 'app': router}
+        await app(scope, receive, send)
+
+    return (time.perf_counter() - started_at) / requests_count
+
+
+async def run(requests_count: int, runs: int) -> dict:
+    middleware = MetricsMiddleware(asgi_app)
+    overheads = []
+
+    for _ in range(runs):
+        bare = await measure(asgi_app, requests_count)
+        instrumented = await measure(middleware, requests_count)
+        overheads.append(instrumented - bare)
+
+    return {
+        'requests': requests_count,
+        'runs': runs,
+        'median_overhead_us': round(statistics.median(overheads) * 1_000_000, 2),
+        'max_overhead_us': round(max(overheads) * 1_000_000, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=100000)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args.requests, args.runs)), indent=4))
+
+
+if __name__ == '__main__':
+    main()
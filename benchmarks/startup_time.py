@@ -0,0 +1,75 @@
+"""Cold start cost of an api worker.
+
+Every run happens in a fresh interpreter, the way uvicorn boots a worker:
+
+    python benchmarks/startup_time.py --runs 10
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+
+SCRIPT = '''
+import asyncio
+import json
+import time
+
+started_at = time.perf_counter()
+from app.main import create_app
+imported_at = time.perf_counter()
+app = create_app()
+created_at = time.perf_counter()
+result = {
+    'import': imported_at - started_at,
+    'create_app': created_at - imported_at,
+}
+
+if RUN_STARTUP:
+    async def lifespan():
+        started_at = time.perf_counter()
+        await app.router.startup()
+        result['startup'] = time.perf_counter() - started_at
+        await app.router.shutdown()
+
+    asyncio.run(lifespan())
+
+print(json.dumps(result))
+'''
+
+
+def measure(startup: bool) -> dict[str, float]:
+    output = subprocess.run(
+        [sys.executable, '-c', SCRIPT.replace('RUN_STARTUP', str(startup))],
+        check=True,
+        capture_output=True,
+        text=True
+    ).stdout
+
+    return json.loads(output.splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument(
+        '--no-startup',
+        action='store_true',
+        help="don't run the startup hooks (no postgres/redis required)"
+    )
+    args = parser.parse_args()
+
+    runs = [measure(not args.no_startup) for _ in range(args.runs)]
+    result = {
+        name: {
+            'median_ms': round(statistics.median(i[name] for i in runs) * 1000, 2),
+            'max_ms': round(max(i[name] for i in runs) * 1000, 2),
+        }
+        for name in runs[0]
+    }
+    print(json.dumps(result, indent=4))
+
+
+if __name__ == '__main__':
+    main()
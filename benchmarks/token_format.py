@@ -0,0 +1,71 @@
+"""Size and decode cost of the legacy and the compact access tokens.
+
+No services are required:
+
+    python benchmarks/token_format.py --runs 10000
+"""
+import argparse
+import json
+import timeit
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from jose import jwt
+
+from app import schemas
+from app.core import settings
+from app.services.auth import AuthService
+
+
+def create_legacy_token(user: schemas.User) -> str:
+    # the format issued before the compact claims
+    now = datetime.utcnow()
+    payload = {
+        'iat': now,
+        'nbf': now,
+        'exp': now + timedelta(seconds=settings.JWT_ACCESS_TOKEN_EXPIRES),
+        'user': jsonable_encoder(user),
+    }
+
+    return jwt.encode(
+        payload,
+        settings.JWT_SECRET_KEY,
+        algorithm=settings.JWT_ALGORITHM
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10000)
+    args = parser.parse_args()
+
+    user = schemas.User(
+        id=123456,
+        username='benchmark_user',
+        email='benchmark_user@example.com',
+        date_joined=datetime.utcnow()
+    )
+    tokens = {
+        'legacy': create_legacy_token(user),
+        'compact': AuthService.create_token(
+            schemas.Principal(user.id, user.username),
+            settings.JWT_ACCESS_TOKEN_EXPIRES
+        ),
+    }
+
+    result = {}
+    for name, token in tokens.items():
+        # decode and validate without the verified-token cache
+        def decode() -> None:
+            AuthService._parse_principal(AuthService.verify_token(token))
+
+        seconds = timeit.timeit(decode, number=args.runs)
+        result[name] = {
+            'header_bytes': len(f'Authorization: Bearer {token}'),
+            'decode_us': round(seconds / args.runs * 1_000_000, 2),
+        }
+    print(json.dumps(result, indent=4))
+
+
+if __name__ == '__main__':
+    main()
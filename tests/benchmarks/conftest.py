@@ -0,0 +1,92 @@
+from typing import NamedTuple
+
+import pytest
+from passlib.hash import bcrypt
+from sqlalchemy import text
+
+from app.database import session
+from app.database.query_stats import track_queries
+
+
+# Every table gets about --benchmark-scale rows: posts, owners, likes and
+# follows (ten per user), with a tenth as many users. The dataset is
+# seeded once per run with INSERT ... SELECT generate_series.
+
+FOLLOWS_PER_USER = 10
+
+SEED_STATEMENTS = (
+    'TRUNCATE "user", blog_post, outbox_event RESTART IDENTITY CASCADE',
+    'INSERT INTO "user" '
+    '(id, username, email, password_hash, date_joined, is_active, is_staff, '
+    'is_superuser) '
+    "SELECT i, 'user_' || i, 'user_' || i || '@example.com', :password_hash, "
+    'now(), true, false, false '
+    'FROM generate_series(1, :users) AS i',
+    'INSERT INTO blog_post '
+    '(id, content, is_published, likes_count, reposts_count, created_at, '
+    'updated_at) '
+    "SELECT i, 'post ' || i, true, 0, 0, now() - i * interval '1 second', "
+    "now() - i * interval '1 second' "
+    'FROM generate_series(1, :rows) AS i',
+    'INSERT INTO blog_post_relationship (user_id, post_id, created_at, is_owner) '
+    "SELECT i % :users + 1, i, now() - i * interval '1 second', true "
+    'FROM generate_series(1, :rows) AS i',
+    'INSERT INTO follower (follower_id, user_id, created_at, is_active) '
+    'SELECT u, (u + f - 1) % :users + 1, now(), true '
+    'FROM generate_series(1, :users) AS u, generate_series(1, :follows) AS f',
+    # 7919 is prime, so the (user, post) pairs are unique
+    'INSERT INTO blog_post_like (user_id, post_id, created_at, is_active) '
+    'SELECT (i - 1) % :users + 1, (i * 7919) % :rows + 1, now(), true '
+    'FROM generate_series(1, :rows) AS i',
+    'UPDATE blog_post SET likes_count = likes.count '
+    'FROM (SELECT post_id, count(*) FROM blog_post_like GROUP BY post_id) AS likes '
+    'WHERE likes.post_id = blog_post.id',
+    "SELECT setval(pg_get_serial_sequence('\"user\"', 'id'), :users)",
+    "SELECT setval(pg_get_serial_sequence('blog_post', 'id'), :rows)",
+    'ANALYZE',
+)
+
+
+class Dataset(NamedTuple):
+    rows: int
+    users: int
+
+
+@pytest.fixture(scope='session')
+def dataset(request) -> Dataset:
+    rows = request.config.getoption('--benchmark-scale')
+    users = max(rows // 10, FOLLOWS_PER_USER * 10)
+    params = {
+        'rows': rows,
+        'users': users,
+        'follows': FOLLOWS_PER_USER,
+        'password_hash': bcrypt.hash('1Password'),
+    }
+
+    # ANALYZE can't run inside a transaction block
+    engine = session.get_engine().execution_options(isolation_level='AUTOCOMMIT')
+
+    with engine.connect() as connection:
+        for statement in SEED_STATEMENTS:
+            connection.execute(text(statement), params)
+
+    return Dataset(rows, users)
+
+
+@pytest.fixture
+def run(event_loop):
+    return event_loop.run_until_complete
+
+
+@pytest.fixture
+async def async_db_session():
+    async for db_session in session.get_async_db_session():
+        yield db_session
+
+    await session.dispose_async_engine()
+
+
+@pytest.fixture
+def count_statements():
+    with track_queries() as stats:
+        yield stats
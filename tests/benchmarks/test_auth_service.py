@@ -0,0 +1,27 @@
+import pytest
+
+from app import schemas
+from app.core import settings
+from app.services.auth import AuthService, clear_token_cache
+
+
+@pytest.mark.parametrize('is_cached', [True, False])
+def test_get_user(benchmark, count_statements, is_cached):
+    token = AuthService.create_token(
+        schemas.Principal(1, 'user_1'),
+        settings.JWT_ACCESS_TOKEN_EXPIRES
+    )
+
+    if is_cached:
+        user = benchmark(AuthService.get_user, token)
+    else:
+        user = benchmark.pedantic(
+            AuthService.get_user,
+            args=(token, ),
+            setup=clear_token_cache,
+            rounds=1000
+        )
+
+    # the principal comes from the claims alone
+    assert user == schemas.Principal(1, 'user_1')
+    assert count_statements.count == 0
@@ -0,0 +1,49 @@
+from itertools import count
+
+from app import schemas
+from app.services.blog_post import BlogPostService
+from app.services.like_buffer import LikeBufferService
+from app.services.timeline import TimelineService
+
+
+# the write and its outbox event
+MAX_STATEMENTS = 2
+
+
+def test_add_blog_post_like(
+        benchmark,
+        dataset,
+        run,
+        async_db_session,
+        redis_session,
+        count_statements
+):
+    blog_post_service = BlogPostService(
+        async_db_session,
+        TimelineService(async_db_session, redis_session),
+        LikeBufferService(redis_session)
+    )
+    likes = count(1)
+
+    def add_blog_post_like():
+        # new likes mostly, a few of the pairs are liked already
+        i = next(likes)
+        user_id = i % dataset.users + 1
+        post_id = (i * 104729) % dataset.rows + 1
+        # the owners are seeded as i % users + 1
+        author_id = post_id % dataset.users + 1
+        run(
+            blog_post_service.add_blog_post_like(
+                schemas.Principal(user_id, f'user_{user_id}'),
+                f'user_{author_id}',
+                post_id
+            )
+        )
+
+    count_statements.count = 0
+    add_blog_post_like()
+    benchmark.extra_info['statements'] = statements = count_statements.count
+
+    benchmark(add_blog_post_like)
+
+    assert statements <= MAX_STATEMENTS
@@ -0,0 +1,43 @@
+from itertools import count
+
+from app import schemas
+from app.services.follower import FollowerService
+from app.services.timeline import TimelineService
+
+
+# the write and its outbox event
+MAX_STATEMENTS = 2
+
+
+def test_follow_user(
+        benchmark,
+        dataset,
+        run,
+        async_db_session,
+        redis_session,
+        count_statements
+):
+    follower_service = FollowerService(
+        async_db_session,
+        TimelineService(async_db_session, redis_session)
+    )
+    follows = count(1)
+
+    def follow_user():
+        i = next(follows)
+        user_id = i % dataset.users + 1
+        target_id = (i * 104729) % dataset.users + 1
+        run(
+            follower_service.follow_user(
+                schemas.Principal(user_id, f'user_{user_id}'),
+                f'user_{target_id}'
+            )
+        )
+
+    count_statements.count = 0
+    follow_user()
+    benchmark.extra_info['statements'] = statements = count_statements.count
+
+    benchmark(follow_user)
+
+    assert statements <= MAX_STATEMENTS
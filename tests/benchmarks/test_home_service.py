@@ -0,0 +1,46 @@
+import pytest
+
+from app import schemas
+from app.services.home import HomeService
+from app.services.timeline import TimelineService
+
+
+@pytest.mark.parametrize(
+    'mode, max_statements',
+    [
+        (schemas.HomeMode.timeline, 2),
+        (schemas.HomeMode.query, 1),
+    ]
+)
+def test_home(
+        benchmark,
+        dataset,
+        run,
+        async_db_session,
+        redis_session,
+        count_statements,
+        mode,
+        max_statements
+):
+    async def flush_redis():
+        # aioredis sends the command as soon as it's called, in the loop
+        await redis_session.flushdb()
+
+    run(flush_redis())
+    home_service = HomeService(
+        async_db_session,
+        TimelineService(async_db_session, redis_session)
+    )
+    user = schemas.Principal(1, 'user_1')
+
+    # the first request builds the home timeline
+    run(home_service.home(user, mode=mode))
+    count_statements.count = 0
+    run(home_service.home(user, mode=mode))
+    benchmark.extra_info['statements'] = statements = count_statements.count
+
+    blog_posts, _ = benchmark(lambda: run(home_service.home(user, mode=mode)))
+
+    # a page of the posts of the ten followed users, rows // users each
+    assert len(blog_posts) == min(50, 10 * (dataset.rows // dataset.users))
+    assert statements <= max_statements
@@ -10,13 +10,24 @@ from app.database.base_class import Base
 from app.main import app
 
 
+def pytest_addoption(parser):
+    parser.addoption(
+        '--benchmark-scale',
+        type=int,
+        default=1000,
+        help='rows in the tables of tests/benchmarks (e.g. 1000, 100000, 1000000)'
+    )
+
+
 @pytest.fixture(scope="session", autouse=True)
 def init_db():
+    session.dispose_engine()
     session.DATABASE = settings.SQLALCHEMY_TEST_DATABASE_URL
-    engine = create_engine(session.DATABASE, pool_pre_ping=True)
+    engine = session.get_engine()
     Base.metadata.drop_all(engine)
     Base.metadata.create_all(engine)
     yield
+    session.dispose_engine()
     session.DATABASE = settings.SQLALCHEMY_DATABASE_URL
 
 
@@ -29,8 +40,13 @@ def init_redis():
 
 @pytest.fixture
 async def test_app():
+    # httpx doesn't send lifespan events, run the hooks manually
+    await app.router.startup()
     async with AsyncClient(app=app, base_url='http://test') as async_client:
         yield async_client
+    # asyncpg connections are bound to the event loop of the current test,
+    # so the pools are closed after every test
+    await app.router.shutdown()
 
 
 @pytest.fixture
@@ -55,3 +71,9 @@ async def redis_session():
     finally:
         redis.close()
         await redis.wait_closed()
+
+
+@pytest.fixture
+def metrics_headers(monkeypatch) -> dict[str, str]:
+    monkeypatch.setattr(settings, 'METRICS_TOKEN', 'metrics_token')
+    return {'Authorization': 'Bearer metrics_token', }
@@ -1,16 +1,68 @@
 import json
+import time
+from calendar import timegm
+from datetime import datetime, timedelta
+from typing import Callable
 
 import pytest
 from aioredis import Redis
+from fastapi import HTTPException
 from httpx import AsyncClient
+from jose import jwt
 from sqlalchemy.orm import Session
 
 from app import schemas
+from app.core import settings
+from app.services.auth import AuthService, clear_token_cache, get_token_cache_stats
+from app.services.availability import FILTER_KEY, get_filter_size
+from app.tools.expire_refresh_tokens import expire_refresh_tokens
 from tests.utils import BaseTestCase
 
 
+@pytest.fixture
+def clock(monkeypatch) -> Callable[[int], None]:
+    # moves the clocks of the sessions, the token cache and jwt forward
+    offset = 0
+    real_time = time.time
+
+    def advance(seconds: int) -> None:
+        nonlocal offset
+        offset += seconds
+
+    monkeypatch.setattr(time, 'time', lambda: real_time() + offset)
+    # jwt converts the issued and the current datetimes to timestamps with it
+    monkeypatch.setattr(jwt, 'timegm', lambda t: timegm(t) + offset)
+
+    return advance
+
+
+def create_legacy_token(user: schemas.Principal) -> str:
+    # tokens issued before the compact claims embed the whole user
+    now = datetime.utcnow()
+    payload = {
+        'iat': now,
+        'nbf': now,
+        'exp': now + timedelta(seconds=60),
+        'user': {
+            'id': user.id,
+            'username': user.username,
+            'email': f'{user.username}@example.com',
+            'date_joined': now.isoformat(),
+        },
+    }
+    return jwt.encode(
+        payload,
+        settings.JWT_SECRET_KEY,
+        algorithm=settings.JWT_ALGORITHM
+    )
+
+
 class TestAuthService(BaseTestCase):
 
+    async def get_refresh_tokens(self, redis_session: Redis) -> list[str]:
+        key = AuthService.get_refresh_tokens_key(self.user['username'])
+        return await redis_session.zrange(key)
+
     @pytest.mark.asyncio
     async def test_sign_up_endpoint_with_new_user(
             self,
@@ -26,10 +78,10 @@ class TestAuthService(BaseTestCase):
         is_db_user = self.check_is_db_user(db_session, self.user['username'])
 
         refresh_token = response.cookies.get('refresh_token', None)
-        refresh_tokens = await redis_session.smembers(self.user['username'])
+        refresh_tokens = await self.get_refresh_tokens(redis_session)
 
         assert response.status_code == 201
-        assert refresh_token in refresh_tokens
+        assert AuthService.get_token_digest(refresh_token) in refresh_tokens
         assert is_db_user
 
     @pytest.mark.asyncio
@@ -71,11 +123,11 @@ class TestAuthService(BaseTestCase):
         )
 
         refresh_token = response.cookies.get('refresh_token', None)
-        refresh_tokens = await redis_session.smembers(self.user['username'])
+        refresh_tokens = await self.get_refresh_tokens(redis_session)
 
         assert response.status_code == 200
         assert all(i in response.json() for i in ('token_type', 'access_token', ))
-        assert refresh_token in refresh_tokens
+        assert AuthService.get_token_digest(refresh_token) in refresh_tokens
 
     @pytest.mark.asyncio
     async def test_sign_in_endpoint_with_unregistered_user(
@@ -108,11 +160,112 @@ class TestAuthService(BaseTestCase):
         response = await test_app.put('/api/v1/auth/refresh', headers=headers)
 
         new_refresh_token = response.cookies.get('refresh_token', None)
-        new_refresh_tokens = await redis_session.smembers(self.user['username'])
+        new_refresh_tokens = await self.get_refresh_tokens(redis_session)
 
         assert response.status_code == 201
         assert all(i in response.json() for i in ('token_type', 'access_token', ))
-        assert new_refresh_token in new_refresh_tokens
+        assert AuthService.get_token_digest(new_refresh_token) in new_refresh_tokens
+
+    @pytest.mark.asyncio
+    async def test_refresh_endpoint_with_rotated_token(
+            self,
+            test_app: AsyncClient,
+            redis_session: Redis
+    ):
+        refresh_token = await self.register_user(test_app, self.user)
+        key = AuthService.get_refresh_tokens_key(self.user['username'])
+
+        headers = {'Authorization': f'Bearer {refresh_token}', }
+        response = await test_app.put('/api/v1/auth/refresh', headers=headers)
+        reused_response = await test_app.put('/api/v1/auth/refresh', headers=headers)
+
+        assert response.status_code == 201
+        assert reused_response.status_code == 401
+        assert await redis_session.zcard(key) == 1
+        assert 0 < await redis_session.ttl(key) <= settings.JWT_REFRESH_TOKEN_EXPIRES
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('is_legacy_token', [False, True])
+    async def test_refresh_endpoint_with_legacy_session(
+            self,
+            test_app: AsyncClient,
+            db_session: Session,
+            redis_session: Redis,
+            is_legacy_token: bool,
+            monkeypatch
+    ):
+        monkeypatch.setattr(settings, 'JWT_ACCEPT_LEGACY_TOKENS', True)
+        self.add_user(db_session, self.user)
+        user = schemas.Principal(
+            self.get_user_id(db_session, self.user['username']),
+            self.user['username']
+        )
+        refresh_token = (
+            create_legacy_token(user)
+            if is_legacy_token
+            else AuthService.create_token(user, 60)
+        )
+        legacy_key = AuthService.get_legacy_refresh_tokens_key(user.username)
+        # a session started before the sorted set
+        await redis_session.sadd(legacy_key, refresh_token, 'other_token')
+
+        headers = {'Authorization': f'Bearer {refresh_token}', }
+        response = await test_app.put('/api/v1/auth/refresh', headers=headers)
+        reused_response = await test_app.put('/api/v1/auth/refresh', headers=headers)
+
+        new_refresh_token = response.cookies.get('refresh_token', None)
+
+        assert response.status_code == 201
+        assert reused_response.status_code == 401
+        assert await self.get_refresh_tokens(redis_session) == [
+            AuthService.get_token_digest(new_refresh_token)
+        ]
+        assert await redis_session.smembers(legacy_key) == ['other_token']
+        assert (
+            0 < await redis_session.ttl(legacy_key)
+            <= settings.JWT_REFRESH_TOKEN_EXPIRES
+        )
+
+    @pytest.mark.asyncio
+    async def test_expire_refresh_tokens(
+            self,
+            db_session: Session,
+            redis_session: Redis
+    ):
+        self.add_user(db_session, self.user)
+        legacy_key = AuthService.get_legacy_refresh_tokens_key(self.user['username'])
+        await redis_session.sadd(legacy_key, 'token')
+
+        assert await expire_refresh_tokens(batch_size=10) == 1
+        assert await expire_refresh_tokens(batch_size=10) == 0
+        assert 0 < await redis_session.ttl(legacy_key)
+
+    @pytest.mark.asyncio
+    async def test_sign_in_endpoint_with_too_many_sessions(
+            self,
+            test_app: AsyncClient,
+            db_session: Session,
+            redis_session: Redis,
+            clock: Callable[[int], None],
+            monkeypatch
+    ):
+        monkeypatch.setattr(settings, 'REFRESH_TOKEN_MAX_SESSIONS', 2)
+        self.add_user(db_session, self.user)
+
+        refresh_tokens = []
+        for _ in range(3):
+            refresh_tokens.append(await self.authorize_user(test_app, self.user))
+            # sessions are ordered by expiry, which has a one second resolution
+            clock(1)
+
+        # the oldest session has been closed
+        headers = {'Authorization': f'Bearer {refresh_tokens[0]}', }
+        response = await test_app.put('/api/v1/auth/refresh', headers=headers)
+
+        assert response.status_code == 401
+        assert await self.get_refresh_tokens(redis_session) == [
+            AuthService.get_token_digest(i) for i in refresh_tokens[1:]
+        ]
 
     @pytest.mark.asyncio
     async def test_get_user_endpoint_with_registered_user(
@@ -130,3 +283,133 @@ class TestAuthService(BaseTestCase):
         assert response.status_code == 200
         assert response.json().keys() == schemas.User.__fields__.keys()
         assert is_db_user
+
+    @pytest.mark.asyncio
+    async def test_availability_endpoint_without_user_filter(
+            self,
+            test_app: AsyncClient,
+            db_session: Session
+    ):
+        self.add_user(db_session, self.user)
+
+        response = await test_app.get(
+            '/api/v1/auth/availability',
+            params={'username': self.user['username'].upper(), 'email': 'a@b.com'}
+        )
+
+        assert response.status_code == 200
+        assert response.json() == {'username': False, 'email': True}
+
+    @pytest.mark.asyncio
+    async def test_availability_endpoint_with_user_filter(
+            self,
+            test_app: AsyncClient,
+            db_session: Session,
+            redis_session: Redis
+    ):
+        bits, _ = get_filter_size()
+        await redis_session.setbit(FILTER_KEY, bits - 1, 0)
+
+        # registration adds the user to the filter
+        _ = await self.register_user(test_app, self.user)
+        # the filter is only loaded by the tool, a definite miss is trusted
+        new_user = {
+            'username': 'new_test_user',
+            'email': 'new_test_user@example.com',
+            'password': '1Password'
+        }
+        self.add_user(db_session, new_user)
+
+        responses = [
+            await test_app.get('/api/v1/auth/availability', params={'username': i})
+            for i in (self.user['username'], new_user['username'])
+        ]
+
+        assert [i.json()['username'] for i in responses] == [False, True]
+        assert responses[0].json()['email'] is None
+
+
+class TestTokenCache:
+
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        clear_token_cache()
+        yield
+        clear_token_cache()
+
+    @staticmethod
+    def create_user(user_id: int = 1) -> schemas.Principal:
+        return schemas.Principal(user_id, f'test_user_{user_id}')
+
+    def test_verified_token_is_cached(self):
+        user = self.create_user()
+        token = AuthService.create_token(user, 60)
+
+        assert AuthService.get_user(token) == user
+        assert AuthService.get_user(token) == user
+
+        stats = get_token_cache_stats()
+
+        assert stats['size'] == 1
+        assert (stats['hits'], stats['misses']) == (1, 1)
+        assert stats['hit_rate'] == 0.5
+
+    def test_expired_token_is_rejected(self, clock: Callable[[int], None]):
+        token = AuthService.create_token(self.create_user(), 1)
+        _ = AuthService.get_user(token)
+
+        # exp has a one second resolution
+        clock(2)
+
+        with pytest.raises(HTTPException) as exc_info:
+            AuthService.get_user(token)
+
+        assert exc_info.value.status_code == 401
+        assert get_token_cache_stats()['size'] == 0
+
+    def test_tampered_token_is_rejected(self):
+        token = AuthService.create_token(self.create_user(), 60)
+        _ = AuthService.get_user(token)
+
+        header, payload, signature = token.split('.')
+        tampered_signature = ('A' if signature[0] != 'A' else 'B') + signature[1:]
+
+        with pytest.raises(HTTPException) as exc_info:
+            AuthService.get_user(f'{header}.{payload}.{tampered_signature}')
+
+        assert exc_info.value.status_code == 401
+
+    def test_cache_size_is_bounded(self, monkeypatch):
+        monkeypatch.setattr(settings, 'TOKEN_CACHE_MAX_SIZE', 2)
+        tokens = [
+            AuthService.create_token(self.create_user(i), 60) for i in range(3)
+        ]
+
+        for token in tokens:
+            _ = AuthService.get_user(token)
+        # the least recently used token has been evicted
+        _ = AuthService.get_user(tokens[0])
+
+        stats = get_token_cache_stats()
+
+        assert stats['size'] == 2
+        assert stats['hits'] == 0
+
+    def test_token_has_compact_claims(self):
+        token = AuthService.create_token(self.create_user(), 60)
+        claims = jwt.get_unverified_claims(token)
+
+        assert claims.keys() == {'sub', 'name', 'jti', 'iat', 'exp'}
+        assert AuthService.get_user(token) == self.create_user()
+
+    def test_legacy_token_is_accepted_when_enabled(self, monkeypatch):
+        token = create_legacy_token(self.create_user())
+
+        with pytest.raises(HTTPException) as exc_info:
+            AuthService.get_user(token)
+
+        assert exc_info.value.status_code == 401
+
+        monkeypatch.setattr(settings, 'JWT_ACCEPT_LEGACY_TOKENS', True)
+
+        assert AuthService.get_user(token) == self.create_user()
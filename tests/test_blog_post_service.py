@@ -1,13 +1,20 @@
+import asyncio
 import json
 
 import pytest
+from aioredis import Redis
 from httpx import AsyncClient
 from sqlalchemy import func
 from sqlalchemy.orm import Session
 
 from app import schemas
+from app.core import settings
+from app.database import session
 from app.models import Like, Post, PostRelationship, User
-from tests.utils import BaseTestCase
+from app.services.like_buffer import coalesce, flush, STREAM_KEY
+from app.tools.flush_likes import hold_lease
+from app.tools.reconcile_counters import reconcile_counters
+from tests.utils import assert_max_queries, BaseTestCase
 
 
 class TestBlogPostService(BaseTestCase):
@@ -38,6 +45,18 @@ class TestBlogPostService(BaseTestCase):
 
         return schemas.BlogPost.from_orm(blog_post)
 
+    @staticmethod
+    def get_blog_post_counters(
+            db_session: Session,
+            post_id: int
+    ) -> tuple[int, int]:
+        return (
+            db_session
+                .query(Post.likes_count, Post.reposts_count)
+                .filter(Post.id == post_id)
+                .one()
+        )
+
     @pytest.mark.asyncio
     async def test_blog_post_create_endpoint(
             self,
@@ -49,11 +68,13 @@ class TestBlogPostService(BaseTestCase):
 
         data = {'content': 'test message', }
 
-        response = await test_app.post(
-            '/api/v1/posts/create',
-            headers=headers,
-            content=json.dumps(data)
-        )
+        # the post with its owner, the outbox event and the followers
+        with assert_max_queries(3):
+            response = await test_app.post(
+                '/api/v1/posts/create',
+                headers=headers,
+                content=json.dumps(data)
+            )
 
         post_relationship = (
             db_session
@@ -76,9 +97,18 @@ class TestBlogPostService(BaseTestCase):
                 .scalar()
         )
 
+        created_at = (
+            db_session
+                .query(Post.created_at, PostRelationship.created_at)
+                .join(PostRelationship, PostRelationship.post_id == Post.id)
+                .filter(Post.id == response.json()['id'])
+                .one()
+        )
+
         assert response.status_code == 201
         assert post_relationship
         assert response.json().keys() == schemas.BlogPost.__fields__.keys()
+        assert created_at[0] == created_at[1]
 
     @pytest.mark.asyncio
     async def test_blog_post_update_endpoint(
@@ -212,6 +242,7 @@ class TestBlogPostService(BaseTestCase):
         assert response.status_code == 200
         assert response.json()['status'] == 'ok'
         assert is_blog_post_repost
+        assert self.get_blog_post_counters(db_session, blog_post.id) == (0, 1)
 
     @pytest.mark.asyncio
     async def test_blog_post_repost_endpoint_with_post_owner(
@@ -280,6 +311,37 @@ class TestBlogPostService(BaseTestCase):
         assert response.status_code == 200
         assert response.json()['status'] == 'ok'
         assert len(user_blog_reposts) == 0
+        assert self.get_blog_post_counters(db_session, blog_post.id) == (0, 0)
+
+    @pytest.mark.asyncio
+    async def test_blog_post_repost_delete_endpoint_concurrently(
+            self,
+            test_app: AsyncClient,
+            db_session: Session
+    ):
+        _ = await self.register_user(test_app, self.new_user)
+        first_user_id = self.get_user_id(db_session, self.new_user['username'])
+        blog_post = self.create_blog_post(db_session, first_user_id, 'qwerty')
+
+        refresh_token = await self.register_user(test_app, self.user)
+        headers = {'Authorization': f'Bearer {refresh_token}', }
+
+        username = self.user['username']
+        _ = await test_app.post(
+            f'/api/v1/users/{username}/{blog_post.id}/repost',
+            headers=headers
+        )
+
+        responses = await asyncio.gather(*(
+            test_app.delete(
+                f'/api/v1/users/{username}/{blog_post.id}/repost/delete',
+                headers=headers
+            )
+            for _ in range(2)
+        ))
+
+        assert sorted(i.status_code for i in responses) == [200, 422]
+        assert self.get_blog_post_counters(db_session, blog_post.id) == (0, 0)
 
     @pytest.mark.asyncio
     async def test_blog_post_like_endpoint(
@@ -314,6 +376,121 @@ class TestBlogPostService(BaseTestCase):
         assert response.status_code == 200
         assert response.json()['status'] == 'ok'
         assert user_blog_post_like
+        assert self.get_blog_post_counters(db_session, blog_post.id) == (1, 0)
+
+    @pytest.mark.asyncio
+    async def test_blog_post_like_endpoint_concurrently(
+            self,
+            test_app: AsyncClient,
+            db_session: Session
+    ):
+        refresh_token = await self.register_user(test_app, self.user)
+        headers = {'Authorization': f'Bearer {refresh_token}', }
+
+        user_id = self.get_user_id(db_session, self.user['username'])
+        blog_post = self.create_blog_post(db_session, user_id, 'qwerty')
+
+        # a double tap on the like button
+        username = self.user['username']
+        responses = await asyncio.gather(*(
+            test_app.post(
+                f'/api/v1/users/{username}/{blog_post.id}/like',
+                headers=headers
+            )
+            for _ in range(2)
+        ))
+
+        assert [i.status_code for i in responses] == [200, 200]
+        assert self.get_blog_post_counters(db_session, blog_post.id) == (1, 0)
+
+    @pytest.mark.asyncio
+    async def test_blog_post_like_endpoint_with_write_behind(
+            self,
+            test_app: AsyncClient,
+            db_session: Session,
+            redis_session: Redis,
+            monkeypatch
+    ):
+        monkeypatch.setattr(settings, 'LIKES_WRITE_BEHIND', True)
+        refresh_token = await self.register_user(test_app, self.user)
+        headers = {'Authorization': f'Bearer {refresh_token}', }
+
+        user_id = self.get_user_id(db_session, self.user['username'])
+        blog_post = self.create_blog_post(db_session, user_id, 'qwerty')
+
+        username = self.user['username']
+        for action in ('like', 'dislike', 'like'):
+            method = test_app.post if action == 'like' else test_app.put
+            response = await method(
+                f'/api/v1/users/{username}/{blog_post.id}/{action}',
+                headers=headers
+            )
+            assert response.status_code == 200
+
+        # nothing is written until the buffer is flushed
+        assert self.get_blog_post_counters(db_session, blog_post.id) == (0, 0)
+
+        entries = [
+            (STREAM_KEY, entry_id, fields)
+            for entry_id, fields in await redis_session.xrange(STREAM_KEY)
+        ]
+        toggles = coalesce(entries)
+
+        # a batch may be delivered more than once
+        for _ in range(2):
+            async for async_db_session in session.get_async_db_session():
+                await flush(async_db_session, toggles)
+                await async_db_session.commit()
+
+        is_active_like = (
+            db_session
+                .query(Like.is_active)
+                .filter((Like.user_id == user_id) & (Like.post_id == blog_post.id))
+                .scalar()
+        )
+
+        assert toggles == {(user_id, blog_post.id): True}
+        assert is_active_like
+        assert self.get_blog_post_counters(db_session, blog_post.id) == (1, 0)
+
+    @pytest.mark.asyncio
+    async def test_blog_post_like_endpoint_with_write_behind_and_invalid_post(
+            self,
+            test_app: AsyncClient,
+            db_session: Session,
+            redis_session: Redis,
+            monkeypatch
+    ):
+        monkeypatch.setattr(settings, 'LIKES_WRITE_BEHIND', True)
+        refresh_token = await self.register_user(test_app, self.user)
+        headers = {'Authorization': f'Bearer {refresh_token}', }
+
+        user_id = self.get_user_id(db_session, self.user['username'])
+        blog_post = self.create_blog_post(db_session, user_id, 'qwerty')
+        archived_blog_post = self.create_blog_post(db_session, user_id, 'qwerty')
+        db_session.query(Post).filter(Post.id == archived_blog_post.id).update(
+            {'is_published': False}
+        )
+        db_session.commit()
+
+        username = self.user['username']
+        for url in (
+            f'/api/v1/users/{username}/{blog_post.id + 100}/like',
+            f'/api/v1/users/{username}/{archived_blog_post.id}/like',
+            f'/api/v1/users/not_{username}/{blog_post.id}/like',
+        ):
+            response = await test_app.post(url, headers=headers)
+            assert response.status_code == 422
+
+        # nothing is buffered for the worker
+        assert await redis_session.xlen(STREAM_KEY) == 0
+
+    @pytest.mark.asyncio
+    async def test_flush_likes_lease(self, redis_session: Redis):
+        # a single worker applies the buffered toggles, in the stream order
+        assert await hold_lease(redis_session, 'first')
+        assert not await hold_lease(redis_session, 'second')
+        assert await hold_lease(redis_session, 'first')
 
     @pytest.mark.asyncio
     async def test_blog_post_dislike_endpoint(
@@ -354,3 +531,50 @@ class TestBlogPostService(BaseTestCase):
         assert response.status_code == 200
         assert response.json()['status'] == 'ok'
         assert user_blog_post_like
+        assert self.get_blog_post_counters(db_session, blog_post.id) == (0, 0)
+
+    @pytest.mark.asyncio
+    async def test_blog_post_dislike_endpoint_concurrently(
+            self,
+            test_app: AsyncClient,
+            db_session: Session
+    ):
+        refresh_token = await self.register_user(test_app, self.user)
+        headers = {'Authorization': f'Bearer {refresh_token}', }
+
+        user_id = self.get_user_id(db_session, self.user['username'])
+        blog_post = self.create_blog_post(db_session, user_id, 'qwerty')
+
+        username = self.user['username']
+        _ = await test_app.post(
+            f'/api/v1/users/{username}/{blog_post.id}/like',
+            headers=headers
+        )
+
+        responses = await asyncio.gather(*(
+            test_app.put(
+                f'/api/v1/users/{username}/{blog_post.id}/dislike',
+                headers=headers
+            )
+            for _ in range(2)
+        ))
+
+        assert [i.status_code for i in responses] == [200, 200]
+        assert self.get_blog_post_counters(db_session, blog_post.id) == (0, 0)
+
+    @pytest.mark.asyncio
+    async def test_reconcile_blog_post_counters(self, db_session: Session):
+        self.add_user(db_session, self.user)
+        user_id = self.get_user_id(db_session, self.user['username'])
+        blog_post = self.create_blog_post(db_session, user_id, 'qwerty')
+
+        db_session.add(Like(user_id=user_id, post_id=blog_post.id))
+        db_session.query(Post).filter(Post.id == blog_post.id).update(
+            {'likes_count': 5, 'reposts_count': 3},
+            synchronize_session=False
+        )
+        db_session.commit()
+
+        assert reconcile_counters(batch_size=1) == 1
+        assert self.get_blog_post_counters(db_session, blog_post.id) == (1, 0)
+        assert reconcile_counters(batch_size=1) == 0
@@ -0,0 +1,95 @@
+import json
+
+import pytest
+from aioredis import Redis
+from httpx import AsyncClient
+from sqlalchemy.orm import Session
+
+from app.models import Follower, Like, Post, PostRelationship, User
+from app.tools.bulk_load import bulk_load, invalidate_timelines
+from tests.utils import BaseTestCase
+
+
+class TestBulkLoad(BaseTestCase):
+    new_user = {
+        'username': 'new_test_user',
+        'email': 'new_test_user@example.com',
+        'password': '1Password'
+    }
+
+    @pytest.mark.asyncio
+    async def test_bulk_load(
+            self,
+            test_app: AsyncClient,
+            db_session: Session,
+            tmp_path
+    ):
+        # the rows of the previous tests are deleted, their ids aren't
+        for table in ('"user"', 'blog_post'):
+            db_session.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), 1, false)"
+            )
+        db_session.commit()
+
+        users = tmp_path / 'users.csv'
+        users.write_text(
+            'id,username,email,password\n'
+            f'10,{self.user["username"]},{self.user["email"]},'
+            f'{self.user["password"]}\n'
+            '11,Test_User_2,Test_User_2@example.com,1Password\n'
+        )
+        # the ids are taken from the sequence
+        posts = tmp_path / 'posts.ndjson'
+        posts.write_text(
+            '\n'.join(
+                json.dumps({'user_id': 10, 'content': f'blog_post_{i}'})
+                for i in range(1, 4)
+            )
+        )
+        follows = tmp_path / 'follows.csv'
+        follows.write_text('follower_id,user_id\n11,10\n')
+        likes = tmp_path / 'likes.csv'
+        likes.write_text('user_id,post_id\n10,1\n11,1\n11,2\n')
+
+        assert bulk_load('users', users, batch_size=1, workers=2) == 2
+        assert bulk_load('posts', posts, batch_size=2, workers=1) == 3
+        assert bulk_load('follows', follows, batch_size=2, workers=1) == 1
+        assert bulk_load('likes', likes, batch_size=2, workers=1) == 3
+
+        likes_count = dict(db_session.query(Post.id, Post.likes_count).all())
+
+        assert self.get_user_id(db_session, 'test_user_2') == 11
+        assert db_session.query(Post.id).order_by(Post.id).all() == [(1,), (2,), (3,)]
+        assert db_session.query(PostRelationship).count() == 3
+        assert db_session.query(Follower).count() == 1
+        assert db_session.query(Like).count() == 3
+        assert likes_count == {1: 2, 2: 1, 3: 0}
+
+        # the passwords are hashed and the sequences are moved past the ids
+        assert await self.authorize_user(test_app, self.user)
+        assert await self.register_user(test_app, self.new_user)
+        assert self.get_user_id(db_session, self.new_user['username']) == 12
+
+    def test_bulk_load_with_mixed_ids(self, db_session: Session, tmp_path):
+        users = tmp_path / 'users.csv'
+        users.write_text(
+            'id,username,email,password\n'
+            f'10,{self.user["username"]},{self.user["email"]},'
+            f'{self.user["password"]}\n'
+            ',test_user_2,test_user_2@example.com,1Password\n'
+        )
+
+        with pytest.raises(ValueError):
+            bulk_load('users', users, batch_size=1, workers=1)
+
+        assert db_session.query(User).count() == 0
+
+    @pytest.mark.asyncio
+    async def test_invalidate_timelines(self, redis_session: Redis):
+        await redis_session.zadd('home:1:timeline', 1, '000000000001')
+        await redis_session.hset('home:1:timeline:actors', '000000000001', 1)
+        await redis_session.zadd('home:2:timeline', 1, '000000000001')
+        await redis_session.set('other', 1)
+
+        assert await invalidate_timelines(batch_size=2) == 3
+        assert await redis_session.keys('*') == ['other']
@@ -1,6 +1,6 @@
 import pytest
 from httpx import AsyncClient
-from sqlalchemy import func
+from sqlalchemy import func, insert, null
 from sqlalchemy.orm import Session
 
 from app.models import Follower
@@ -86,3 +86,70 @@ class TestFollowerService(BaseTestCase):
 
         assert response.status_code == 200
         assert is_inactive_follower
+
+    @pytest.mark.asyncio
+    async def test_follow_endpoint_after_unfollow(
+            self,
+            test_app: AsyncClient,
+            db_session: Session
+    ):
+        self.add_user(db_session, self.user)
+        refresh_token = await self.register_user(test_app, self.new_user)
+        headers = {'Authorization': f'Bearer {refresh_token}', }
+
+        user = self.user['username']
+        for action in ('follow', 'unfollow', 'follow', 'follow'):
+            method = test_app.post if action == 'follow' else test_app.put
+            response = await method(
+                f'/api/v1/users/{user}/{action}',
+                headers=headers
+            )
+
+        user_id = self.get_user_id(db_session, user)
+        followers = (
+            db_session
+                .query(Follower.is_active)
+                .filter(Follower.user_id == user_id)
+                .all()
+        )
+
+        assert response.status_code == 201
+        assert followers == [(True, )]
+
+    @pytest.mark.asyncio
+    async def test_follow_endpoint_with_null_follower(
+            self,
+            test_app: AsyncClient,
+            db_session: Session
+    ):
+        self.add_user(db_session, self.user)
+        refresh_token = await self.register_user(test_app, self.new_user)
+        headers = {'Authorization': f'Bearer {refresh_token}', }
+
+        user = self.user['username']
+        user_id = self.get_user_id(db_session, user)
+        follower_id = self.get_user_id(db_session, self.new_user['username'])
+        # is_active is nullable, such a row isn't an active follower
+        db_session.execute(
+            insert(Follower).values(
+                user_id=user_id,
+                follower_id=follower_id,
+                is_active=null()
+            )
+        )
+        db_session.commit()
+
+        response = await test_app.post(
+            f'/api/v1/users/{user}/follow',
+            headers=headers
+        )
+
+        followers = (
+            db_session
+                .query(Follower.is_active)
+                .filter(Follower.user_id == user_id)
+                .all()
+        )
+
+        assert response.status_code == 201
+        assert followers == [(True, )]
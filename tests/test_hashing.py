@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from app.core import hashing, settings
+
+
+class TestPasswordHashing:
+
+    @pytest.mark.asyncio
+    async def test_hash_and_verify_password(self):
+        password_hash = await hashing.hash_password('1Password')
+
+        assert await hashing.verify_password('1Password', password_hash)
+        assert not await hashing.verify_password('2Password', password_hash)
+        assert hashing.get_hashing_stats()['running'] == 0
+
+    @pytest.mark.asyncio
+    async def test_requests_over_the_queue_limit_are_rejected(self, monkeypatch):
+        monkeypatch.setattr(settings, 'PASSWORD_HASHING_WORKERS', 1)
+        monkeypatch.setattr(settings, 'PASSWORD_HASHING_MAX_QUEUE', 1)
+        hashing.shutdown_executor()
+        rejected = hashing.get_hashing_stats()['rejected']
+
+        try:
+            results = await asyncio.gather(
+                *(hashing.hash_password('1Password') for _ in range(3)),
+                return_exceptions=True
+            )
+        finally:
+            hashing.shutdown_executor()
+
+        assert sum(isinstance(i, str) for i in results) == 2
+        assert isinstance(results[-1], hashing.HashingQueueFull)
+        assert hashing.get_hashing_stats()['rejected'] == rejected + 1
+
+    @pytest.mark.asyncio
+    async def test_failed_calls_are_not_completed(self):
+        stats = hashing.get_hashing_stats()
+
+        with pytest.raises(ValueError):
+            await hashing.verify_password('1Password', 'not a hash')
+
+        new_stats = hashing.get_hashing_stats()
+
+        assert new_stats['completed'] == stats['completed']
+        assert new_stats['failed'] == stats['failed'] + 1
+        assert new_stats['running'] == 0
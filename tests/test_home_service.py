@@ -1,10 +1,14 @@
+import json
+
 import pytest
+from aioredis import Redis
 from httpx import AsyncClient
 from sqlalchemy.orm import Session
 
 from app import schemas
 from app.models import Follower, Post, PostRelationship, User
-from tests.utils import BaseTestCase
+from app.services.timeline import to_member
+from tests.utils import assert_max_queries, BaseTestCase
 
 
 class TestFollowerService(BaseTestCase):
@@ -73,7 +77,13 @@ class TestFollowerService(BaseTestCase):
         self.add_follower(db_session, 'test_user_2', 'test_user_3')
 
     @pytest.mark.asyncio
-    async def test_home_endpoint(self, test_app: AsyncClient, db_session: Session):
+    @pytest.mark.parametrize('mode', ['timeline', 'query'])
+    async def test_home_endpoint(
+            self,
+            test_app: AsyncClient,
+            db_session: Session,
+            mode: str
+    ):
         self.add_users(db_session)
         self.add_users_posts(db_session)
         self.add_followers(db_session)
@@ -81,8 +91,275 @@ class TestFollowerService(BaseTestCase):
         refresh_token = await self.authorize_user(test_app, self.user)
         headers = {'Authorization': f'Bearer {refresh_token}', }
 
-        response = await test_app.get('/api/v1/home', headers=headers)
+        # the timeline is built and hydrated by two statements
+        with assert_max_queries(2):
+            response = await test_app.get(
+                '/api/v1/home',
+                headers=headers,
+                params={'mode': mode}
+            )
 
         assert response.status_code == 200
         assert response.json()[0].keys() == schemas.HomeBlogPost.__fields__.keys()
         assert len(response.json()) == self.posts_count
+
+    @pytest.mark.asyncio
+    async def test_home_endpoint_with_empty_timeline(
+            self,
+            test_app: AsyncClient,
+            db_session: Session,
+            redis_session: Redis
+    ):
+        self.add_users(db_session)
+        self.add_followers(db_session)
+
+        refresh_token = await self.authorize_user(test_app, self.user)
+        headers = {'Authorization': f'Bearer {refresh_token}', }
+
+        _ = await test_app.get('/api/v1/home', headers=headers)
+
+        # the empty timeline is cached, it isn't rebuilt by the next request
+        with assert_max_queries(0):
+            response = await test_app.get('/api/v1/home', headers=headers)
+
+        user_id = self.get_user_id(db_session, self.user['username'])
+
+        assert response.status_code == 200
+        assert response.json() == []
+        assert await redis_session.ttl(f'home:{user_id}:timeline') > 0
+
+        author = {'username': 'test_user_1', 'password': '1Password'}
+        author_refresh_token = await self.authorize_user(test_app, author)
+        author_headers = {'Authorization': f'Bearer {author_refresh_token}', }
+        response = await test_app.post(
+            '/api/v1/posts/create',
+            headers=author_headers,
+            content=json.dumps({'content': 'new blog post'})
+        )
+        post_id = response.json()['id']
+
+        response = await test_app.get('/api/v1/home', headers=headers)
+
+        assert [i['post_id'] for i in response.json()] == [post_id]
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('action', ['archive', 'delete'])
+    async def test_home_endpoint_with_removed_blog_post(
+            self,
+            test_app: AsyncClient,
+            db_session: Session,
+            redis_session: Redis,
+            action: str
+    ):
+        self.add_users(db_session)
+        self.add_users_posts(db_session)
+        self.add_followers(db_session)
+
+        refresh_token = await self.authorize_user(test_app, self.user)
+        headers = {'Authorization': f'Bearer {refresh_token}', }
+
+        # the first request builds the home timeline
+        _ = await test_app.get('/api/v1/home', headers=headers)
+
+        author = {'username': 'test_user_1', 'password': '1Password'}
+        author_refresh_token = await self.authorize_user(test_app, author)
+        author_headers = {'Authorization': f'Bearer {author_refresh_token}', }
+        post_id = (
+            db_session
+            .query(PostRelationship.post_id)
+            .filter(
+                PostRelationship.user_id ==
+                self.get_user_id(db_session, author['username'])
+            )
+            .first()
+            .post_id
+        )
+
+        url = f'/api/v1/users/{author["username"]}/{post_id}'
+        if action == 'archive':
+            response = await test_app.put(f'{url}/archive', headers=author_headers)
+        else:
+            response = await test_app.delete(url, headers=author_headers)
+
+        user_id = self.get_user_id(db_session, self.user['username'])
+        timeline = await redis_session.zrevrange(f'home:{user_id}:timeline', 0, -1)
+
+        # the post is removed from the timeline instead of being hidden
+        assert response.status_code == 200
+        assert to_member(post_id) not in timeline
+        assert len(timeline) == self.posts_count - 1
+
+    @pytest.mark.asyncio
+    async def test_home_endpoint_with_new_blog_post(
+            self,
+            test_app: AsyncClient,
+            db_session: Session,
+            redis_session: Redis
+    ):
+        self.add_users(db_session)
+        self.add_users_posts(db_session)
+        self.add_followers(db_session)
+
+        refresh_token = await self.authorize_user(test_app, self.user)
+        headers = {'Authorization': f'Bearer {refresh_token}', }
+
+        # the first request builds the home timeline
+        _ = await test_app.get('/api/v1/home', headers=headers)
+
+        author = {'username': 'test_user_1', 'password': '1Password'}
+        author_refresh_token = await self.authorize_user(test_app, author)
+        author_headers = {'Authorization': f'Bearer {author_refresh_token}', }
+
+        response = await test_app.post(
+            '/api/v1/posts/create',
+            headers=author_headers,
+            content=json.dumps({'content': 'new blog post'})
+        )
+        post_id = response.json()['id']
+
+        user_id = self.get_user_id(db_session, self.user['username'])
+        timeline = await redis_session.zrevrange(f'home:{user_id}:timeline', 0, -1)
+
+        assert response.status_code == 201
+        assert timeline[0] == to_member(post_id)
+        assert len(timeline) == self.posts_count + 1
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('mode', ['timeline', 'query'])
+    async def test_home_endpoint_with_cursor(
+            self,
+            test_app: AsyncClient,
+            db_session: Session,
+            mode: str
+    ):
+        self.add_users(db_session)
+        self.add_users_posts(db_session)
+        self.add_followers(db_session)
+
+        refresh_token = await self.authorize_user(test_app, self.user)
+        headers = {'Authorization': f'Bearer {refresh_token}', }
+
+        post_ids = []
+        params = {'limit': 4, 'mode': mode}
+
+        while True:
+            response = await test_app.get(
+                '/api/v1/home',
+                headers=headers,
+                params=params
+            )
+            assert response.status_code == 200
+            post_ids.extend(i['post_id'] for i in response.json())
+
+            if 'x-next-cursor' not in response.headers:
+                break
+            params['cursor'] = response.headers['x-next-cursor']
+
+        # the first page doesn't depend on previous requests
+        response = await test_app.get(
+            '/api/v1/home',
+            headers=headers,
+            params={'limit': 4, 'mode': mode}
+        )
+
+        assert len(post_ids) == len(set(post_ids)) == self.posts_count
+        assert [i['post_id'] for i in response.json()] == post_ids[:4]
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('mode', ['timeline', 'query'])
+    async def test_home_endpoint_with_cursor_and_reposts(
+            self,
+            test_app: AsyncClient,
+            db_session: Session,
+            mode: str
+    ):
+        self.add_users(db_session)
+        self.add_users_posts(db_session)
+        self.add_followers(db_session)
+
+        refresh_token = await self.authorize_user(test_app, self.user)
+        headers = {'Authorization': f'Bearer {refresh_token}', }
+
+        # the oldest posts of the first user move to the first page, their
+        # older activity mustn't bring them back on the next pages
+        author = {'username': 'test_user_2', 'password': '1Password'}
+        author_refresh_token = await self.authorize_user(test_app, author)
+        for blog_post in db_session.query(Post).order_by(Post.id).limit(3):
+            _ = await test_app.post(
+                f'/api/v1/users/test_user_2/{blog_post.id}/repost',
+                headers={'Authorization': f'Bearer {author_refresh_token}', }
+            )
+
+        post_ids = []
+        params = {'limit': 2, 'mode': mode}
+
+        while True:
+            response = await test_app.get(
+                '/api/v1/home',
+                headers=headers,
+                params=params
+            )
+            post_ids.extend(i['post_id'] for i in response.json())
+
+            if 'x-next-cursor' not in response.headers:
+                break
+            params['cursor'] = response.headers['x-next-cursor']
+
+        assert len(post_ids) == len(set(post_ids)) == self.posts_count
+
+    @pytest.mark.asyncio
+    async def test_home_endpoint_with_invalid_cursor(
+            self,
+            test_app: AsyncClient,
+            db_session: Session
+    ):
+        self.add_users(db_session)
+
+        refresh_token = await self.authorize_user(test_app, self.user)
+        headers = {'Authorization': f'Bearer {refresh_token}', }
+
+        response = await test_app.get(
+            '/api/v1/home',
+            headers=headers,
+            params={'cursor': 'invalid'}
+        )
+
+        assert response.status_code == 422
+
+    @pytest.mark.asyncio
+    async def test_home_endpoint_modes_return_the_same_posts(
+            self,
+            test_app: AsyncClient,
+            db_session: Session
+    ):
+        self.add_users(db_session)
+        self.add_users_posts(db_session)
+        self.add_followers(db_session)
+
+        refresh_token = await self.authorize_user(test_app, self.user)
+        headers = {'Authorization': f'Bearer {refresh_token}', }
+
+        # repost one of the posts of the first user by the second one
+        blog_post = db_session.query(Post).order_by(Post.id).first()
+        author = {'username': 'test_user_2', 'password': '1Password'}
+        author_refresh_token = await self.authorize_user(test_app, author)
+        _ = await test_app.post(
+            f'/api/v1/users/test_user_2/{blog_post.id}/repost',
+            headers={'Authorization': f'Bearer {author_refresh_token}', }
+        )
+
+        timeline_response = await test_app.get(
+            '/api/v1/home',
+            headers=headers,
+            params={'mode': 'timeline'}
+        )
+        query_response = await test_app.get(
+            '/api/v1/home',
+            headers=headers,
+            params={'mode': 'query'}
+        )
+
+        assert timeline_response.status_code == query_response.status_code == 200
+        assert timeline_response.json() == query_response.json()
+        assert query_response.json()[0]['post_id'] == blog_post.id
+        assert query_response.json()[0]['author']['username'] == 'test_user_1'
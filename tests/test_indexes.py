@@ -0,0 +1,141 @@
+from contextlib import contextmanager
+from typing import Iterator
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from app.database import session
+from app.models import Follower, Like, Post, PostRelationship
+from tests.utils import BaseTestCase
+
+
+@contextmanager
+def capture_statements() -> Iterator[list[tuple[str, tuple]]]:
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, *args):
+        statements.append((statement, parameters))
+
+    engine = session.get_async_engine().sync_engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+class TestIndexes(BaseTestCase):
+    users_count = 20
+    posts_count = 10
+
+    def add_dataset(self, db_session: Session) -> list[int]:
+        for i in range(self.users_count):
+            self.add_user(
+                db_session,
+                {
+                    'username': f'test_user_{i}',
+                    'email': f'test_user_{i}@example.com',
+                    'password': '1Password'
+                }
+            )
+        user_ids = [
+            self.get_user_id(db_session, f'test_user_{i}')
+            for i in range(self.users_count)
+        ]
+
+        for user_id in user_ids:
+            for follower_id in user_ids:
+                if user_id != follower_id:
+                    db_session.add(Follower(user_id=user_id, follower_id=follower_id))
+
+            for i in range(self.posts_count):
+                post = Post(content=f'blog_post_{i}')
+                db_session.add(post)
+                db_session.flush()
+                db_session.add(PostRelationship(user_id=user_id, post_id=post.id))
+                db_session.add(Like(user_id=user_ids[0], post_id=post.id))
+
+        db_session.commit()
+        db_session.execute(text('ANALYZE'))
+
+        return user_ids
+
+    @staticmethod
+    def explain(db_session: Session, statements: list[tuple[str, tuple]]) -> str:
+        plans = []
+
+        # the seeded tables are tiny, a sequential scan would always win
+        db_session.execute(text('SET LOCAL enable_seqscan = off'))
+        for statement, parameters in statements:
+            result = db_session.connection().exec_driver_sql(
+                f'EXPLAIN {statement}',
+                parameters
+            )
+            plans.extend(result.scalars().all())
+        db_session.rollback()
+
+        return '\n'.join(plans)
+
+    @pytest.mark.asyncio
+    async def test_hot_path_statements_use_indexes(
+            self,
+            test_app: AsyncClient,
+            db_session: Session
+    ):
+        self.add_dataset(db_session)
+        post_id = (
+            db_session
+            .query(PostRelationship.post_id)
+            .filter(
+                PostRelationship.user_id == self.get_user_id(db_session, 'test_user_1')
+            )
+            .first()
+            .post_id
+        )
+        headers = {}
+        for username in ('test_user_0', 'test_user_1'):
+            user = {'username': username, 'password': '1Password'}
+            refresh_token = await self.authorize_user(test_app, user)
+            headers[username] = {'Authorization': f'Bearer {refresh_token}', }
+
+        # the statements issued by the services for these requests
+        requests = {
+            # the latest activity of the followed users, a page shorter than
+            # their posts, so that the index saves the sort
+            'ix_blog_post_relationship_user_id_created_at': (
+                'test_user_0',
+                'GET',
+                '/api/v1/home?mode=query&limit=2'
+            ),
+            # the fan-out to the followers
+            'ix_follower_user_id_active': (
+                'test_user_0',
+                'POST',
+                '/api/v1/posts/create'
+            ),
+            'ix_blog_post_like_post_id_active': (
+                'test_user_0',
+                'PUT',
+                f'/api/v1/users/test_user_1/{post_id}/dislike'
+            ),
+            # the owner and the reposters of the deleted post
+            'ix_blog_post_relationship_post_id': (
+                'test_user_1',
+                'DELETE',
+                f'/api/v1/users/test_user_1/{post_id}'
+            ),
+        }
+
+        for index_name, (username, method, url) in requests.items():
+            with capture_statements() as statements:
+                response = await test_app.request(
+                    method,
+                    url,
+                    headers=headers[username],
+                    json={'content': 'new blog post'} if method == 'POST' else None
+                )
+
+            assert response.status_code < 300, index_name
+            assert index_name in self.explain(db_session, statements), index_name
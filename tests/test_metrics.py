@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+from httpx import AsyncClient
+from prometheus_client import CollectorRegistry
+
+from app.api.metrics import STATS, StatsCollector
+from app.core import settings
+from app.core.metrics import EVENT_LOOP_LAG_INTERVAL
+from app.database import session
+from tests.utils import BaseTestCase
+
+
+class TestMetrics(BaseTestCase):
+
+    @pytest.mark.asyncio
+    async def test_metrics_endpoint(
+            self,
+            test_app: AsyncClient,
+            metrics_headers: dict[str, str]
+    ):
+        refresh_token = await self.register_user(test_app, self.user)
+        headers = {'Authorization': f'Bearer {refresh_token}', }
+
+        _ = await test_app.get('/api/v1/home', headers=headers)
+        _ = await test_app.get('/api/v1/missing', headers=headers)
+        # the lag is only sampled every interval
+        await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL * 2)
+
+        response = await test_app.get('/metrics', headers=metrics_headers)
+        metrics = response.text
+
+        assert response.status_code == 200
+        # the route templates are used as labels instead of the paths
+        assert (
+            'http_request_duration_seconds_count'
+            '{method="GET",route="/api/v1/home",status="200"}'
+        ) in metrics
+        assert 'route="unmatched",status="404"' in metrics
+        assert 'http_requests_in_flight 1.0' in metrics
+        assert 'redis_command_duration_seconds_count{command="EVAL"}' in metrics
+        assert 'db_pool_checked_out ' in metrics
+        assert 'event_loop_lag_seconds_count' in metrics
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('metrics_token', ['', 'metrics_token'])
+    async def test_metrics_endpoint_without_token(
+            self,
+            test_app: AsyncClient,
+            metrics_token: str,
+            monkeypatch
+    ):
+        monkeypatch.setattr(settings, 'METRICS_TOKEN', metrics_token)
+
+        responses = [
+            await test_app.get('/metrics'),
+            await test_app.get('/metrics', headers={'Authorization': 'Bearer '}),
+            await test_app.get(
+                '/metrics',
+                headers={'Authorization': 'Bearer other_token'}
+            ),
+        ]
+
+        assert [i.status_code for i in responses] == [401, 401, 401]
+
+    def test_stats_are_described_without_the_engine(self, monkeypatch):
+        monkeypatch.setattr(session, '_async_engine', None)
+        registry = CollectorRegistry(auto_describe=True)
+
+        registry.register(StatsCollector(STATS))
+
+        # the metric names are registered, so duplicates are still detected
+        with pytest.raises(ValueError):
+            registry.register(StatsCollector({'db_pool': STATS['db_pool']}))
+        assert session._async_engine is None
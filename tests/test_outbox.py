@@ -0,0 +1,164 @@
+import json
+
+import pytest
+from aioredis import Redis
+from httpx import AsyncClient
+from sqlalchemy.orm import Session
+
+from app.core import settings
+from app.database import session
+from app.models import Follower, OutboxEvent
+from app.services.outbox import get_outbox_stats, process_batch
+from app.services.timeline import to_member
+from tests.utils import BaseTestCase
+
+
+class TestOutbox(BaseTestCase):
+    author = {
+        'username': 'test_user_2',
+        'email': 'test_user_2@example.com',
+        'password': '1Password'
+    }
+
+    def add_author(self, db_session: Session) -> None:
+        self.add_user(db_session, self.user)
+        self.add_user(db_session, self.author)
+
+        follower = Follower(
+            user_id=self.get_user_id(db_session, self.author['username']),
+            follower_id=self.get_user_id(db_session, self.user['username'])
+        )
+        db_session.add(follower)
+        db_session.commit()
+
+    async def create_blog_post(self, test_app: AsyncClient) -> int:
+        refresh_token = await self.authorize_user(test_app, self.author)
+        headers = {'Authorization': f'Bearer {refresh_token}', }
+
+        response = await test_app.post(
+            '/api/v1/posts/create',
+            headers=headers,
+            content=json.dumps({'content': 'new blog post'})
+        )
+
+        return response.json()['id']
+
+    @pytest.mark.asyncio
+    async def test_process_batch(
+            self,
+            test_app: AsyncClient,
+            db_session: Session,
+            redis_session: Redis,
+            monkeypatch
+    ):
+        monkeypatch.setattr(settings, 'TIMELINE_FAN_OUT_IN_WORKER', True)
+        self.add_author(db_session)
+
+        refresh_token = await self.authorize_user(test_app, self.user)
+        headers = {'Authorization': f'Bearer {refresh_token}', }
+
+        # the first request builds the home timeline
+        _ = await test_app.get('/api/v1/home', headers=headers)
+
+        post_id = await self.create_blog_post(test_app)
+
+        user_id = self.get_user_id(db_session, self.user['username'])
+        timeline_key = f'home:{user_id}:timeline'
+
+        # the post is in the outbox until the worker processes it
+        assert db_session.query(OutboxEvent.event_type).all() == [('post_created',)]
+        assert await redis_session.zscore(timeline_key, to_member(post_id)) is None
+
+        async for async_db_session in session.get_async_db_session():
+            processed = await process_batch(async_db_session, redis_session, 100)
+
+        timeline = await redis_session.zrevrange(timeline_key, 0, -1)
+
+        assert processed == 1
+        assert db_session.query(OutboxEvent).count() == 0
+        assert (await get_outbox_stats(redis_session))['processed'] == 1
+        assert timeline[0] == to_member(post_id)
+
+    @pytest.mark.asyncio
+    async def test_process_batch_with_deleted_blog_post(
+            self,
+            test_app: AsyncClient,
+            db_session: Session,
+            redis_session: Redis,
+            monkeypatch
+    ):
+        monkeypatch.setattr(settings, 'TIMELINE_FAN_OUT_IN_WORKER', True)
+        self.add_author(db_session)
+
+        post_id = await self.create_blog_post(test_app)
+
+        async for async_db_session in session.get_async_db_session():
+            _ = await process_batch(async_db_session, redis_session, 100)
+
+        refresh_token = await self.authorize_user(test_app, self.user)
+        headers = {'Authorization': f'Bearer {refresh_token}', }
+        _ = await test_app.get('/api/v1/home', headers=headers)
+
+        author_refresh_token = await self.authorize_user(test_app, self.author)
+        author_headers = {'Authorization': f'Bearer {author_refresh_token}', }
+        _ = await test_app.delete(
+            f'/api/v1/users/{self.author["username"]}/{post_id}',
+            headers=author_headers
+        )
+
+        user_id = self.get_user_id(db_session, self.user['username'])
+        timeline_key = f'home:{user_id}:timeline'
+
+        assert db_session.query(OutboxEvent.event_type).all() == [('post_deleted',)]
+        assert await redis_session.zscore(timeline_key, to_member(post_id))
+
+        async for async_db_session in session.get_async_db_session():
+            _ = await process_batch(async_db_session, redis_session, 100)
+
+        assert await redis_session.zscore(timeline_key, to_member(post_id)) is None
+
+    @pytest.mark.asyncio
+    async def test_events_without_enabled_handlers(
+            self,
+            test_app: AsyncClient,
+            db_session: Session,
+            redis_session: Redis
+    ):
+        self.add_author(db_session)
+
+        post_id = await self.create_blog_post(test_app)
+
+        refresh_token = await self.authorize_user(test_app, self.user)
+        headers = {'Authorization': f'Bearer {refresh_token}', }
+
+        username = self.author['username']
+        response = await test_app.post(
+            f'/api/v1/users/{username}/{post_id}/like',
+            headers=headers
+        )
+
+        # the events are recorded with the fan-out disabled too
+        assert response.status_code == 200
+        assert db_session.query(OutboxEvent.event_type).order_by(
+            OutboxEvent.id
+        ).all() == [('post_created',), ('post_liked',)]
+
+        async for async_db_session in session.get_async_db_session():
+            processed = await process_batch(async_db_session, redis_session, 100)
+
+        assert processed == 2
+        assert db_session.query(OutboxEvent).count() == 0
+
+    @pytest.mark.asyncio
+    async def test_stats_are_exported(
+            self,
+            test_app: AsyncClient,
+            redis_session: Redis,
+            metrics_headers: dict[str, str]
+    ):
+        await redis_session.hset('outbox:stats', 'processed', 3)
+
+        response = await test_app.get('/metrics', headers=metrics_headers)
+
+        assert 'outbox_processed_total 3.0' in response.text
+        assert 'outbox_last_lag_ms 0.0' in response.text
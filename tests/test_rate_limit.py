@@ -0,0 +1,94 @@
+import json
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy.orm import Session
+
+from app.core import settings
+from app.services.rate_limit import get_rate_limit_stats, RateLimiter
+from tests.utils import BaseTestCase
+
+
+class TestRateLimit(BaseTestCase):
+
+    @pytest.mark.asyncio
+    async def test_sign_in_endpoint_is_limited_per_ip(
+            self,
+            test_app: AsyncClient,
+            db_session: Session,
+            monkeypatch
+    ):
+        monkeypatch.setattr(settings, 'RATE_LIMIT_SIGN_IN', '2/60')
+        self.add_user(db_session, self.user)
+
+        headers = {'content-type': 'application/x-www-form-urlencoded', }
+        data = {
+            'username': self.user['username'],
+            'password': self.user['password']
+        }
+
+        responses = [
+            await test_app.post('/api/v1/auth/sign-in', headers=headers, data=data)
+            for _ in range(3)
+        ]
+
+        assert [i.status_code for i in responses] == [200, 200, 429]
+        assert int(responses[-1].headers['retry-after']) == 30
+
+    @pytest.mark.asyncio
+    async def test_availability_endpoint_is_limited_per_ip(
+            self,
+            test_app: AsyncClient,
+            monkeypatch
+    ):
+        monkeypatch.setattr(settings, 'RATE_LIMIT_AVAILABILITY', '2/60')
+
+        responses = [
+            await test_app.get(
+                '/api/v1/auth/availability',
+                params={'username': f'test_user_{i}'}
+            )
+            for i in range(3)
+        ]
+
+        assert [i.status_code for i in responses] == [200, 200, 429]
+
+    @pytest.mark.asyncio
+    async def test_create_endpoint_is_limited_per_user(
+            self,
+            test_app: AsyncClient,
+            monkeypatch
+    ):
+        monkeypatch.setattr(settings, 'RATE_LIMIT_CREATE_POST', '1/60')
+        new_user = {
+            'username': 'new_test_user',
+            'email': 'new_test_user@example.com',
+            'password': '1Password'
+        }
+
+        tokens = [
+            await self.register_user(test_app, user) for user in (self.user, new_user)
+        ]
+
+        status_codes = []
+        for refresh_token in (tokens[0], tokens[0], tokens[1]):
+            response = await test_app.post(
+                '/api/v1/posts/create',
+                headers={'Authorization': f'Bearer {refresh_token}', },
+                content=json.dumps({'content': 'qwerty'})
+            )
+            status_codes.append(response.status_code)
+
+        assert status_codes == [201, 429, 201]
+
+    @pytest.mark.asyncio
+    async def test_rate_limiter_fails_open(self):
+        class UnavailableRedis:
+            async def eval(self, *args, **kwargs):
+                raise ConnectionRefusedError()
+
+        failed_open = get_rate_limit_stats()['failed_open']
+
+        await RateLimiter('sign_in').hit(UnavailableRedis(), '127.0.0.1')
+
+        assert get_rate_limit_stats()['failed_open'] == failed_open + 1
@@ -0,0 +1,44 @@
+import pytest
+from sqlalchemy import text
+
+from app.core import settings
+from app.database import session
+
+
+class TestDatabaseSession:
+
+    def test_engine_is_shared_between_sessions(self):
+        first_session = next(session.get_db_session())
+        second_session = next(session.get_db_session())
+
+        assert first_session.get_bind() is second_session.get_bind()
+        assert first_session.get_bind() is session.get_engine()
+
+    def test_pool_stats_count_checkouts(self):
+        stats = session.get_db_pool_stats()
+
+        for db_session in session.get_db_session():
+            db_session.execute(text('SELECT 1'))
+
+        new_stats = session.get_db_pool_stats()
+
+        assert new_stats['checkouts'] == stats['checkouts'] + 1
+        assert new_stats['checkins'] == stats['checkins'] + 1
+        assert new_stats['checked_out'] == stats['checked_out']
+
+    @pytest.mark.asyncio
+    async def test_redis_pool_is_shared_between_sessions(self):
+        redis = await session.init_redis_pool()
+        try:
+            async for redis_session in session.get_redis_session():
+                assert redis_session is redis
+
+            await redis.ping()
+            stats = session.get_redis_pool_stats()
+
+            assert stats['maxsize'] == settings.REDIS_POOL_MAXSIZE
+            assert 1 <= stats['size'] <= stats['maxsize']
+        finally:
+            await session.close_redis_pool()
+
+        assert session.get_redis_pool_stats()['size'] == 0
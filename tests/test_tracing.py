@@ -0,0 +1,144 @@
+import json
+
+import pytest
+from httpx import AsyncClient
+
+from app.core import settings, tracing
+from app.core.tracing import TracingMiddleware
+from app.main import app
+from tests.utils import BaseTestCase
+
+
+class CollectingExporter:
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans: list[tracing.Span]) -> None:
+        self.spans.extend(spans)
+
+
+class TestTracing(BaseTestCase):
+
+    @pytest.fixture
+    def exporter(self, monkeypatch) -> CollectingExporter:
+        exporter = CollectingExporter()
+        monkeypatch.setattr(settings, 'TRACING_SAMPLE_RATE', 1.0)
+        monkeypatch.setattr(tracing, '_exporter', exporter)
+        return exporter
+
+    @pytest.mark.asyncio
+    async def test_request_spans(
+            self,
+            test_app: AsyncClient,
+            exporter: CollectingExporter
+    ):
+        refresh_token = await self.register_user(test_app, self.user)
+        headers = {'Authorization': f'Bearer {refresh_token}', }
+
+        async with AsyncClient(
+                app=TracingMiddleware(app),
+                base_url='http://test'
+        ) as client:
+            response = await client.get('/api/v1/home', headers=headers)
+
+        assert response.status_code == 200
+
+        spans = {span.name: span for span in exporter.spans}
+        root = spans['GET /api/v1/home']
+
+        assert root.parent_id is None
+        assert root.attributes['http.status_code'] == 200
+        assert spans['HomeService.home'].parent_id == root.span_id
+        assert 'sql' in spans
+        assert 'redis EVAL' in spans
+        assert {span.trace.trace_id for span in exporter.spans} == {
+            root.trace.trace_id
+        }
+
+    @pytest.mark.asyncio
+    async def test_traceparent(
+            self,
+            test_app: AsyncClient,
+            exporter: CollectingExporter,
+            monkeypatch
+    ):
+        monkeypatch.setattr(settings, 'TRACING_TRUST_TRACEPARENT', True)
+        trace_id, parent_id = 'a' * 32, 'b' * 16
+
+        async with AsyncClient(
+                app=TracingMiddleware(app),
+                base_url='http://test'
+        ) as client:
+            # the caller decides about the sampling
+            _ = await client.get(
+                '/api/v1/missing',
+                headers={'traceparent': f'00-{trace_id}-{parent_id}-00'}
+            )
+            assert exporter.spans == []
+
+            _ = await client.get(
+                '/api/v1/missing',
+                headers={'traceparent': f'00-{trace_id}-{parent_id}-01'}
+            )
+
+        [span] = exporter.spans
+
+        assert span.trace.trace_id == trace_id
+        assert span.parent_id == parent_id
+        assert span.name == 'GET unmatched'
+
+    @pytest.mark.asyncio
+    async def test_untrusted_traceparent(
+            self,
+            test_app: AsyncClient,
+            exporter: CollectingExporter,
+            monkeypatch
+    ):
+        monkeypatch.setattr(settings, 'TRACING_SAMPLE_RATE', 0.0)
+        trace_id, parent_id = 'a' * 32, 'b' * 16
+
+        async with AsyncClient(
+                app=TracingMiddleware(app),
+                base_url='http://test'
+        ) as client:
+            # the sample rate applies, whatever the caller asks for
+            _ = await client.get(
+                '/api/v1/missing',
+                headers={'traceparent': f'00-{trace_id}-{parent_id}-01'}
+            )
+
+        assert exporter.spans == []
+
+    @pytest.mark.parametrize(
+        'traceparent, expected',
+        [
+            (f'00-{"a" * 32}-{"b" * 16}-01', ('a' * 32, 'b' * 16, True)),
+            # the other flags are ignored
+            (f'00-{"a" * 32}-{"b" * 16}-03', ('a' * 32, 'b' * 16, True)),
+            (f'00-{"a" * 32}-{"b" * 16}-02', ('a' * 32, 'b' * 16, False)),
+            (f'00-{"x" * 32}-{"b" * 16}-01', None),
+            (f'00-{"a" * 32}-{"b" * 16}-0x', None),
+            (f'00-{"0" * 32}-{"b" * 16}-01', None),
+            (f'00-{"a" * 32}-{"0" * 16}-01', None),
+            (f'ff-{"a" * 32}-{"b" * 16}-01', None),
+            (f'00-{"a" * 31}-{"b" * 16}-01', None),
+        ]
+    )
+    def test_parse_traceparent(self, traceparent: str, expected):
+        assert tracing._parse_traceparent(traceparent) == expected
+
+    def test_file_exporter(self, exporter: CollectingExporter, tmp_path):
+        path = tmp_path / 'traces.ndjson'
+        file_exporter = tracing.FileExporter(str(path))
+
+        with tracing.start_trace('root'):
+            with tracing.start_span('child'):
+                pass
+
+        file_exporter.export(exporter.spans)
+        file_exporter.close()
+
+        lines = [json.loads(line) for line in path.read_text().splitlines()]
+
+        assert [line['name'] for line in lines] == ['child', 'root']
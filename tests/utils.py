@@ -1,4 +1,7 @@
 import json
+from contextlib import contextmanager
+from typing import Iterator
+
 import pytest
 from aioredis import Redis
 from httpx import AsyncClient
@@ -8,9 +11,22 @@ from sqlalchemy.orm import Session
 
 from app.database import session
 from app.database.base_class import Base
+from app.database.query_stats import QueryStats, track_queries
 from app.models import User
 
 
+@contextmanager
+def assert_max_queries(count: int) -> Iterator[QueryStats]:
+    with track_queries() as stats:
+        yield stats
+
+    statements = '\n'.join(stats.statements)
+    assert stats.count <= count, (
+        f'{stats.count} statements, expected at most {count}:\n{statements}'
+    )
+    assert not stats.repeated, f'repeated statements: {stats.repeated}'
+
+
 class BaseTestCase:
     user = {
         'username': 'test_user',